@@ -3,7 +3,7 @@ from decimal import Decimal
 import numpy as np
 import pytest
 
-from xutility import Cast
+from xutility import Cast, CastArray
 
 
 def test_cast_none():
@@ -60,3 +60,59 @@ def test_cast_int():
 
     assert Cast("1.234").to(int) == 1
     assert Cast("1.234").to(int, rounding="ROUND_UP") == 2
+
+
+def _scalar_to(values, to_type, precision, rounding):
+    return [Cast(v).to(to_type, precision, rounding) for v in values]
+
+
+def test_cast_array_matches_cast():
+    rng = np.random.default_rng(0)
+    values = [1.235, 1.225, 2.675, 0.125, -1.005, 0.5, -2.5, 0.29, 1e-7, 123456.785, 0.0, -0.0]
+    values += [round(v, int(p)) for v, p in zip(rng.uniform(-1000, 1000, 200), rng.integers(0, 6, 200))]
+    values += rng.uniform(-10, 10, 100).tolist()
+    for rounding in ["ROUND_05UP", "ROUND_UP", "ROUND_DOWN"]:
+        for precision in range(5):
+            for to_type in [float, np.float64, Decimal, str, int]:
+                expected = _scalar_to(values, to_type, precision, rounding)
+                for arr in [np.array(values), values]:
+                    assert CastArray(arr).to(to_type, precision, rounding).tolist() == expected
+        assert CastArray(values).set_precision(2, rounding).tolist() == [
+            Cast(v).set_precision(2, rounding) for v in values
+        ]
+    for tick in [Decimal("0.05"), 0.01, 1]:
+        for round_down in [False, True]:
+            expected = [Cast(v).quantize(tick, round_down) for v in values]
+            assert CastArray(values).quantize(tick, round_down).tolist() == expected
+    assert CastArray(values + [1e-5, 1e17]).precision.tolist() == [Cast(v).precision for v in values + [1e-5, 1e17]]
+
+
+def test_cast_array_none():
+    arr = CastArray([1.234, None, 2.5])
+    assert arr.mask.tolist() == [False, True, False]
+    assert arr.to(float, 2).tolist() == [1.23, None, 2.5]
+    assert arr.to(int).tolist() == [1, None, 2]
+    assert arr.to(Decimal, 1).tolist() == [Decimal("1.2"), None, Decimal("2.5")]
+    assert arr.to(str).tolist() == ["1.234", None, "2.5"]
+    assert arr.quantize(Decimal("0.1")).tolist() == [Decimal("1.3"), None, Decimal("2.5")]
+    assert arr.precision.tolist() == [3, None, 1]
+    with pytest.raises(ValueError):
+        CastArray([1.0, None], allow_none=False)
+
+
+def test_cast_array_int_and_mixed():
+    ints = [3, -7, 0, 2**40]
+    for arr in [np.array(ints), ints]:
+        for to_type in [float, int, Decimal, str]:
+            for precision in [None, 0, 2]:
+                assert CastArray(arr).to(to_type, precision).tolist() == _scalar_to(
+                    ints, to_type, precision, "ROUND_05UP"
+                )
+        assert CastArray(arr).precision.tolist() == [0, 0, 0, 0]
+    mixed = ["1.235", Decimal("2.5"), 3, 4.5, None]
+    assert CastArray(mixed).to(Decimal, 2).tolist() == _scalar_to(mixed, Decimal, 2, "ROUND_05UP")
+    assert CastArray(mixed).to(float).tolist() == [1.235, 2.5, 3.0, 4.5, None]
+    with pytest.raises(TypeError):
+        CastArray([1.0, [2.0]])
+    with pytest.raises(TypeError):
+        CastArray(np.array([1.0], dtype=np.float32))
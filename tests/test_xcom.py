@@ -0,0 +1,987 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import socket
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import orjson
+import pytest
+
+from xutility import (
+    XComAdmissionPolicy,
+    XComCachePolicy,
+    XComCodec,
+    XComHistogram,
+    XComKACli,
+    XComMultiCli,
+    XComNumpyCodec,
+    XComRaw,
+    XComRecorder,
+    XComStreamError,
+    XComSvr,
+    XComSyncCli,
+    XComTCli,
+    XComTransportOptions,
+)
+from xutility.xcom import bench, replay
+from xutility.xcom.capture import XCOM_RECEIVED, XCOM_SENT, read_capture
+from xutility.xcom.transport import (
+    XComStreamConnection,
+    _shm_client_handshake,
+    _shm_server_handshake,
+    _ShmRing,
+    run_event_loop,
+)
+
+
+async def echo(req):
+    return {"ack": req["msg"]}
+
+
+async def slow_echo(req):
+    await asyncio.sleep(req["sleep"])
+    return {"ack": req["msg"]}
+
+
+def blocking_sum(req):
+    time.sleep(req.get("sleep", 0))
+    return {"sum": sum(range(req["n"])), "pid": os.getpid()}
+
+
+@contextlib.asynccontextmanager
+async def serving(svr: XComSvr, unix_sock: str):
+    task = asyncio.create_task(svr.run())
+    while not os.path.exists(unix_sock):
+        await asyncio.sleep(0.01)
+    try:
+        yield svr
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+@pytest.fixture
+def unix_sock(tmp_path):
+    return str(tmp_path / "xcom.sock")
+
+
+@pytest.mark.asyncio
+async def test_transient_req(unix_sock):
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock, keep_alive=False)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo")
+        rsp, err, ts = await cli.req({"msg": 1})
+        assert (rsp, err) == ({"ack": 1}, None)
+        assert ts is not None
+
+        rsp, err, _ = await cli.req({"msg": 1}, req_type="missing")
+        assert rsp is None and "not found" in err
+
+
+@pytest.mark.asyncio
+async def test_pooled_req(unix_sock):
+    svr = XComSvr({"echo": echo, "slow_echo": slow_echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=2)
+        results = await asyncio.gather(*[cli.req({"msg": i}) for i in range(20)])
+        assert [rsp for rsp, _, _ in results] == [{"ack": i} for i in range(20)]
+        assert 0 < len(cli._pool) <= 2
+
+        rsp, err, ts = await cli.req({"msg": 0, "sleep": 0.3}, req_type="slow_echo", timeout=0.1)
+        assert (rsp, err, ts) == (None, "Request timeout.", None)
+        await cli.close()
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_correlated_req(unix_sock):
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        received = []
+
+        async def on_message(rsp):
+            received.append(rsp)
+
+        cli = XComKACli("echo", unix_sock=unix_sock, reconnect_wait=0.05)
+        cli.register_msg_callback(on_message)
+        task = asyncio.create_task(cli.run())
+        while cli._ws is None:
+            await asyncio.sleep(0.01)
+
+        assert await cli.send({"msg": 0}) is None
+        futures = [await cli.send_req({"msg": i}) for i in range(1, 4)]
+        assert [rsp for rsp, _, _ in await asyncio.gather(*futures)] == [{"ack": i} for i in range(1, 4)]
+        assert (await cli.req({"msg": 4}))[0] == {"ack": 4}
+        assert received == [{"ack": 0}]
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_server(unix_sock):
+    svr = XComSvr({"slow_echo": slow_echo}, unix_sock=unix_sock, pipeline=8)
+    async with serving(svr, unix_sock):
+        received = []
+
+        async def on_message(rsp):
+            received.append(rsp["ack"])
+
+        unordered = XComKACli("slow_echo", unix_sock=unix_sock)
+        ordered = XComKACli("slow_echo", unix_sock=unix_sock, ordered=True)
+        tasks = []
+        for cli in (unordered, ordered):
+            cli.register_msg_callback(on_message)
+            tasks.append(asyncio.create_task(cli.run()))
+            while cli._ws is None:
+                await asyncio.sleep(0.01)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        futures = [await unordered.send_req({"msg": i, "sleep": 0.2}) for i in range(8)]
+        await asyncio.gather(*futures)
+        assert loop.time() - start < 0.2 * 4
+
+        for i, sleep in enumerate([0.2, 0.1, 0]):
+            await ordered.send({"msg": i, "sleep": sleep})
+        while len(received) < 3:
+            await asyncio.sleep(0.01)
+        assert received == [0, 1, 2]
+        for task in tasks:
+            task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_batching(unix_sock):
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        tcli = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=1, batch_size=4, batch_window=0.01)
+        results = await asyncio.gather(*[tcli.req({"msg": i}) for i in range(10)])
+        assert [rsp for rsp, _, _ in results] == [{"ack": i} for i in range(10)]
+        await tcli.close()
+
+        received = []
+
+        async def on_message(rsp):
+            received.append(rsp["ack"])
+
+        kacli = XComKACli("echo", unix_sock=unix_sock, batch_size=3, batch_window=0.01)
+        kacli.register_msg_callback(on_message)
+        task = asyncio.create_task(kacli.run())
+        while kacli._ws is None:
+            await asyncio.sleep(0.01)
+        for i in range(5):
+            assert await kacli.send({"msg": i}) is None
+        assert (await kacli.req({"msg": 5}))[0] == {"ack": 5}
+        assert received == [0, 1, 2, 3, 4]
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_batch(unix_sock):
+    running, peak = 0, 0
+
+    async def slow(req):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {"ack": req["msg"]}
+
+    svr = XComSvr({"slow": slow}, unix_sock=unix_sock, pipeline=2)
+    async with serving(svr, unix_sock):
+        tcli = XComTCli(unix_sock=unix_sock, req_type="slow", pool_size=1, batch_size=20, batch_window=0.05)
+        results = await asyncio.gather(*[tcli.req({"msg": i}, timeout=2) for i in range(20)])
+        assert [rsp for rsp, _, _ in results] == [{"ack": i} for i in range(20)]
+        # every envelope of the batch counts against the pipeline limit
+        assert peak == 2
+        await tcli.close()
+
+
+def test_numpy_codec():
+    codec = XComNumpyCodec()
+    a = np.arange(12, dtype=np.float64).reshape(3, 4)
+    raw_d = codec.decode(codec.encode({"ts": 1, "data": {"a": a, "l": [a[:, ::2], {"x": np.int32(1)}]}}))
+    assert raw_d["ts"] == 1 and raw_d["data"]["l"][1] == {"x": 1}
+    assert np.array_equal(raw_d["data"]["a"], a) and not raw_d["data"]["a"].flags.writeable
+    assert np.array_equal(raw_d["data"]["l"][0], a[:, ::2])
+
+    for array in (np.array(3.0), np.zeros((0, 2)), np.zeros((2, 0), dtype=np.int32), a.T, a[::-1, 1::2]):
+        decoded = codec.decode(codec.encode({"a": array}))["a"]
+        assert decoded.shape == array.shape and decoded.dtype == array.dtype and np.array_equal(decoded, array)
+
+
+@pytest.mark.asyncio
+async def test_codec_negotiation(unix_sock):
+    async def norm(req):
+        return {"norm": req["a"] / np.linalg.norm(req["a"])}
+
+    svr = XComSvr({"norm": norm}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="norm", pool_size=1, codec=XComNumpyCodec())
+        rsp, err, _ = await cli.req({"a": np.array([3.0, 4.0])})
+        assert err is None and isinstance(rsp["norm"], np.ndarray)
+        assert np.allclose(rsp["norm"], [0.6, 0.8])
+
+        rsp, err, _ = await XComTCli(unix_sock=unix_sock, req_type="norm").req({"a": [3.0, 4.0]})
+        assert err is None and rsp["norm"] == [0.6, 0.8]
+        await cli.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("keep_alive", [True, False])
+async def test_stream_transport(unix_sock, keep_alive):
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock, keep_alive=keep_alive, transport="stream")
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo", transport="stream")
+        assert (await cli.req({"msg": 1}))[:2] == ({"ack": 1}, None)
+        if not keep_alive:
+            return
+
+        pooled = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=2, transport="stream")
+        results = await asyncio.gather(*[pooled.req({"msg": i}) for i in range(10)])
+        assert [rsp for rsp, _, _ in results] == [{"ack": i} for i in range(10)]
+        await pooled.close()
+
+        kacli = XComKACli("echo", unix_sock=unix_sock, transport="stream")
+        task = asyncio.create_task(kacli.run())
+        while kacli._ws is None:
+            await asyncio.sleep(0.01)
+        assert (await kacli.req({"msg": 2}))[0] == {"ack": 2}
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_shm_transport(unix_sock):
+    async def mean(req):
+        return {"mean": float(req["a"].mean())}
+
+    svr = XComSvr({"echo": echo, "mean": mean}, unix_sock=unix_sock, transport="shm")
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=1, codec=XComNumpyCodec(), transport="shm")
+        results = await asyncio.gather(*[cli.req({"msg": i}) for i in range(100)])
+        assert [rsp for rsp, _, _ in results] == [{"ack": i} for i in range(100)]
+        assert type(cli._pool[0]._ws).__name__ == "XComShmConnection"
+
+        # larger than the ring, sent inline through the socket
+        a = np.ones(1024 * 1024)
+        rsp, err, _ = await cli.req({"a": a}, req_type="mean", timeout=5)
+        assert err is None and rsp == {"mean": 1.0}
+        await cli.close()
+
+        # plain stream client falls back
+        stream_cli = XComTCli(unix_sock=unix_sock, req_type="echo", transport="stream")
+        assert (await stream_cli.req({"msg": 1}))[0] == {"ack": 1}
+
+        # transient client skips the rings
+        created = set(_ShmRing._created)
+        transient_cli = XComTCli(unix_sock=unix_sock, req_type="echo", transport="shm")
+        assert (await transient_cli.req({"msg": 2}))[0] == {"ack": 2}
+        assert not _ShmRing._created - created
+
+        # segments not created as rings are never attached
+        foreign = shared_memory.SharedMemory(create=True, size=4096)
+        try:
+            conn = XComStreamConnection(*await asyncio.open_unix_connection(unix_sock))
+            await conn.send(orjson.dumps({"__xcom_shm__": [foreign.name, foreign.name]}))
+            assert orjson.loads(await conn.recv()) == {"__xcom_shm__": False}
+            await conn.send(orjson.dumps({"req_type": "echo", "ts": 0, "data": {"msg": 3}}))
+            assert orjson.loads(await conn.recv())["data"] == {"ack": 3}
+            await conn.close()
+        finally:
+            foreign.close()
+            foreign.unlink()
+
+
+@pytest.mark.asyncio
+async def test_shm_max_size(unix_sock):
+    options = XComTransportOptions(max_size=1024)
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock, transport="shm", transport_options=options)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=1, transport="shm", transport_options=options)
+        assert (await cli.req({"msg": 1}))[0] == {"ack": 1}
+        assert type(cli._pool[0]._ws).__name__ == "XComShmConnection"
+        # fits in the ring but not in max_size
+        _, err_msg, ts = await cli.req({"msg": "x" * 2048})
+        assert err_msg is not None and ts is None
+        await cli.close()
+
+
+@pytest.mark.asyncio
+async def test_shm_remote_declined(unix_sock):
+    async def handle(reader, writer):
+        conn = await _shm_server_handshake(XComStreamConnection(reader, writer), local=False)
+        served.append(type(conn).__name__)
+        await conn.close()
+
+    served = []
+    server = await asyncio.start_unix_server(handle, unix_sock)
+    try:
+        conn = await _shm_client_handshake(XComStreamConnection(*await asyncio.open_unix_connection(unix_sock)), 4096)
+        assert type(conn) is XComStreamConnection
+        await conn.close()
+        while not served:
+            await asyncio.sleep(0.01)
+        assert served == ["XComStreamConnection"]
+    finally:
+        server.close()
+
+
+@pytest.mark.asyncio
+async def test_workers(unix_sock):
+    async def pid(req):
+        return {"pid": os.getpid()}
+
+    svr = XComSvr({"pid": pid}, unix_sock=unix_sock, keep_alive=False, workers=2)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="pid")
+        worker_pids = {proc.pid for proc in svr._worker_procs}
+        for _ in range(10):
+            rsp, err, _ = await cli.req({}, timeout=2)
+            assert err is None and rsp["pid"] in worker_pids
+
+        # crashed worker is restarted
+        svr._worker_procs[0].kill()
+        for _ in range(30):
+            await asyncio.sleep(0.1)
+            if all(proc.is_alive() for proc in svr._worker_procs):
+                break
+        assert all(proc.is_alive() for proc in svr._worker_procs)
+        assert (await cli.req({}, timeout=2))[1] is None
+
+
+@pytest.mark.asyncio
+async def test_executor_policies(unix_sock):
+    svr = XComSvr(
+        {"echo": echo, "thread_sum": blocking_sum, "process_sum": blocking_sum, "inline_sum": blocking_sum},
+        unix_sock=unix_sock,
+        callback_policies={"thread_sum": "thread", "process_sum": "process"},
+        executor_workers={"thread": 2, "process": 1},
+        executor_queue_limits={"thread": 1},
+        pipeline=8,
+    )
+    with pytest.raises(TypeError):
+        svr.register_msg_callback("bad", echo, "thread")
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, pool_size=1)
+        rsp, err, _ = await cli.req({"n": 10}, req_type="inline_sum")
+        assert err is None and rsp == {"sum": 45, "pid": os.getpid()}
+        rsp, err, _ = await cli.req({"n": 10}, req_type="process_sum", timeout=5)
+        assert err is None and rsp["sum"] == 45 and rsp["pid"] != os.getpid()
+
+        # the loop keeps serving while the thread pool is busy, and the full pool rejects
+        slow = asyncio.ensure_future(cli.req({"n": 10, "sleep": 0.3}, req_type="thread_sum"))
+        await asyncio.sleep(0.05)
+        assert (await cli.req({"msg": 1}, req_type="echo"))[0] == {"ack": 1}
+        assert (await cli.req({"n": 10}, req_type="thread_sum"))[1] == "Executor of policy=thread is full."
+        assert (await slow)[0]["sum"] == 45
+        # a timed-out request holds its slot until its job leaves the pool
+        rsp, err, _ = await cli.req({"n": 10, "sleep": 0.3}, req_type="thread_sum", timeout=0.05)
+        assert err == "Request timeout."
+        await asyncio.sleep(0.05)
+        assert (await cli.req({"n": 10}, req_type="thread_sum"))[1] == "Executor of policy=thread is full."
+        await asyncio.sleep(0.3)
+        assert (await cli.req({"n": 10}, req_type="thread_sum"))[1] is None
+        await cli.close()
+
+
+@pytest.mark.asyncio
+async def test_publish_subscribe(unix_sock):
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        received = {"a": [], "b": [], "default": []}
+
+        async def on_a(data):
+            received["a"].append(data["v"])
+
+        async def on_b(data):
+            received["b"].append(data["v"])
+
+        async def on_message(data):
+            received["default"].append(data["v"])
+
+        clis, tasks = [], []
+        for codec in (None, XComNumpyCodec()):
+            cli = (
+                XComKACli("echo", unix_sock=unix_sock)
+                if codec is None
+                else XComKACli("echo", unix_sock=unix_sock, codec=codec)
+            )
+            cli.register_msg_callback(on_message)
+            tasks.append(asyncio.create_task(cli.run()))
+            while cli._ws is None:
+                await asyncio.sleep(0.01)
+            clis.append(cli)
+        assert await clis[0].subscribe("a", on_a) is None
+        assert await clis[1].subscribe("a", on_b) is None
+        assert await clis[1].subscribe("c") is None
+
+        assert svr.publish("a", {"v": np.arange(2)}) == 2
+        assert svr.publish("c", {"v": 1}) == 1
+        assert svr.publish("nobody", {"v": 1}) == 0
+        while len(received["a"]) + len(received["b"]) + len(received["default"]) < 3:
+            await asyncio.sleep(0.01)
+        assert received["a"] == [[0, 1]] and np.array_equal(received["b"][0], np.arange(2))
+        assert received["default"] == [1]
+
+        assert await clis[1].unsubscribe("a") is None
+        assert svr.publish("a", {"v": 2}) == 1
+
+        # subscriptions are dropped with the connection
+        tasks[0].cancel()
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if "a" not in svr._topics:
+                break
+        assert "a" not in svr._topics and svr.publish("c", {"v": 3}) == 1
+        tasks[1].cancel()
+
+
+class _StalledConnection:
+    def __init__(self):
+        self.sent = []
+        self.unblock = asyncio.Event()
+        self.closed = False
+
+    async def send(self, frame):
+        await self.unblock.wait()
+        self.sent.append(frame)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "policy, expected",
+    [("drop_oldest", [b"0", b"3", b"4"]), ("latest", [b"0", b"4"]), ("disconnect", [])],
+)
+async def test_slow_consumer_policies(unix_sock, policy, expected):
+    class DataCodec(XComCodec):
+        def encode(self, raw_d):
+            return str(raw_d["data"]).encode()
+
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock, subscriber_queue=2, slow_consumer_policy=policy)
+    ws = _StalledConnection()
+    await svr._dispatch({"req_type": "__subscribe__", "ts": 0, "data": {"topic": "t"}}, ws, DataCodec())
+    for i in range(5):
+        # the writer is stuck on the first message, the others are queued
+        assert svr.publish("t", i) == 1
+        await asyncio.sleep(0)
+    ws.unblock.set()
+    await asyncio.sleep(0.01)
+    assert ws.sent == expected
+    assert ws.closed == (policy == "disconnect")
+    svr._drop_subscriber(ws)
+
+
+@pytest.mark.asyncio
+async def test_send_queue(unix_sock):
+    received = []
+
+    async def on_message(rsp):
+        received.append(rsp["ack"])
+
+    # queued while the server is not up yet, sent once connected
+    cli = XComKACli("echo", unix_sock=unix_sock, reconnect_wait=0.05, send_queue=3, overflow="drop_oldest")
+    cli.register_msg_callback(on_message)
+    task = asyncio.create_task(cli.run())
+    for i in range(5):
+        assert await cli.send({"msg": i}) is None
+    assert (cli.send_queue_depth, cli.send_dropped) == (3, 2)
+
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        while len(received) < 3:
+            await asyncio.sleep(0.01)
+        assert received == [2, 3, 4] and cli.send_queue_depth == 0
+        assert (await cli.req({"msg": 5}))[0] == {"ack": 5}
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_send_queue_overflow():
+    cli = XComKACli("echo", unix_sock="unused", send_queue=2, overflow="drop_newest")
+    assert await cli.send({"msg": 0}) is None and await cli.send({"msg": 1}) is None
+    assert await cli.send({"msg": 2}) == "Send queue is full."
+
+    cli = XComKACli("echo", unix_sock="unused", send_queue=2, overflow="block")
+    assert await cli.send({"msg": 0}) is None and await cli.send({"msg": 1}) is None
+    assert await cli.send({"msg": 2}, timeout=0.05) == "Send timeout."
+
+    cli = XComKACli("echo", unix_sock="unused", send_queue=2, overflow="conflate")
+    for i in range(3):
+        assert await cli.send({"msg": i}, key="a") is None
+    assert await cli.send({"msg": 3}, key="b") is None
+    assert (cli.send_queue_depth, cli.send_dropped) == (2, 2)
+    entries = await cli._send_queue.peek(2)
+    assert [raw_req_d["data"]["msg"] for _, raw_req_d in entries] == [2, 3]
+
+
+def test_histogram():
+    hist = XComHistogram()
+    assert hist.percentile(50) == 0
+    for v in range(1, 10001):
+        hist.record(v)
+    assert (hist.count, hist.max) == (10000, 10000)
+    for q, expected in [(50, 5000), (99, 9900), (99.9, 9990), (100, 10000)]:
+        assert expected <= hist.percentile(q) <= expected * 1.016
+    assert hist.percentiles([50, 99.9]) == {"p50": hist.percentile(50), "p999": hist.percentile(99.9)}
+    hist.record(2**50)
+    assert hist.max == 2**50 and hist.percentile(100) <= 2**50
+
+
+@pytest.mark.asyncio
+async def test_stats(unix_sock):
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=1)
+        for i in range(10):
+            await cli.req({"msg": i})
+        await cli.req({}, req_type="missing")
+        assert cli.stats()["echo"]["rtt"]["count"] == 10 and cli.stats()["missing"]["errors"] == 1
+
+        rsp, err, _ = await cli.req({}, req_type="__stats__")
+        assert err is None and rsp["echo"] == svr.stats()["echo"]
+        assert {"decode", "callback", "encode", "send"} <= set(rsp["echo"])
+        assert rsp["echo"]["callback"]["count"] == 10 and rsp["__unknown__"]["errors"] == 1
+        assert rsp["echo"]["callback"]["p99"] <= rsp["echo"]["callback"]["max"]
+        await cli.close()
+
+
+def test_bench(tmp_path):
+    output, baseline = tmp_path / "bench.json", tmp_path / "baseline.json"
+    argv = ["--endpoints", "unix", "--modes", "keep-alive", "--payloads", "10", "--concurrency", "2"]
+    assert bench.main(argv + ["--duration", "0.2", "--warm-up", "0", "--output", str(output)]) == 0
+    report = orjson.loads(output.read_bytes())
+    (case,) = report["results"]
+    assert case["mode"] == "keep-alive" and case["requests"] > 0 and case["errors"] == 0
+    assert case["p50_us"] <= case["p99_us"] <= case["p999_us"] <= case["max_us"]
+
+    case["msgs_per_sec"] *= 2
+    baseline.write_bytes(orjson.dumps(report))
+    assert bench.main(argv + ["--duration", "0.2", "--warm-up", "0", "--baseline", str(baseline)]) == 1
+
+
+@pytest.mark.asyncio
+async def test_response_cache(unix_sock):
+    calls = []
+
+    async def lookup(req):
+        calls.append(req)
+        await asyncio.sleep(0.05)
+        return {"value": req["k"] * 2, "a": np.arange(req["k"])} if req.get("array") else {"value": req["k"] * 2}
+
+    svr = XComSvr(
+        {"lookup": lookup},
+        unix_sock=unix_sock,
+        pipeline=16,
+        cache_policies={"lookup": XComCachePolicy(ttl=0.3, max_entries=2)},
+    )
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="lookup", pool_size=1)
+        # identical concurrent requests share one callback run
+        results = await asyncio.gather(*[cli.req({"k": 1, "x": [1, 2]}) for _ in range(10)])
+        assert [rsp for rsp, _, _ in results] == [{"value": 2}] * 10 and len(calls) == 1
+        # canonical request bytes, key order does not matter
+        assert (await cli.req({"x": [1, 2], "k": 1}))[0] == {"value": 2} and len(calls) == 1
+        assert svr.stats()["lookup"]["cache_hits"] == 1 and svr.stats()["lookup"]["coalesced"] == 9
+
+        # LRU of 2 entries
+        for k in [2, 3, 1]:
+            await cli.req({"k": k, "x": [1, 2]})
+        assert len(calls) == 4 and svr.stats()["lookup"]["cache_entries"] == 2
+
+        await asyncio.sleep(0.3)
+        await cli.req({"k": 1, "x": [1, 2]})
+        assert len(calls) == 5
+
+        numpy_cli = XComTCli(unix_sock=unix_sock, req_type="lookup", pool_size=1, codec=XComNumpyCodec())
+        for _ in range(2):
+            rsp, err, _ = await numpy_cli.req({"k": 3, "array": True})
+            assert err is None and np.array_equal(rsp["a"], np.arange(3))
+        assert len(calls) == 6
+        await cli.close()
+        await numpy_cli.close()
+
+
+@pytest.mark.asyncio
+async def test_raw_pass_through(unix_sock):
+    async def relay(req):
+        return XComRaw(b'{"px":1.5,"qty":[1,2]}')
+
+    svr = XComSvr({"relay": relay, "echo": echo}, unix_sock=unix_sock)
+    async with serving(svr, unix_sock):
+        for codec in (None, XComNumpyCodec()):
+            cli = XComTCli(unix_sock=unix_sock, req_type="relay", **({"codec": codec} if codec else {}))
+            assert (await cli.req({}))[:2] == ({"px": 1.5, "qty": [1, 2]}, None)
+
+        kacli = XComKACli("echo", unix_sock=unix_sock)
+        task = asyncio.create_task(kacli.run())
+        while kacli._ws is None:
+            await asyncio.sleep(0.01)
+        assert (await kacli.req(XComRaw(b'{"msg":"raw"}')))[0] == {"ack": "raw"}
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_multi_endpoint_client(tmp_path):
+    def whoami(replica):
+        async def callback(req):
+            await asyncio.sleep(req.get("sleep", 0) + (1 if req.get("stall") == replica else 0))
+            return {"replica": replica}
+
+        return callback
+
+    socks = [str(tmp_path / f"xcom{i}.sock") for i in range(3)]
+    async with contextlib.AsyncExitStack() as stack:
+        # the third replica is down
+        for i, sock in enumerate(socks[:2]):
+            await stack.enter_async_context(serving(XComSvr({"whoami": whoami(i)}, unix_sock=sock, pipeline=8), sock))
+        cli = XComMultiCli(socks, req_type="whoami", health_interval=0.05, eject_after=1)
+        await cli.warm_up()
+        await asyncio.sleep(0.1)
+        replicas = {replica["endpoint"]: replica for replica in cli.replicas}
+        assert not replicas[socks[2]]["healthy"] and replicas[socks[0]]["healthy"]
+
+        # least outstanding spreads concurrent requests over the healthy replicas
+        results = await asyncio.gather(*[cli.req({"sleep": 0.05}, timeout=2) for _ in range(20)])
+        assert all(err is None for _, err, _ in results)
+        assert {rsp["replica"] for rsp, _, _ in results} == {0, 1}
+        await cli.close()
+
+        # without health checks, idempotent requests are retried on another replica
+        cli = XComMultiCli([socks[2], socks[0]], req_type="whoami", health_interval=0, eject_after=100)
+        for _ in range(5):
+            assert (await cli.req({}, idempotent=True))[:2] == ({"replica": 0}, None)
+        _, err, _ = await XComMultiCli([socks[2]], req_type="whoami", health_interval=0).req({}, idempotent=True)
+        assert "Connection failed" in err
+        await cli.close()
+
+        # a timed-out attempt leaves time to retry on another replica
+        cli = XComMultiCli(socks[:2], req_type="whoami", health_interval=0)
+        for _ in range(4):
+            rsp, err, _ = await cli.req({"stall": 0}, timeout=0.4, idempotent=True)
+            assert err is None and rsp == {"replica": 1}
+        await cli.close()
+
+
+@pytest.mark.asyncio
+async def test_deadline(unix_sock):
+    finished = []
+
+    async def slow(req):
+        await asyncio.sleep(req["sleep"])
+        finished.append(req["sleep"])
+        return {}
+
+    svr = XComSvr({"slow": slow, "echo": echo}, unix_sock=unix_sock)
+    raw_rsp_d = await svr._process({"req_type": "echo", "ts": 0, "data": {"msg": 1}, "deadline": 1})
+    assert raw_rsp_d["err_code"] == "deadline_exceeded" and raw_rsp_d["err_msg"] == "Deadline exceeded."
+    # the timeout counts from the receipt by the server, whatever the ts of the client
+    raw_req_d, _ = svr._decode_req(
+        orjson.dumps({"req_type": "echo", "ts": 0, "data": {"msg": 1}, "timeout_us": 100000})
+    )
+    assert (await svr._process(raw_req_d))["data"] == {"ack": 1}
+
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="slow")
+        assert (await cli.req({"sleep": 0.3}, timeout=0.1))[1] == "Request timeout."
+        await asyncio.sleep(0.3)
+        # cancelled by the server at the deadline
+        assert finished == [] and svr.stats()["slow"]["deadline_exceeded"] == 1
+        assert (await cli.req({"sleep": 0}, timeout=0.1))[1] is None and finished == [0]
+
+
+@pytest.mark.asyncio
+async def test_admission_control(unix_sock):
+    order = []
+
+    async def work(req):
+        order.append(req["msg"])
+        await asyncio.sleep(req.get("sleep", 0.05))
+        return {"ack": req["msg"]}
+
+    svr = XComSvr(
+        {"bulk": work, "low": work, "high": work},
+        unix_sock=unix_sock,
+        pipeline=16,
+        admission_policies={
+            "bulk": XComAdmissionPolicy(max_concurrency=1, max_pending=1),
+            "high": XComAdmissionPolicy(priority=10),
+        },
+    )
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, pool_size=1)
+        reqs = [asyncio.ensure_future(cli.req({"msg": i, "sleep": 0.2}, req_type="bulk")) for i in range(3)]
+        await asyncio.sleep(0.1)
+        assert {k: svr.admission()["bulk"][k] for k in ["running", "pending", "rejected"]} == {
+            "running": 1,
+            "pending": 1,
+            "rejected": 1,
+        }
+        results = await asyncio.gather(*reqs)
+        assert [err for _, err, _ in results].count("Server is overloaded for req_type=bulk.") == 1
+        assert [getattr(err, "err_code", None) for _, err, _ in results].count("overloaded") == 1
+        assert (await cli.req({}, req_type="__stats__"))[0]["bulk"]["overloaded"] == 1
+
+        # requests waiting for the server-wide slot are served by priority
+        order.clear()
+        svr.set_max_concurrency(1, 10)
+        reqs = [asyncio.ensure_future(cli.req({"msg": "low0"}, req_type="low"))]
+        await asyncio.sleep(0.02)
+        for req_type, msg in [("low", "low1"), ("low", "low2"), ("high", "high")]:
+            reqs.append(asyncio.ensure_future(cli.req({"msg": msg}, req_type=req_type)))
+        await asyncio.gather(*reqs)
+        assert order == ["low0", "high", "low1", "low2"]
+        assert svr.admission()["__all__"]["running"] == 0
+        await cli.close()
+
+
+@pytest.mark.asyncio
+async def test_streaming(unix_sock):
+    async def count(req):
+        for i in range(req["n"]):
+            if i == req.get("fail_at"):
+                raise ValueError("boom")
+            yield {"i": i}
+
+    svr = XComSvr({"count": count, "echo": echo}, unix_sock=unix_sock, keep_alive=True, pipeline=4)
+    async with serving(svr, unix_sock):
+        for cli in [XComTCli(unix_sock=unix_sock), XComTCli(unix_sock=unix_sock, pool_size=1)]:
+            assert [chunk["i"] async for chunk in cli.stream({"n": 5}, req_type="count")] == list(range(5))
+            with pytest.raises(XComStreamError):
+                async for chunk in cli.stream({"n": 5, "fail_at": 2}, req_type="count"):
+                    assert chunk["i"] < 2
+            # responses of other requests on the same connection are unaffected
+            assert (await cli.req({"msg": 1}, req_type="echo"))[0] == {"ack": 1}
+            # plain requests to a streaming callback get an error
+            assert (await cli.req({"n": 3}, req_type="count"))[1] == "Callback streams its response, use stream()."
+            assert (await cli.req({"msg": 2}, req_type="echo"))[0] == {"ack": 2}
+            await cli.close()
+
+        kacli = XComKACli("count", unix_sock=unix_sock)
+        kacli_task = asyncio.create_task(kacli.run())
+        try:
+            while kacli._ws is None:
+                await asyncio.sleep(0.01)
+            streams = [kacli.stream({"n": n}) for n in (3, 4)]
+            results = await asyncio.gather(*[asyncio.ensure_future(_collect(s)) for s in streams])
+            assert results == [[0, 1, 2], [0, 1, 2, 3]]
+            assert (await kacli.req({"n": 3}))[1] == "Callback streams its response, use stream()."
+        finally:
+            kacli_task.cancel()
+
+
+async def _collect(stream):
+    return [chunk["i"] async for chunk in stream]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("transport", ["ws", "stream"])
+async def test_transport_options(transport):
+    port = bench._free_port()
+    options = XComTransportOptions(max_size=1024, send_buffer=1 << 16, write_limit=1 << 12)
+    svr = XComSvr({"echo": echo}, host="127.0.0.1", port=port, transport=transport, transport_options=options)
+    task = asyncio.create_task(svr.run())
+    try:
+        cli = XComTCli(host="127.0.0.1", port=port, pool_size=1, transport=transport, transport_options=options)
+        for _ in range(100):
+            with contextlib.suppress(OSError):
+                await cli.warm_up()
+                break
+            await asyncio.sleep(0.01)
+        assert (await cli.req({"msg": 1}, req_type="echo"))[0] == {"ack": 1}
+        sock = cli._pool[0]._ws.transport.get_extra_info("socket")
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        # frames beyond max_size close the connection
+        _, err_msg, ts = await cli.req({"msg": "x" * 2048}, req_type="echo")
+        assert err_msg is not None and ts is None
+        await cli.close()
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+def test_run_event_loop():
+    async def main():
+        return 1
+
+    assert run_event_loop(main(), "asyncio") == 1
+    assert run_event_loop(main()) == 1
+
+
+@pytest.mark.asyncio
+async def test_capture_replay(unix_sock, tmp_path):
+    svr_recorder = XComRecorder(str(tmp_path / "svr.xcap"))
+    cli_recorder = XComRecorder(str(tmp_path / "cli.xcap"), directions=(XCOM_SENT,))
+    svr = XComSvr({"echo": echo}, unix_sock=unix_sock, pipeline=4, recorder=svr_recorder)
+    async with serving(svr, unix_sock):
+        cli = XComTCli(unix_sock=unix_sock, req_type="echo", pool_size=1, recorder=cli_recorder)
+        for i in range(5):
+            await cli.req({"msg": i})
+            await asyncio.sleep(0.01)
+        await cli.req({}, req_type="__ping__")
+        await cli.close()
+        svr_recorder.flush()
+        cli_recorder.close()
+
+        frames = list(read_capture(svr_recorder.path))
+        assert [direction for _, direction, _ in frames] == [XCOM_RECEIVED, XCOM_SENT] * 6
+        assert [ts for ts, _, _ in frames] == sorted(ts for ts, _, _ in frames)
+        assert [raw_b for _, _, raw_b in read_capture(cli_recorder.path)] == [
+            raw_b for _, direction, raw_b in frames if direction == XCOM_RECEIVED
+        ]
+
+        requests = replay.load_requests([cli_recorder.path])
+        assert [data for _, _, data, _ in requests] == [{"msg": i} for i in range(5)]
+        report = await replay.replay(requests, {"unix_sock": unix_sock}, speed=10)
+        assert report["requests"] == 5 and report["errors"] == 0
+        assert report["duration"] >= (requests[-1][0] - requests[0][0]) / 1e6 / 10
+        report = await replay.replay(requests, {"unix_sock": unix_sock}, speed=0, concurrency=2)
+        assert report["requests"] == 5 and report["errors"] == 0
+        assert report["req_types"]["echo"]["rtt"]["count"] == 5
+
+
+@pytest.mark.asyncio
+async def test_sync_client(unix_sock):
+    received = []
+
+    async def record(req):
+        received.append(req["msg"])
+
+    svr = XComSvr({"echo": echo, "record": record}, unix_sock=unix_sock, pipeline=16)
+    async with serving(svr, unix_sock):
+
+        def use_from_threads():
+            with XComSyncCli(unix_sock=unix_sock, req_type="echo", pool_size=2) as cli:
+                with concurrent.futures.ThreadPoolExecutor(8) as pool:
+                    results = list(pool.map(lambda i: cli.req({"msg": i})[0], range(50)))
+                futures = [cli.req_future({"msg": i}) for i in range(10)]
+                assert cli.send({"msg": "one-way"}, req_type="record") is None
+                assert cli.send_future({"msg": "one-way"}, req_type="record").result() is None
+                return results, [fut.result()[0] for fut in futures], cli.stats()
+
+        results, future_results, stats = await asyncio.to_thread(use_from_threads)
+        assert results == [{"ack": i} for i in range(50)]
+        assert future_results == [{"ack": i} for i in range(10)]
+        assert stats["echo"]["rtt"]["count"] == 60
+        while len(received) < 2:
+            await asyncio.sleep(0.01)
+        assert received == ["one-way", "one-way"]
+
+
+@pytest.mark.asyncio
+async def test_reconnect_replay(unix_sock):
+    received = []
+
+    async def record(req):
+        received.append(req["msg"])
+
+    cli = XComKACli("record", unix_sock=unix_sock, reconnect_wait=0.2, replay_buffer=2)
+    assert all(0.005 <= cli._reconnect_delay(0) <= 0.01 and 0.1 <= cli._reconnect_delay(10) <= 0.2 for _ in range(100))
+    # waits below the initial wait, down to none, are kept as given
+    assert XComKACli("record", unix_sock=unix_sock, reconnect_wait=0)._reconnect_delay(3) == 0
+    assert XComKACli("record", unix_sock=unix_sock, reconnect_wait=0.002)._reconnect_delay(0) <= 0.002
+    task = asyncio.create_task(cli.run())
+    try:
+        async with serving(XComSvr({"record": record}, unix_sock=unix_sock), unix_sock):
+            while not cli.connected:
+                await asyncio.sleep(0.01)
+            assert await cli.send({"msg": 0}) is None
+            while not received:
+                await asyncio.sleep(0.01)
+        os.remove(unix_sock)
+
+        # sent while the server is down
+        while cli.connected:
+            await asyncio.sleep(0.01)
+        for i in range(1, 4):
+            assert await cli.send({"msg": i}) is None
+        assert cli.replay_depth == 2
+        assert (await cli.req({"msg": "correlated"}))[1] is not None
+
+        async with serving(XComSvr({"record": record}, unix_sock=unix_sock), unix_sock):
+            while len(received) < 3:
+                await asyncio.sleep(0.01)
+            assert received == [0, 2, 3]
+            stats = cli.stats()["__connection__"]
+            assert stats["reconnects"] == 1 and stats["downtime"]["count"] == 1
+            assert stats["replayed"] == 2 and stats["replay_dropped"] == 1
+    finally:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_backoff(unix_sock):
+    # a peer accepting and closing right away must not cause a reconnect storm
+    server = await asyncio.start_unix_server(lambda reader, writer: writer.close(), path=unix_sock)
+    cli = XComKACli("echo", unix_sock=unix_sock, transport="stream", reconnect_wait=0.1)
+    task = asyncio.create_task(cli.run())
+    try:
+        await asyncio.sleep(1)
+        assert 0 < cli.stats()["__connection__"]["reconnects"] < 20
+    finally:
+        task.cancel()
+        server.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("serialize", [True, False])
+async def test_local_transport(serialize):
+    seen = []
+
+    async def keep(req):
+        seen.append(req)
+        return {"ack": req["msg"]}
+
+    async def count(req):
+        for i in range(req["n"]):
+            yield i
+
+    async def raw(req):
+        return XComRaw(b'{"px":1.5}')
+
+    options = XComTransportOptions(serialize=serialize)
+    kwargs = dict(unix_sock="svc", transport="local", transport_options=options)
+    cli = XComTCli(req_type="keep", **kwargs)
+    assert (await cli.req({"msg": 0}))[1].startswith("Connection failed with")
+
+    svr = XComSvr(
+        {"keep": keep, "count": count, "raw": raw, "cached": keep},
+        pipeline=4,
+        cache_policies={"cached": XComCachePolicy(ttl=10)},
+        **kwargs,
+    )
+    task = asyncio.create_task(svr.run())
+    await asyncio.sleep(0)
+    try:
+        req_d = {"msg": 1}
+        assert await cli.req(req_d) == ({"ack": 1}, None, pytest.approx(time.time() * 1e6, rel=1e-3))
+        assert (seen[-1] is req_d) is not serialize
+        # pre-encoded responses arrive decoded
+        assert (await cli.req({}, req_type="raw"))[:2] == ({"px": 1.5}, None)
+        for _ in range(2):
+            assert (await cli.req({"msg": "c"}, req_type="cached"))[:2] == ({"ack": "c"}, None)
+        assert (await cli.req(XComRaw(b'{"msg":"r"}')))[:2] == ({"ack": "r"}, None)
+        pooled = XComTCli(req_type="keep", pool_size=2, **kwargs)
+        results = await asyncio.gather(*[pooled.req({"msg": i}) for i in range(10)])
+        assert [rsp for rsp, _, _ in results] == [{"ack": i} for i in range(10)]
+        assert [i async for i in pooled.stream({"n": 3}, req_type="count")] == [0, 1, 2]
+
+        kacli = XComKACli("keep", **kwargs)
+        kacli_task = asyncio.create_task(kacli.run())
+        while not kacli.connected:
+            await asyncio.sleep(0.01)
+        assert (await kacli.req({"msg": 2}))[0] == {"ack": 2}
+        kacli_task.cancel()
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    # connections are closed with the server
+    assert (await pooled.req({"msg": 3}))[1] is not None
+    await pooled.close()
@@ -4,8 +4,26 @@ from .data_container import EasyDumpClass, OrderedEnum, StrEnum
 from .env import get_env
 from .exception import catch_it, catch_it_async
 from .logger import setup_logger
-from .numeric import Cast
-from .xcom import XComKACli, XComSvr, XComTCli
+from .numeric import Cast, CastArray
+from .xcom import (
+    XComAdmissionPolicy,
+    XComCachePolicy,
+    XComCodec,
+    XComErrMsg,
+    XComHistogram,
+    XComJsonCodec,
+    XComKACli,
+    XComMultiCli,
+    XComNumpyCodec,
+    XComRaw,
+    XComRecorder,
+    XComStats,
+    XComStreamError,
+    XComSvr,
+    XComSyncCli,
+    XComTCli,
+    XComTransportOptions,
+)
 
 __all__ = [
     "current_ms",
@@ -20,7 +38,22 @@ __all__ = [
     "catch_it_async",
     "setup_logger",
     "Cast",
+    "CastArray",
+    "XComAdmissionPolicy",
+    "XComCachePolicy",
+    "XComCodec",
+    "XComJsonCodec",
+    "XComNumpyCodec",
+    "XComRaw",
     "XComKACli",
     "XComSvr",
     "XComTCli",
+    "XComStreamError",
+    "XComErrMsg",
+    "XComMultiCli",
+    "XComHistogram",
+    "XComStats",
+    "XComTransportOptions",
+    "XComRecorder",
+    "XComSyncCli",
 ]
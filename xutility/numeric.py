@@ -1,5 +1,6 @@
+import contextlib
 import decimal
-from typing import Literal, Type
+from typing import Any, Iterable, Iterator, Literal, Sequence, Tuple, Type
 
 import numpy as np
 
@@ -83,3 +84,276 @@ class Cast:
                 return to_type(self.set_precision(precision, rounding))
         else:
             raise ValueError(f"Unsupported to_type {to_type}")
+
+
+_Rounding = Literal["ROUND_UP", "ROUND_DOWN", "ROUND_05UP"]
+_ToType = Type[float] | Type[np.float64] | Type[decimal.Decimal] | Type[int] | Type[str]
+
+
+class CastArray:
+    """Bulk counterpart of `Cast` over a NumPy array or a sequence, with the same results element by element
+
+    Float64 and integer inputs are rounded as arrays. Elements whose float result could differ from the decimal
+    rounding of `Cast` (near a tie or a rounding boundary, or beyond the exact range of float64) fall back to `Cast`,
+    as do inputs holding str, Decimal or mixed types. None elements are masked: numeric results are `np.ma.MaskedArray`,
+    Decimal and str results are object arrays with None.
+    """
+
+    _ATOL = 1e-13
+    _MAX_EXACT = 2.0**52
+
+    def __init__(
+        self,
+        values: np.ndarray | Sequence[decimal.Decimal | float | np.float64 | int | str | None],
+        allow_none: bool = True,
+    ) -> None:
+        if isinstance(values, np.ndarray) and values.dtype.kind in "iu" and values.dtype != np.uint64:
+            self._shape: tuple[int, ...] = values.shape
+            self._kind = "i"
+            self._values: np.ndarray = values.astype(np.int64).ravel()
+            self._mask: np.ndarray = np.zeros(self._values.size, dtype=bool)
+            return
+        if isinstance(values, np.ndarray) and values.dtype.kind == "f":
+            if values.dtype != np.float64:
+                raise TypeError(f"Unsupported input dtype {values.dtype}")
+            self._shape = values.shape
+            self._kind = "f"
+            self._values = values.ravel()
+            self._mask = np.zeros(self._values.size, dtype=bool)
+            return
+
+        objs = np.asarray(values, dtype=object) if isinstance(values, np.ndarray) else _object_array(values)
+        self._shape = objs.shape
+        objs = objs.ravel()
+        self._mask = np.fromiter((v is None for v in objs), dtype=bool, count=objs.size)
+        if self._mask.any() and not allow_none:
+            raise ValueError("Get None value but allow_none=False")
+        types = {type(v) for v in objs[~self._mask]}
+        for t in types:
+            if t not in [float, np.float64, decimal.Decimal, int, str]:
+                raise TypeError(f"Unsupported input type {t}")
+        if types <= {float, np.float64}:
+            self._kind = "f"
+            self._values = np.where(self._mask, 0.0, objs).astype(np.float64)
+        elif types == {int} and all(-(2**63) <= v < 2**63 for v in objs[~self._mask]):
+            self._kind = "i"
+            self._values = np.where(self._mask, 0, objs).astype(np.int64)
+        else:
+            self._kind = "o"
+            self._values = objs
+
+    def __len__(self) -> int:
+        return self._values.size
+
+    @property
+    def mask(self) -> np.ndarray:
+        """True where the input is None"""
+        return self._mask.reshape(self._shape)
+
+    def _numeric(self, data: np.ndarray) -> np.ma.MaskedArray:
+        return np.ma.MaskedArray(data, mask=self._mask.copy()).reshape(self._shape)
+
+    def _objects(self, items: Iterable[Any]) -> np.ndarray:
+        out = np.empty(self._values.size, dtype=object)
+        out[:] = list(items)
+        out[self._mask] = None
+        return out.reshape(self._shape)
+
+    def _scalars(self) -> Iterator[Tuple[int, Cast]]:
+        for i in np.flatnonzero(~self._mask).tolist():
+            v = self._values[i]
+            yield i, Cast(v.item() if isinstance(v, np.generic) and self._kind != "o" else v)
+
+    def _per_element(self, to_type: _ToType, precision: int | None, rounding: _Rounding) -> np.ndarray:
+        """Results of `Cast.to` element by element"""
+        results: list[Any] = [None] * self._values.size
+        for i, cast in self._scalars():
+            results[i] = cast.to(to_type, precision, rounding)
+        if to_type in [float, np.float64]:
+            return self._numeric(np.array([0.0 if v is None else v for v in results], dtype=np.float64))
+        elif to_type is int:
+            data = np.array([0 if v is None else v for v in results], dtype=object)
+            with contextlib.suppress(OverflowError):
+                data = data.astype(np.int64)
+            return self._numeric(data)
+        return self._objects(results)
+
+    def _round(self, precision: int, rounding: _Rounding) -> Tuple[np.ndarray, dict[int, decimal.Decimal]]:
+        """Float64 values scaled by 10**precision and rounded to integers, and the exact `Cast.set_precision` of the
+        elements whose float rounding could differ from it"""
+        values = self._values.astype(np.float64) if self._kind == "i" else self._values
+        scale = 10.0**precision
+        with np.errstate(invalid="ignore", over="ignore"):
+            scaled = values * scale
+            tol = np.abs(scaled) * self._ATOL
+            if rounding == "ROUND_05UP":
+                rounded = np.rint(scaled)
+                fraction = np.abs(scaled - np.trunc(scaled))
+                inexact = np.abs(fraction - 0.5) <= tol
+            else:
+                if rounding == "ROUND_UP":
+                    rounded = np.where(scaled >= 0, np.ceil(scaled), np.floor(scaled))
+                else:
+                    rounded = np.trunc(scaled)
+                nearest = np.rint(scaled)
+                # an integer product is exact only if the value is that many steps of 10**-precision
+                inexact = (np.abs(scaled - nearest) <= tol) & ((scaled != nearest) | (nearest / scale != values))
+            inexact |= ~np.isfinite(scaled) | (np.abs(scaled) >= self._MAX_EXACT)
+        if precision > 22:
+            # 10**precision is not exact in float64
+            inexact[:] = True
+        inexact &= ~self._mask
+        exact = {
+            i: Cast(values[i].item()).set_precision(precision, rounding) for i in np.flatnonzero(inexact).tolist()
+        }
+        return rounded, exact  # type: ignore[return-value]
+
+    def to(
+        self,
+        to_type: _ToType,
+        precision: int | None = None,
+        rounding: _Rounding = "ROUND_05UP",
+    ) -> np.ndarray:
+        """`Cast.to` of every element
+
+        Returns:
+            np.ndarray: `np.ma.MaskedArray` of float64 or int64 (object if beyond int64) for float, np.float64 and int,
+                object array of Decimal or str with None for masked elements otherwise
+        """
+        # sanity check
+        assert rounding in ["ROUND_UP", "ROUND_DOWN", "ROUND_05UP"], "Invalid `rounding`"
+        assert precision is None or precision >= 0, "Invalid `precision`"
+        if to_type not in [float, np.float64, decimal.Decimal, int, str]:
+            raise ValueError(f"Unsupported to_type {to_type}")
+        if self._kind == "o":
+            return self._per_element(to_type, precision, rounding)
+
+        if self._kind == "i":
+            if to_type is int:
+                return self._numeric(self._values.copy())
+            elif to_type in [float, np.float64]:
+                return self._numeric(self._values.astype(np.float64))
+            elif precision is None:
+                return self._objects(map(to_type, self._values.tolist()))
+            # coefficients beyond the 28 digits of the decimal context fail in `Cast`
+            elif precision > 8:
+                return self._per_element(to_type, precision, rounding)
+            strs = self._values.astype(str)
+            if precision > 0:
+                strs = np.char.add(strs, "." + "0" * precision)
+            return self._objects(strs.tolist() if to_type is str else map(decimal.Decimal, strs.tolist()))
+
+        # float64, int ignores `precision` as in `Cast.to`
+        if to_type is int:
+            precision = 0
+        elif precision is None:
+            if to_type in [float, np.float64]:
+                return self._numeric(self._values.copy())
+            return self._objects(to_type(str(v)) for v in self._values.tolist())
+
+        rounded, exact = self._round(precision, rounding)
+        if to_type is int:
+            data = rounded.astype(np.int64) if not exact else rounded.astype(object)
+            for i, v in exact.items():
+                data[i] = int(v)
+            if exact:
+                with contextlib.suppress(OverflowError):
+                    data = data.astype(np.int64)
+            else:
+                data[self._mask] = 0
+            return self._numeric(data)
+
+        with np.errstate(invalid="ignore"):
+            floats = rounded / 10.0**precision
+        if to_type in [float, np.float64]:
+            for i, v in exact.items():
+                floats[i] = float(v)
+            return self._numeric(floats)
+
+        floats[self._mask | ~np.isfinite(floats)] = 0
+        strs = np.char.mod(f"%.{precision}f", floats).astype(object)
+        if to_type is str:
+            # `str(Decimal)` switches to scientific notation below 1E-6
+            digits = np.floor(np.log10(np.maximum(np.abs(rounded), 1))) + 1
+            for i in np.flatnonzero((digits - 1 - precision < -6) & ~self._mask).tolist():
+                exact.setdefault(i, decimal.Decimal(strs[i]))
+            for i, v in exact.items():
+                strs[i] = str(v)
+            return self._objects(strs)
+        out = [decimal.Decimal(s) for s in strs]
+        for i, v in exact.items():
+            out[i] = v
+        return self._objects(out)
+
+    def set_precision(self, precision: int, rounding: _Rounding = "ROUND_05UP") -> np.ndarray:
+        """`Cast.set_precision` of every element, an object array of Decimal with None for masked elements"""
+        return self.to(decimal.Decimal, precision, rounding)
+
+    def quantize(self, tick: decimal.Decimal | float, round_down: bool = False) -> np.ndarray:
+        """`Cast.quantize` of every element, an object array of Decimal with None for masked elements"""
+        _tick = decimal.Decimal(str(tick))
+        if self._kind == "o":
+            results: list[Any] = [None] * self._values.size
+            for i, cast in self._scalars():
+                results[i] = cast.quantize(tick, round_down)
+            return self._objects(results)
+
+        values = self._values.astype(np.float64) if self._kind == "i" else self._values
+        with np.errstate(invalid="ignore", over="ignore", divide="ignore"):
+            ratio = values / float(_tick)
+            nearest = np.rint(ratio)
+            # multiples of the tick, and values near one, are decided by the exact decimal division
+            inexact = (np.abs(ratio - nearest) <= np.abs(ratio) * self._ATOL + self._ATOL) | ~np.isfinite(ratio)
+            inexact |= np.abs(ratio) >= self._MAX_EXACT
+            if self._kind == "i":
+                inexact |= np.abs(self._values) >= self._MAX_EXACT
+        inexact &= ~self._mask
+        steps = np.trunc(ratio) + (0 if round_down else 1)
+        steps[inexact | self._mask] = 0
+        out = [_tick * n for n in steps.astype(np.int64).tolist()]
+        for i in np.flatnonzero(inexact).tolist():
+            v = self._values[i].item()
+            out[i] = Cast(v).quantize(tick, round_down)  # type: ignore[assignment]
+        return self._objects(out)
+
+    @property
+    def precision(self) -> np.ma.MaskedArray:
+        """`Cast.precision` of every element"""
+        if self._kind == "i":
+            return self._numeric(np.zeros(self._values.size, dtype=np.int64))
+        out = np.zeros(self._values.size, dtype=np.int64)
+        if self._kind == "o":
+            for i, cast in self._scalars():
+                out[i] = cast.precision
+            return self._numeric(out)
+
+        values = self._values
+        # the shortest repr is in positional notation in this range
+        positional = (
+            ~self._mask & np.isfinite(values) & ((values == 0) | ((np.abs(values) >= 1e-4) & (np.abs(values) < 1e16)))
+        )
+        pending = np.flatnonzero(positional)
+        inexact = [np.flatnonzero(~positional & ~self._mask)]
+        for precision in range(18):
+            if pending.size == 0:
+                break
+            scale = 10.0**precision
+            scaled = values[pending] * scale
+            # beyond 2**50 the rounding error of the product may reach 0.5
+            out_of_range = np.abs(scaled) >= 2.0**50
+            inexact.append(pending[out_of_range])
+            pending, scaled = pending[~out_of_range], scaled[~out_of_range]
+            # the fewest decimals that round-trip are the decimals of the shortest repr
+            round_trip = np.rint(scaled) / scale == values[pending]
+            out[pending[round_trip]] = precision
+            pending = pending[~round_trip]
+        inexact.append(pending)
+        for i in np.concatenate(inexact).tolist():
+            out[i] = Cast(values[i].item()).precision
+        return self._numeric(out)
+
+
+def _object_array(values: Sequence[Any]) -> np.ndarray:
+    out = np.empty(len(values), dtype=object)
+    out[:] = list(values)
+    return out
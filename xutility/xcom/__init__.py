@@ -0,0 +1,29 @@
+from .admission import XComAdmissionPolicy
+from .cache import XComCachePolicy
+from .capture import XComRecorder
+from .codec import XComCodec, XComJsonCodec, XComNumpyCodec, XComRaw
+from .core import XComErrMsg, XComKACli, XComStreamError, XComSvr, XComTCli
+from .multi import XComMultiCli
+from .stats import XComHistogram, XComStats
+from .sync import XComSyncCli
+from .transport import XComTransportOptions
+
+__all__ = [
+    "XComAdmissionPolicy",
+    "XComCachePolicy",
+    "XComCodec",
+    "XComJsonCodec",
+    "XComNumpyCodec",
+    "XComRaw",
+    "XComKACli",
+    "XComSvr",
+    "XComTCli",
+    "XComStreamError",
+    "XComErrMsg",
+    "XComMultiCli",
+    "XComHistogram",
+    "XComStats",
+    "XComTransportOptions",
+    "XComRecorder",
+    "XComSyncCli",
+]
@@ -0,0 +1,85 @@
+import asyncio
+import heapq
+import itertools
+from typing import Any
+
+
+class XComAdmissionPolicy:
+    """Admission control of one req_type
+
+    Args:
+        max_concurrency (int, optional): max requests running at the same time, 0 for unlimited. Defaults to 0.
+        max_pending (int, optional): max requests waiting for a free slot, beyond which requests are rejected
+            right away as "overloaded". Defaults to 0, i.e. no waiting.
+        priority (int, optional): requests of higher priority get free slots of the server-wide limit first.
+            Defaults to 0.
+    """
+
+    def __init__(self, max_concurrency: int = 0, max_pending: int = 0, priority: int = 0):
+        assert max_concurrency >= 0, "max_concurrency must not be negative!"
+        assert max_pending >= 0, "max_pending must not be negative!"
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.priority = priority
+
+
+class _XComLimiter:
+    """Concurrency limit with a bounded queue of waiters, served by priority then arrival"""
+
+    def __init__(self, max_concurrency: int, max_pending: int):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.running: int = 0
+        self.pending: int = 0
+        self.rejected: int = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_pending": self.max_pending,
+            "running": self.running,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    async def acquire(self, priority: int = 0) -> bool:
+        """Take a slot, waiting in the queue if needed. Returns False if rejected."""
+        if self.max_concurrency == 0 or (self.running < self.max_concurrency and self.pending == 0):
+            self.running += 1
+            return True
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._seq), fut))
+        self.pending += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # the slot was handed over right before the cancellation
+                self.release()
+            else:
+                self.pending -= 1
+            raise
+        return True
+
+    def release(self):
+        self.running -= 1
+        self._wake_up()
+
+    def _wake_up(self):
+        """Hand free slots over to the waiters"""
+        while self._waiters and (self.max_concurrency == 0 or self.running < self.max_concurrency):
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self.pending -= 1
+                self.running += 1
+                fut.set_result(None)
+
+    def update(self, max_concurrency: int, max_pending: int):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._wake_up()
@@ -0,0 +1,275 @@
+"""Throughput and latency benchmark of xcom
+
+Starts an echo `XComSvr` in a separate process per (endpoint, transport) and drives it with `XComTCli` / `XComKACli`
+over the matrix endpoints x transports x modes x payload sizes x concurrency, for a fixed duration per case.
+Prints the results as JSON, and with `--baseline` compares them to a previous run.
+
+Usage:
+    python -m xutility.xcom.bench --endpoints unix,tcp --modes transient,keep-alive,pooled --payloads 100,10000 \\
+        --concurrency 1,32 --duration 2 --output bench.json
+    python -m xutility.xcom.bench ... --baseline bench.json --tolerance 0.1
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+from importlib import metadata
+from typing import Any, Literal
+
+import orjson
+
+from ..logger import setup_logger
+from .core import XComKACli, XComSvr, XComTCli
+from .stats import XComHistogram, monotonic_us
+from .transport import XComEventLoop, XComTransport, XComTransportOptions, run_event_loop
+
+BenchMode = Literal["transient", "keep-alive", "pooled"]
+BenchEndpoint = Literal["unix", "tcp"]
+
+
+async def _echo(req):
+    return req
+
+
+def _run_server(endpoint: dict[str, Any], transport: XComTransport, event_loop: XComEventLoop):
+    setup_logger(echo_level="ERROR")
+    options = XComTransportOptions(event_loop=event_loop)
+    XComSvr(msg_callbacks={"echo": _echo}, transport=transport, transport_options=options, **endpoint).serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(endpoint: dict[str, Any], timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if "unix_sock" in endpoint:
+            if os.path.exists(endpoint["unix_sock"]):
+                return
+        else:
+            try:
+                socket.create_connection((endpoint["host"], endpoint["port"]), timeout=0.1).close()
+                return
+            except OSError:
+                pass
+        time.sleep(0.01)
+    raise TimeoutError(f"Server at {endpoint} is not ready after {timeout} seconds")
+
+
+async def _drive(
+    endpoint: dict[str, Any],
+    transport: XComTransport,
+    mode: BenchMode,
+    payload: int,
+    concurrency: int,
+    duration: float,
+    warm_up: float,
+    pool_size: int,
+) -> dict[str, Any]:
+    """Run `concurrency` request loops for `warm_up` + `duration` seconds, measuring the last `duration` seconds"""
+    req_d = {"msg": "x" * payload}
+    hist = XComHistogram()
+    errors = 0
+    kacli_task = None
+    if mode == "keep-alive":
+        kacli = XComKACli("echo", transport=transport, **endpoint)
+        kacli_task = asyncio.create_task(kacli.run())
+        while not kacli.connected:
+            await asyncio.sleep(0.01)
+        cli: XComTCli | XComKACli = kacli
+    elif mode == "pooled":
+        cli = XComTCli(req_type="echo", pool_size=pool_size, transport=transport, **endpoint)
+        await cli.warm_up()
+    else:
+        cli = XComTCli(req_type="echo", transport=transport, **endpoint)
+
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + warm_up
+    stop_at = measure_from + duration
+
+    async def worker():
+        nonlocal errors
+        while (now := loop.time()) < stop_at:
+            start = monotonic_us()
+            _, err_msg, _ = await cli.req(req_d, timeout=5)
+            if now < measure_from:
+                continue
+            if err_msg is None:
+                hist.record(monotonic_us() - start)
+            else:
+                errors += 1
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    finally:
+        if kacli_task is not None:
+            kacli_task.cancel()
+        elif mode == "pooled":
+            await cli.close()  # type: ignore[union-attr]
+    return {
+        "requests": hist.count,
+        "errors": errors,
+        "msgs_per_sec": round(hist.count / duration, 1),
+        "mean_us": round(hist.total / hist.count, 1) if hist.count else 0,
+        **{f"{name}_us": value for name, value in hist.percentiles((50, 99, 99.9)).items()},
+        "max_us": hist.max,
+    }
+
+
+def run_matrix(
+    endpoints: list[BenchEndpoint],
+    transports: list[XComTransport],
+    modes: list[BenchMode],
+    payloads: list[int],
+    concurrency: list[int],
+    duration: float = 2,
+    warm_up: float = 0.2,
+    pool_size: int = 4,
+    event_loop: XComEventLoop = "auto",
+) -> dict[str, Any]:
+    """Run every case of the matrix and return {"meta": environment and settings, "results": [case]}"""
+    results = []
+    for endpoint_type, transport in itertools.product(endpoints, transports):
+        if endpoint_type == "unix":
+            endpoint: dict[str, Any] = {"unix_sock": os.path.join(tempfile.mkdtemp(), "bench.sock")}
+        else:
+            endpoint = {"host": "127.0.0.1", "port": _free_port()}
+        server = multiprocessing.get_context("spawn").Process(
+            target=_run_server, args=(endpoint, transport, event_loop), daemon=True
+        )
+        server.start()
+        try:
+            _wait_ready(endpoint)
+            for mode, payload, n_concurrent in itertools.product(modes, payloads, concurrency):
+                case = {
+                    "endpoint": endpoint_type,
+                    "transport": transport,
+                    "mode": mode,
+                    "payload": payload,
+                    "concurrency": n_concurrent,
+                }
+                result = run_event_loop(
+                    _drive(endpoint, transport, mode, payload, n_concurrent, duration, warm_up, pool_size), event_loop
+                )
+                results.append({**case, **result})
+                print(orjson.dumps(results[-1]).decode(), file=sys.stderr)
+        finally:
+            server.terminate()
+            server.join()
+    return {
+        "meta": {
+            "ts": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "xutility": _version("xutility"),
+            "websockets": _version("websockets"),
+            "orjson": _version("orjson"),
+            "uvloop": _version("uvloop") if event_loop != "asyncio" else None,
+            "duration": duration,
+            "warm_up": warm_up,
+            "pool_size": pool_size,
+            "event_loop": event_loop,
+        },
+        "results": results,
+    }
+
+
+def _version(package: str) -> str | None:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Cases of `report` whose throughput dropped or p99 latency grew by more than `tolerance` vs `baseline`"""
+    keys = ("endpoint", "transport", "mode", "payload", "concurrency")
+    baseline_cases = {tuple(case[k] for k in keys): case for case in baseline["results"]}
+    regressions = []
+    for case in report["results"]:
+        base = baseline_cases.get(tuple(case[k] for k in keys))
+        if base is None:
+            continue
+        name = "/".join(str(case[k]) for k in keys)
+        if case["msgs_per_sec"] < base["msgs_per_sec"] * (1 - tolerance):
+            regressions.append("{}: msgs_per_sec {} -> {}".format(name, base["msgs_per_sec"], case["msgs_per_sec"]))
+        if case["p99_us"] > base["p99_us"] * (1 + tolerance):
+            regressions.append("{}: p99_us {} -> {}".format(name, base["p99_us"], case["p99_us"]))
+    return regressions
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    def csv(cast):
+        return lambda s: [cast(x) for x in s.split(",") if x]
+
+    parser = argparse.ArgumentParser(prog="python -m xutility.xcom.bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", type=csv(str), default=["unix", "tcp"], help="unix,tcp")
+    parser.add_argument("--transports", type=csv(str), default=["ws"], help="ws,stream,shm")
+    parser.add_argument("--modes", type=csv(str), default=["transient", "keep-alive", "pooled"])
+    parser.add_argument("--payloads", type=csv(int), default=[100, 10000], help="payload sizes in bytes")
+    parser.add_argument("--concurrency", type=csv(int), default=[1, 32], help="concurrent request loops")
+    parser.add_argument("--duration", type=float, default=2, help="measured seconds per case")
+    parser.add_argument("--warm-up", type=float, default=0.2, help="unmeasured seconds per case")
+    parser.add_argument("--pool-size", type=int, default=4, help="connections of the pooled mode")
+    parser.add_argument(
+        "--event-loop", choices=["auto", "asyncio", "uvloop"], default="auto", help="uvloop if installed for auto"
+    )
+    parser.add_argument("--output", type=str, default="", help="write the JSON report to this file, default stdout")
+    parser.add_argument("--baseline", type=str, default="", help="JSON report of a previous run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression vs baseline")
+    args = parser.parse_args(argv)
+    for endpoint in args.endpoints:
+        if endpoint not in ["unix", "tcp"]:
+            parser.error(f"Unsupported endpoint {endpoint}")
+    for transport in args.transports:
+        if transport not in ["ws", "stream", "shm"]:
+            parser.error(f"Unsupported transport {transport}")
+    for mode in args.modes:
+        if mode not in ["transient", "keep-alive", "pooled"]:
+            parser.error(f"Unsupported mode {mode}")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    setup_logger(echo_level="ERROR")
+    report = run_matrix(
+        args.endpoints,
+        args.transports,
+        args.modes,
+        args.payloads,
+        args.concurrency,
+        args.duration,
+        args.warm_up,
+        args.pool_size,
+        args.event_loop,
+    )
+    report_b = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(report_b)
+    else:
+        print(report_b.decode())
+
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            regressions = compare(report, orjson.loads(f.read()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+import hashlib
+import time
+from typing import Any, Callable, Coroutine, Tuple
+
+import orjson
+
+from .codec import XComRaw
+
+
+class XComCachePolicy:
+    """Response cache of one req_type, for callbacks returning the same response for the same request data
+
+    Args:
+        ttl (float, optional): seconds a response is reused, 0 to only coalesce concurrent requests. Defaults to 1.
+        max_entries (int, optional): max cached responses, least recently used ones are evicted. Defaults to 1024.
+        max_bytes (int, optional): max total size of the cached responses, 0 for unlimited. Defaults to 0.
+        single_flight (bool, optional): identical requests arriving while the callback runs wait for its response
+            instead of running the callback again. Defaults to True.
+    """
+
+    def __init__(self, ttl: float = 1, max_entries: int = 1024, max_bytes: int = 0, single_flight: bool = True):
+        assert ttl >= 0, "ttl must not be negative!"
+        assert max_entries > 0, "max_entries must be positive!"
+        assert max_bytes >= 0, "max_bytes must not be negative!"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.single_flight = single_flight
+
+
+def encode_once(rsp_d: Any) -> Tuple[Any, int]:
+    """Encode a JSON serializable response once as `XComRaw`, which the codecs splice into every envelope
+    as is. Responses with NumPy arrays are kept as they are for the NumPy codec.
+
+    Returns:
+        Tuple[Any, int]: (response to put into envelopes, its approximate size in bytes)
+    """
+    try:
+        rsp_b = orjson.dumps(rsp_d)
+    except TypeError:
+        return rsp_d, len(orjson.dumps(rsp_d, option=orjson.OPT_SERIALIZE_NUMPY))
+    return XComRaw(rsp_b), len(rsp_b)
+
+
+class _XComResponseCache:
+    """LRU + TTL cache of encoded responses by hash of the canonical request data, with single-flight coalescing"""
+
+    def __init__(self, policy: XComCachePolicy):
+        self._policy = policy
+        # key -> (expires at, response, size)
+        self._entries: collections.OrderedDict[bytes, Tuple[float, Any, int]] = collections.OrderedDict()
+        self._n_bytes: int = 0
+        self._inflight: dict[bytes, asyncio.Future] = dict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(data: Any) -> bytes | None:
+        """Hash of the canonical request bytes, None if the request data cannot be canonicalized"""
+        try:
+            data_b = orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            return None
+        return hashlib.blake2b(data_b, digest_size=16).digest()
+
+    async def get_or_call(self, key: bytes, call: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
+        """Cached response of `key`, otherwise the response of `call()` (shared with identical concurrent requests)"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._evict(key)
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+
+        self.misses += 1
+        if self._policy.single_flight:
+            fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            rsp, size = encode_once(await call())
+        except BaseException as e:
+            if fut is not None:
+                # waiters get an error response instead of being cancelled along with this request
+                fut.set_exception(e if isinstance(e, Exception) else RuntimeError("Coalesced request was cancelled."))
+                # retrieved here in case nobody else waits for it
+                fut.exception()
+            raise
+        finally:
+            if fut is not None:
+                self._inflight.pop(key, None)
+        if fut is not None:
+            fut.set_result(rsp)
+        if self._policy.ttl > 0:
+            self._put(key, rsp, size)
+        return rsp
+
+    def _put(self, key: bytes, rsp: Any, size: int):
+        if self._policy.max_bytes and size > self._policy.max_bytes:
+            return
+        self._evict(key)
+        self._entries[key] = (time.monotonic() + self._policy.ttl, rsp, size)
+        self._n_bytes += size
+        while len(self._entries) > self._policy.max_entries or (
+            self._policy.max_bytes and self._n_bytes > self._policy.max_bytes
+        ):
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: bytes):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._n_bytes -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self._n_bytes = 0
@@ -0,0 +1,127 @@
+import os
+import struct
+import time
+from typing import Any, BinaryIO, Iterator, Tuple
+
+import orjson
+from loguru import logger
+
+from .transport import XComConnection
+
+# direction of a captured frame, relative to the process recording it
+XCOM_RECEIVED = 0
+XCOM_SENT = 1
+
+
+class XComRecorder:
+    """Append-only binary log of the frames of a server or client, for replay with `xutility.xcom.replay`
+
+    File layout: magic b"XCAP" | version (uint8), then per frame:
+    arrival ts (int64, epoch in microseconds) | direction (uint8) | frame length (uint32) | frame as on the wire
+
+    Args:
+        path (str): file to append to, created if missing
+        max_bytes (int, optional): stop recording once the file reaches this size, 0 for unlimited. Defaults to 0.
+        directions (Tuple[int, ...], optional): directions to record, e.g. `(XCOM_RECEIVED,)` for the requests
+            received by a server only. Defaults to both.
+    """
+
+    MAGIC = b"XCAP\x01"
+    _RECORD = struct.Struct("<qBI")
+
+    def __init__(self, path: str, max_bytes: int = 0, directions: Tuple[int, ...] = (XCOM_RECEIVED, XCOM_SENT)):
+        assert max_bytes >= 0, "max_bytes must not be negative!"
+        self.path = path
+        self._max_bytes = max_bytes
+        self._directions = frozenset(directions)
+        self._f: BinaryIO | None = None
+        self._n_bytes: int = 0
+        self.recorded: int = 0
+        self.skipped: int = 0
+
+    def _open(self) -> BinaryIO:
+        # opened on the first frame, so that forked workers never share the file of their supervisor
+        f = open(self.path, "ab")
+        if f.tell() == 0:
+            f.write(self.MAGIC)
+        self._n_bytes = f.tell()
+        return f
+
+    def record(self, direction: int, raw_b: bytes | str | dict[str, Any]):
+        if direction not in self._directions:
+            return
+        if isinstance(raw_b, str):
+            raw_b = raw_b.encode()
+        elif isinstance(raw_b, dict):
+            # unserialized envelope of the "local" transport
+            raw_b = orjson.dumps(raw_b, option=orjson.OPT_SERIALIZE_NUMPY)
+        size = self._RECORD.size + len(raw_b)
+        if self._max_bytes and self._n_bytes + size > self._max_bytes:
+            self.skipped += 1
+            return
+        if self._f is None:
+            self._f = self._open()
+        self._f.write(self._RECORD.pack(time.time_ns() // 1000, direction, len(raw_b)))
+        self._f.write(raw_b)
+        self._n_bytes += size
+        self.recorded += 1
+
+    def for_worker(self) -> "XComRecorder":
+        """A recorder of the same settings writing to "{path}.{pid}" of the calling process"""
+        return XComRecorder(f"{self.path}.{os.getpid()}", self._max_bytes, tuple(self._directions))
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def read_capture(path: str) -> Iterator[Tuple[int, int, bytes]]:
+    """(arrival ts in epoch microseconds, direction, frame) of every frame of a capture file, a truncated last frame is
+    ignored"""
+    record = XComRecorder._RECORD
+    with open(path, "rb") as f:
+        if f.read(len(XComRecorder.MAGIC)) != XComRecorder.MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while header := f.read(record.size):
+            if len(header) < record.size:
+                break
+            ts, direction, size = record.unpack(header)
+            raw_b = f.read(size)
+            if len(raw_b) < size:
+                logger.warning("Ignore truncated frame at the end of {}.".format(path))
+                break
+            yield ts, direction, raw_b
+
+
+class _XComRecordingConnection:
+    """Connection recording every frame it sends and receives, otherwise the same as the connection it wraps"""
+
+    def __init__(self, conn: XComConnection, recorder: XComRecorder):
+        self._conn = conn
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def send(self, raw_b: bytes | str):
+        self._recorder.record(XCOM_SENT, raw_b)
+        await self._conn.send(raw_b)
+
+    async def recv(self, decode: bool | None = None) -> bytes | str:
+        raw_b = await self._conn.recv(decode=decode)
+        self._recorder.record(XCOM_RECEIVED, raw_b)
+        return raw_b
+
+    async def close(self):
+        await self._conn.close()
+
+    async def __aenter__(self) -> "_XComRecordingConnection":
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        await self._conn.close()
@@ -0,0 +1,176 @@
+import math
+import struct
+from typing import Any
+
+import numpy as np
+import orjson
+
+XComRaw = orjson.Fragment
+"""Already serialized JSON bytes, e.g. `XComRaw(b'{"px": 1.5}')`, spliced as is into an envelope by the codecs.
+
+Usable as (part of) the request data of the clients and the response of callbacks, so that payloads already held as
+bytes are not decoded and encoded again. The bytes are not validated, invalid JSON breaks the envelope.
+"""
+
+
+class XComCodec:
+    """Encode an envelope into a frame and decode a frame back into an envelope
+
+    A binary codec starts every frame with its own `magic` so that the receiver can pick the matching codec,
+    see `decode_frame`.
+    """
+
+    magic: bytes = b""
+
+    def encode(self, raw_d: dict[str, Any]) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, raw_b: bytes) -> dict[str, Any]:
+        raise NotImplementedError
+
+
+class XComJsonCodec(XComCodec):
+    """The default codec, envelope as JSON. NumPy arrays are sent as (nested) lists."""
+
+    def encode(self, raw_d: dict[str, Any]) -> bytes:
+        return orjson.dumps(raw_d, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def decode(self, raw_b: bytes) -> dict[str, Any]:
+        return orjson.loads(raw_b)
+
+
+class XComNumpyCodec(XComCodec):
+    """Envelope as JSON header, NumPy arrays anywhere in the envelope as raw buffers
+
+    Frame layout:
+        magic (4 bytes) | header length (uint32) | header JSON | padding | array buffer | padding | array buffer ...
+
+    Decoded arrays are read-only views of the received frame (`np.frombuffer`), no copy is made. The dict key
+    `__xcom_ndarray__` is reserved: a dict of that single key in the envelope of a frame holding arrays is decoded as
+    an array.
+    """
+
+    magic: bytes = b"\x93XCN"
+    _PREFIX = struct.Struct("<4sI")
+    _ALIGNMENT = 64
+    _PLACEHOLDER = "__xcom_ndarray__"
+
+    def encode(self, raw_d: dict[str, Any]) -> bytes:
+        # (dtype, shape, contiguous bytes) of every array
+        arrays: list[tuple[str, tuple[int, ...], np.ndarray]] = []
+
+        def collect_array(obj: Any) -> Any:
+            if isinstance(obj, np.ndarray):
+                if obj.dtype.hasobject:
+                    raise TypeError("Unable to encode ndarray of dtype=object")
+                # `ascontiguousarray` promotes 0-d arrays to 1-d, hence the shape of the original
+                arrays.append((obj.dtype.str, obj.shape, np.ascontiguousarray(obj).reshape(-1).view(np.uint8)))
+                return {self._PLACEHOLDER: len(arrays) - 1}
+            elif isinstance(obj, np.generic):
+                return obj.item()
+            raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+        env_b = orjson.dumps(raw_d, default=collect_array)
+        if not arrays:
+            header_b = orjson.dumps({"env": orjson.Fragment(env_b)})
+            return self._PREFIX.pack(self.magic, len(header_b)) + header_b
+
+        # buffer offsets are relative to the aligned end of the header
+        array_metas = []
+        offset = 0
+        for dtype, shape, array_b in arrays:
+            array_metas.append((dtype, shape, offset))
+            offset = self._align(offset + array_b.nbytes)
+        header_b = orjson.dumps({"env": orjson.Fragment(env_b), "arrays": array_metas})
+        header_end = self._PREFIX.size + len(header_b)
+
+        parts: list[bytes | memoryview] = [self._PREFIX.pack(self.magic, len(header_b)), header_b]
+        parts.append(b"\x00" * (self._align(header_end) - header_end))
+        for (_, _, array_b), (_, _, offset) in zip(arrays, array_metas):
+            parts.append(array_b.data)
+            parts.append(b"\x00" * (self._align(offset + array_b.nbytes) - offset - array_b.nbytes))
+        return b"".join(parts)
+
+    def decode(self, raw_b: bytes) -> dict[str, Any]:
+        _, header_len = self._PREFIX.unpack_from(raw_b)
+        header_end = self._PREFIX.size + header_len
+        header = orjson.loads(memoryview(raw_b)[self._PREFIX.size : header_end])
+        if "arrays" not in header:
+            return header["env"]
+        data_start = self._align(header_end)
+        arrays = []
+        for dtype, shape, offset in header["arrays"]:
+            count = math.prod(shape)
+            if count == 0:
+                array = np.empty(shape, dtype=np.dtype(dtype))
+                array.flags.writeable = False
+            else:
+                array = np.frombuffer(raw_b, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+            arrays.append(array.reshape(shape))
+        return self._restore_arrays(header["env"], arrays)
+
+    @classmethod
+    def _align(cls, n: int) -> int:
+        return -(-n // cls._ALIGNMENT) * cls._ALIGNMENT
+
+    def _restore_arrays(self, obj: Any, arrays: list[np.ndarray]) -> Any:
+        if isinstance(obj, dict):
+            if len(obj) == 1 and self._PLACEHOLDER in obj:
+                return arrays[obj[self._PLACEHOLDER]]
+            return {k: self._restore_arrays(v, arrays) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [self._restore_arrays(v, arrays) for v in obj]
+        else:
+            return obj
+
+
+class _XComObjectCodec(XComCodec):
+    """No serialization, the envelope object itself is the frame. Only for the in-process "local" transport.
+
+    `XComRaw` in the envelope, e.g. cached responses, are decoded so that the receiver gets the same data as over a
+    socket.
+    """
+
+    def encode(self, raw_d: dict[str, Any]) -> Any:
+        return _decode_raw(raw_d)
+
+    def decode(self, raw_b: Any) -> dict[str, Any]:
+        return raw_b
+
+
+def _decode_raw(obj: Any) -> Any:
+    """`obj` with every `XComRaw` in it decoded, `obj` itself if it holds none"""
+    if isinstance(obj, XComRaw):
+        return orjson.loads(orjson.dumps(obj))
+    elif isinstance(obj, dict):
+        decoded: dict[Any, Any] | None = None
+        for k, v in obj.items():
+            new_v = _decode_raw(v)
+            if new_v is not v:
+                if decoded is None:
+                    decoded = dict(obj)
+                decoded[k] = new_v
+        return obj if decoded is None else decoded
+    elif isinstance(obj, (list, tuple)):
+        items = [_decode_raw(v) for v in obj]
+        if all(new_v is v for new_v, v in zip(items, obj)):
+            return obj
+        return items if isinstance(obj, list) else tuple(items)
+    return obj
+
+
+JSON_CODEC = XComJsonCodec()
+NUMPY_CODEC = XComNumpyCodec()
+OBJECT_CODEC = _XComObjectCodec()
+_BINARY_CODECS: dict[bytes, XComCodec] = {NUMPY_CODEC.magic: NUMPY_CODEC}
+
+
+def codec_of_frame(raw_b: bytes) -> XComCodec:
+    if isinstance(raw_b, dict):
+        return OBJECT_CODEC
+    return _BINARY_CODECS.get(bytes(raw_b[:4]), JSON_CODEC)
+
+
+def decode_frame(raw_b: bytes) -> dict[str, Any]:
+    """Decode a frame of any known codec"""
+    return codec_of_frame(raw_b).decode(raw_b)
@@ -0,0 +1,2019 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import inspect
+import itertools
+import multiprocessing
+import random
+import socket
+import time
+import traceback
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Iterable, Literal, Tuple
+
+import websockets
+from loguru import logger
+
+from .admission import XComAdmissionPolicy, _XComLimiter
+from .cache import XComCachePolicy, _XComResponseCache
+from .capture import XComRecorder, _XComRecordingConnection
+from .codec import JSON_CODEC, OBJECT_CODEC, XComCodec, XComRaw, codec_of_frame, decode_frame
+from .stats import XComStats, monotonic_us
+from .transport import (
+    XCOM_TRANSPORTS,
+    XComConnection,
+    XComConnectionClosed,
+    XComTransport,
+    XComTransportOptions,
+    bind_unix_socket,
+    open_connection,
+    run_event_loop,
+    start_server,
+)
+
+XComCallbackPolicy = Literal["inline", "thread", "process"]
+XComSlowConsumerPolicy = Literal["drop_oldest", "latest", "disconnect"]
+XComOverflowPolicy = Literal["block", "drop_newest", "drop_oldest", "conflate"]
+
+# reserved req_types handled by the server itself, data is {"topic": topic}
+_XCOM_SUBSCRIBE = "__subscribe__"
+_XCOM_UNSUBSCRIBE = "__unsubscribe__"
+# reserved req_type returning the stats of the serving process
+_XCOM_STATS = "__stats__"
+# reserved req_type answered with empty data, for health checks
+_XCOM_PING = "__ping__"
+_XCOM_RESERVED = (_XCOM_SUBSCRIBE, _XCOM_UNSUBSCRIBE, _XCOM_STATS, _XCOM_PING)
+# stats key of the connection metrics of a keep-alive client
+_XCOM_CONNECTION = "__connection__"
+
+
+class _XComRejected(Exception):
+    """A request refused by the server, the message is returned as `err_msg` together with `err_code`"""
+
+    def __init__(self, err_msg: str, err_code: str = "rejected"):
+        super().__init__(err_msg)
+        self.err_code = err_code
+
+
+class XComErrMsg(str):
+    """Error message of an unsuccessful response, a plain `str` plus the `err_code` of a request refused by the server
+    itself, e.g. "overloaded" or "deadline_exceeded", None for any other error"""
+
+    err_code: str | None
+
+    def __new__(cls, err_msg: str, err_code: str | None = None) -> "XComErrMsg":
+        self = super().__new__(cls, err_msg)
+        self.err_code = err_code
+        return self
+
+
+class XComStreamError(Exception):
+    """A streamed response failed, raised by the async iterators of `stream()` with the error message and the
+    `err_code` of the server, see `XComErrMsg`"""
+
+    def __init__(self, err_msg: str, err_code: str | None = None):
+        super().__init__(err_msg)
+        self.err_code = err_code
+
+
+# returned by streaming callbacks once all chunks are sent
+_XCOM_EOS = object()
+
+
+class XComBase:
+    # endpoint of the server, set by the servers and clients
+    _transport: XComTransport
+    _unix_sock: str | None
+    _host: str | None
+    _port: int | None
+    _transport_options: XComTransportOptions
+    _recorder: XComRecorder | None
+
+    def __init__(self, tag: str = "", verbose: bool = True, debug: bool = False):
+        self._tag = tag
+        self._verbose = verbose
+        self._debug = debug
+
+    @property
+    def _identifier(self) -> str:
+        return self.__class__.__name__ + (f"-{self._tag}" if self._tag else "")
+
+    async def _connect(self, transient: bool = False) -> XComConnection:
+        """Open a connection to the endpoint of a client, by its transport
+
+        Args:
+            transient (bool, optional): the connection carries a single request. "shm" then falls back to "stream",
+                setting up the rings would cost more than the request. Defaults to False.
+        """
+        transport: XComTransport = "stream" if transient and self._transport == "shm" else self._transport
+        conn = await open_connection(transport, self._unix_sock, self._host, self._port, self._transport_options)
+        if self._recorder is not None:
+            return _XComRecordingConnection(conn, self._recorder)  # type: ignore[return-value]
+        return conn
+
+
+def _iter_envelopes(raw_d: dict[str, Any]) -> Iterable[dict[str, Any]]:
+    """Single envelope or the envelopes carried by a batch envelope"""
+    return raw_d["batch"] if "batch" in raw_d else (raw_d,)
+
+
+def _single_rsp(raw_rsp_d: dict[str, Any]) -> dict[str, Any]:
+    """Response envelope of a plain request, a chunk or end of stream of a streaming callback is turned into an error"""
+    if "chunk" in raw_rsp_d or raw_rsp_d.get("eos"):
+        return {"ts": raw_rsp_d["ts"], "err_msg": "Callback streams its response, use stream()."}
+    return raw_rsp_d
+
+
+def _unpack_rsp(
+    raw_rsp_d: dict[str, Any],
+) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float]:
+    """Response envelope -> (rsp_data, error message, server ts)"""
+    if "data" in raw_rsp_d:
+        return raw_rsp_d["data"], None, raw_rsp_d["ts"]
+    else:
+        return None, XComErrMsg(raw_rsp_d["err_msg"], raw_rsp_d.get("err_code")), raw_rsp_d["ts"]
+
+
+class _XComPending:
+    """In-flight requests waiting for the response carrying the same `req_id`"""
+
+    def __init__(self) -> None:
+        self._last_req_id: int = 0
+        self._futures: dict[int, asyncio.Future] = dict()
+        self._streams: dict[int, asyncio.Queue] = dict()
+
+    def __len__(self) -> int:
+        return len(self._futures) + len(self._streams)
+
+    def create(self) -> Tuple[int, asyncio.Future]:
+        self._last_req_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._futures[self._last_req_id] = fut
+        return self._last_req_id, fut
+
+    def create_stream(self, max_chunks: int) -> Tuple[int, asyncio.Queue]:
+        """A bounded queue of the chunks and the final envelope of a streamed response"""
+        self._last_req_id += 1
+        queue: asyncio.Queue = asyncio.Queue(max_chunks)
+        self._streams[self._last_req_id] = queue
+        return self._last_req_id, queue
+
+    def discard(self, req_id: int):
+        self._futures.pop(req_id, None)
+        queue = self._streams.pop(req_id, None)
+        if queue is not None:
+            # unblock a reader waiting for room in the queue of an abandoned stream
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def resolve_stream(self, raw_rsp_d: dict[str, Any]) -> bool:
+        """Queue a chunk or the final envelope of a streamed response, waiting while the queue is full.
+        Returns False if nobody is waiting for this stream."""
+        queue = self._streams.get(raw_rsp_d.get("req_id"))  # type: ignore[arg-type]
+        if queue is None:
+            return False
+        if "chunk" not in raw_rsp_d:
+            del self._streams[raw_rsp_d["req_id"]]
+        await queue.put(raw_rsp_d)
+        return True
+
+    def resolve(self, raw_rsp_d: dict[str, Any]) -> bool:
+        """Returns False if nobody is waiting for this response"""
+        if "chunk" in raw_rsp_d:
+            return False
+        fut = self._futures.pop(raw_rsp_d.get("req_id"), None)  # type: ignore[arg-type]
+        if fut is None:
+            return False
+        if not fut.done():
+            fut.set_result(raw_rsp_d)
+        return True
+
+    def fail(self, req_id: int, err_msg: str):
+        fut = self._futures.pop(req_id, None)
+        if fut is not None and not fut.done():
+            fut.set_exception(ConnectionError(err_msg))
+
+    def fail_all(self, err_msg: str):
+        futures, self._futures = self._futures, dict()
+        for fut in futures.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError(err_msg))
+        streams, self._streams = self._streams, dict()
+        for queue in streams.values():
+            # the stream fails anyway, make room for the error
+            while queue.full():
+                queue.get_nowait()
+            queue.put_nowait(ConnectionError(err_msg))
+
+
+async def _iter_stream(queue: asyncio.Queue, deadline: float) -> AsyncIterator[Any]:
+    """Chunks of a streamed response until the end of stream, raises XComStreamError"""
+    while True:
+        try:
+            async with asyncio.timeout_at(deadline):
+                item = await queue.get()
+        except TimeoutError:
+            raise XComStreamError("Request timeout.")
+        if isinstance(item, Exception):
+            raise XComStreamError(str(item))
+        if "chunk" in item:
+            yield item["chunk"]
+        elif "err_msg" in item:
+            raise XComStreamError(item["err_msg"], item.get("err_code"))
+        else:
+            return
+
+
+class _XComBatcher:
+    """Gather request envelopes for up to `batch_window` seconds or `batch_size` envelopes,
+    then hand them over to `flush_callback` to be sent as one batch envelope"""
+
+    def __init__(
+        self,
+        flush_callback: Callable[[list[dict[str, Any]]], Coroutine[Any, Any, None]],
+        batch_size: int,
+        batch_window: float,
+    ):
+        assert batch_size > 1, "batch_size must be greater than 1!"
+        assert batch_window >= 0, "batch_window must not be negative!"
+        self._flush_callback = flush_callback
+        self._batch_size: int = batch_size
+        self._batch_window: float = batch_window
+        self._items: list[dict[str, Any]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+
+    def add(self, raw_req_d: dict[str, Any]):
+        self._items.append(raw_req_d)
+        if len(self._items) >= self._batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._batch_window, self.flush)
+
+    def flush(self):
+        """Flush in a separate task, so that a caller timing out cannot cancel a batch shared with other callers"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._items:
+            items, self._items = self._items, []
+            task = asyncio.create_task(self._flush_callback(items))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+
+class _XComSendQueue:
+    """Bounded queue of outbound request envelopes, drained by one writer task
+
+    Envelopes stay queued until `ack` after being sent, so that they survive a lost connection.
+    When the queue is full, `overflow` decides:
+        "block" - wait for a free slot until the timeout
+        "drop_newest" - refuse the new envelope
+        "drop_oldest" - drop the oldest queued envelope
+        "conflate" - replace the queued envelope of the same key, otherwise drop the oldest one
+    """
+
+    def __init__(self, max_size: int, overflow: XComOverflowPolicy):
+        assert max_size > 0, "max_size must be positive!"
+        assert overflow in ["block", "drop_newest", "drop_oldest", "conflate"]
+        self._max_size = max_size
+        self._overflow = overflow
+        self._items: collections.OrderedDict[Tuple[str, Any], dict[str, Any]] = collections.OrderedDict()
+        self._seq = itertools.count()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self.dropped: int = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def put(self, raw_req_d: dict[str, Any], key: Any, timeout: float) -> str | None:
+        if self._overflow == "conflate" and key is not None and ("key", key) in self._items:
+            self._items[("key", key)] = raw_req_d
+            self.dropped += 1
+            return None
+        while len(self._items) >= self._max_size:
+            if self._overflow == "block":
+                self._not_full.clear()
+                try:
+                    async with asyncio.timeout(timeout):
+                        await self._not_full.wait()
+                except TimeoutError:
+                    return f"Send timeout."
+            elif self._overflow == "drop_newest":
+                self.dropped += 1
+                return f"Send queue is full."
+            else:
+                self._items.popitem(last=False)
+                self.dropped += 1
+        if self._overflow == "conflate" and key is not None:
+            self._items[("key", key)] = raw_req_d
+        else:
+            self._items[("seq", next(self._seq))] = raw_req_d
+        self._not_empty.set()
+        return None
+
+    async def peek(self, n: int) -> list[Tuple[Tuple[str, Any], dict[str, Any]]]:
+        """Wait for and return up to `n` oldest (key, envelope) without removing them"""
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return list(itertools.islice(self._items.items(), n))
+
+    def ack(self, entries: list[Tuple[Tuple[str, Any], dict[str, Any]]]):
+        """Remove sent envelopes, unless replaced by conflation in the meantime"""
+        for key, raw_req_d in entries:
+            if self._items.get(key) is raw_req_d:
+                del self._items[key]
+        if len(self._items) < self._max_size:
+            self._not_full.set()
+
+
+def _batch_envelope(items: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "ts": int(time.time() * 1000000),
+        "batch": items,
+    }
+
+
+class _XComMuxConn:
+    """A persistent connection carrying many concurrent requests, matched to responses by `req_id`"""
+
+    def __init__(
+        self,
+        ws: XComConnection,
+        codec: XComCodec = JSON_CODEC,
+        batch_size: int = 0,
+        batch_window: float = 0,
+    ):
+        self._ws = ws
+        self._codec = codec
+        self._pending = _XComPending()
+        self._batcher = _XComBatcher(self._send_batch, batch_size, batch_window) if batch_size > 0 else None
+        self._reader = asyncio.create_task(self._read_loop())
+
+    @property
+    def closed(self) -> bool:
+        return self._reader.done()
+
+    @property
+    def n_pending(self) -> int:
+        return len(self._pending)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                for raw_rsp_d in _iter_envelopes(decode_frame(await self._ws.recv(decode=False))):
+                    if await self._pending.resolve_stream(raw_rsp_d):
+                        continue
+                    if not self._pending.resolve(raw_rsp_d) and "req_id" in raw_rsp_d:
+                        logger.debug("Discard uncorrelated response {}".format(raw_rsp_d))
+        except Exception as e:
+            self._pending.fail_all(
+                "Connection lost. Error type: {}. Error msg: {}.".format(e.__class__.__name__, str(e))
+            )
+
+    async def req(self, raw_req_d: dict[str, Any], codec: XComCodec | None = None) -> dict[str, Any]:
+        """Caller is responsible for the timeout. Raises ConnectionError if the connection is lost.
+
+        `codec` overrides the codec of the connection, except for batched requests."""
+        req_id, fut = self._pending.create()
+        raw_req_d["req_id"] = req_id
+        try:
+            if self._batcher is not None:
+                self._batcher.add(raw_req_d)
+            else:
+                await self._ws.send((codec or self._codec).encode(raw_req_d))
+            return await fut
+        finally:
+            self._pending.discard(req_id)
+
+    async def send(self, raw_req_d: dict[str, Any], codec: XComCodec | None = None):
+        """One-way request without `req_id`, the read loop discards its response"""
+        await self._ws.send((codec or self._codec).encode(raw_req_d))
+
+    async def stream(
+        self, raw_req_d: dict[str, Any], deadline: float, max_chunks: int, codec: XComCodec | None = None
+    ) -> AsyncIterator[Any]:
+        """Chunks of the streamed response, the connection read loop waits while `max_chunks` are not consumed"""
+        req_id, queue = self._pending.create_stream(max_chunks)
+        raw_req_d["req_id"] = req_id
+        try:
+            await self._ws.send((codec or self._codec).encode(raw_req_d))
+            async for chunk in _iter_stream(queue, deadline):
+                yield chunk
+        finally:
+            self._pending.discard(req_id)
+
+    async def _send_batch(self, items: list[dict[str, Any]]):
+        try:
+            await self._ws.send(self._codec.encode(_batch_envelope(items)))
+        except Exception as e:
+            for raw_req_d in items:
+                self._pending.fail(
+                    raw_req_d["req_id"],
+                    "Send failed. Error type {}. Error msg {}.".format(e.__class__.__name__, str(e)),
+                )
+
+    async def close(self):
+        self._reader.cancel()
+        await self._ws.close()
+
+
+class _XComSubscriber:
+    """Published frames queued for one subscribed connection, written by its own task
+
+    The queue is bounded by `max_queue`. When it is full, `policy` decides:
+        "drop_oldest" - drop the oldest queued frame
+        "latest" - keep only the latest frame per (topic, key), then drop the oldest
+        "disconnect" - close the connection
+    """
+
+    def __init__(self, ws: XComConnection, codec: XComCodec, max_queue: int, policy: XComSlowConsumerPolicy):
+        self.ws = ws
+        self.codec = codec
+        self.topics: set[str] = set()
+        self.dropped: int = 0
+        self._max_queue = max_queue
+        self._policy = policy
+        self._queue: collections.OrderedDict[Any, bytes] = collections.OrderedDict()
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._closing: asyncio.Task | None = None
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def put(self, key: Any, frame: bytes):
+        if self._policy == "latest" and key in self._queue:
+            # conflate in place, the value keeps its position in the queue
+            self._queue[key] = frame
+            self.dropped += 1
+            return
+        if len(self._queue) >= self._max_queue:
+            if self._policy == "disconnect":
+                if self._closing is None:
+                    logger.warning("Disconnect slow subscriber with {} queued message(s).".format(len(self._queue)))
+                    self.close()
+                    self._closing = asyncio.create_task(self.ws.close())
+                return
+            self._queue.popitem(last=False)
+            self.dropped += 1
+        self._queue[key if self._policy == "latest" else next(self._seq)] = frame
+        self._ready.set()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    _, frame = self._queue.popitem(last=False)
+                    await self.ws.send(frame)
+        except (websockets.exceptions.ConnectionClosed, XComConnectionClosed):
+            pass
+        except Exception as e:
+            logger.error(
+                "Failed to send published message. Error type {}. Error msg {}.".format(e.__class__.__name__, str(e))
+            )
+
+    def close(self):
+        self._writer.cancel()
+        self._queue.clear()
+
+
+class XComSvr(XComBase):
+    """Interprocess Communication by Websocket - Server"""
+
+    def __init__(
+        self,
+        msg_callbacks: dict[str, Callable],
+        unix_sock: str | None = None,
+        host: str | None = None,
+        port: int | None = None,
+        keep_alive: bool = True,
+        restart_policy: Literal["always", "never"] = "always",
+        pipeline: int = 0,
+        codec: XComCodec | None = None,
+        codecs: dict[str, XComCodec] | None = None,
+        transport: XComTransport = "ws",
+        transport_options: XComTransportOptions | None = None,
+        recorder: XComRecorder | None = None,
+        workers: int = 1,
+        callback_policies: dict[str, XComCallbackPolicy] | None = None,
+        executor_workers: dict[XComCallbackPolicy, int] | None = None,
+        executor_queue_limits: dict[XComCallbackPolicy, int] | None = None,
+        subscriber_queue: int = 1024,
+        slow_consumer_policy: XComSlowConsumerPolicy = "drop_oldest",
+        cache_policies: dict[str, XComCachePolicy] | None = None,
+        admission_policies: dict[str, XComAdmissionPolicy] | None = None,
+        max_concurrency: int = 0,
+        max_pending: int = 0,
+        tag: str = "",
+        verbose: bool = True,
+        debug: bool = False,
+    ):
+        """_summary_
+
+        Args:
+            msg_callbacks (dict[str, Callable]): {req_type: async callback)
+            unix_sock (str | None, optional): _description_. Defaults to None.
+            host (str | None, optional): _description_. Defaults to None.
+            port (str | None, optional): _description_. Defaults to None.
+            keep_alive (bool, optional): Keep connection alive (for keep alive client) or close connection (for transient client). Defaults to True.
+            restart_policy (Literal[&quot;always&quot;, &quot;never&quot;], optional): _description_. Defaults to "always".
+            pipeline (int, optional): max number of requests from one keep-alive connection running concurrently, 0 for one at a time. Defaults to 0.
+            codec (XComCodec | None, optional): codec of responses, None to reply with the codec of the request. Defaults to None.
+            codecs (dict[str, XComCodec] | None, optional): {req_type: codec of responses}, overrides `codec`. Defaults to None.
+            transport (XComTransport, optional): "ws" for websockets, "stream" for length-prefixed frames over a plain socket, "shm" for shared-memory rings between local peers, "local" for clients in the same process and event loop, connecting by `unix_sock` as name. Defaults to "ws".
+            transport_options (XComTransportOptions | None, optional): socket, framing and event loop settings. Defaults to None, i.e. `XComTransportOptions()`.
+            recorder (XComRecorder | None, optional): capture every frame sent and received, see `XComRecorder`. Defaults to None.
+            workers (int, optional): number of forked worker processes serving the endpoint, 1 to serve in this process. Defaults to 1.
+            callback_policies (dict[str, XComCallbackPolicy] | None, optional): {req_type: where a plain function callback runs}, see `register_msg_callback`. Defaults to None.
+            executor_workers (dict[XComCallbackPolicy, int] | None, optional): {"thread"/"process": pool size}. Defaults to None, i.e. the default of `concurrent.futures`.
+            executor_queue_limits (dict[XComCallbackPolicy, int] | None, optional): {"thread"/"process": max requests running or queued in the pool}, beyond which requests are rejected. Defaults to None, i.e. unlimited.
+            subscriber_queue (int, optional): max published messages queued for one subscriber. Defaults to 1024.
+            slow_consumer_policy (XComSlowConsumerPolicy, optional): what to do when the queue of a subscriber is full, see `publish`. Defaults to "drop_oldest".
+            cache_policies (dict[str, XComCachePolicy] | None, optional): {req_type: response cache}, see `register_msg_callback`. Defaults to None.
+            admission_policies (dict[str, XComAdmissionPolicy] | None, optional): {req_type: concurrency limit, pending queue and priority}, see `set_admission_policy`. Defaults to None.
+            max_concurrency (int, optional): max requests running at the same time over all req_types, 0 for unlimited. Defaults to 0.
+            max_pending (int, optional): max requests waiting for `max_concurrency`, served by priority of their req_type. Defaults to 0.
+            debug (bool, optional): _description_. Defaults to False.
+        """
+        super().__init__(tag, verbose, debug)
+        self._use_unix_sock: bool
+        self._unix_sock: str | None
+        self._host: str | None
+        self._port: int | None
+
+        # sanity check
+        assert (unix_sock is not None) ^ ((host is not None) & (port is not None))
+        if unix_sock:
+            self._use_unix_sock = True
+            self._unix_sock = unix_sock
+            self._host = None
+            self._port = None
+        else:
+            self._use_unix_sock = False
+            self._unix_sock = None
+            self._host = host
+            self._port = port
+
+        self._keep_alive = keep_alive
+        assert restart_policy in ["always", "never"]
+        self._restart_policy: str = restart_policy
+        assert pipeline >= 0, "pipeline must not be negative!"
+        self._pipeline: int = pipeline
+        self._codec: XComCodec | None = codec
+        self._codecs: dict[str, XComCodec] = codecs or dict()
+        assert transport in XCOM_TRANSPORTS
+        self._transport: XComTransport = transport
+        self._transport_options: XComTransportOptions = transport_options or XComTransportOptions()
+        self._recorder: XComRecorder | None = recorder
+        assert workers >= 1, "workers must be positive!"
+        assert workers == 1 or transport != "local", "local transport cannot be served by workers!"
+        self._workers: int = workers
+        self._worker_procs: list[multiprocessing.process.BaseProcess] = []
+
+        self._executor_workers: dict[XComCallbackPolicy, int] = executor_workers or dict()
+        self._executor_queue_limits: dict[XComCallbackPolicy, int] = executor_queue_limits or dict()
+        self._executors: dict[XComCallbackPolicy, concurrent.futures.Executor] = dict()
+        self._executor_queued: dict[XComCallbackPolicy, int] = {"thread": 0, "process": 0}
+
+        assert subscriber_queue > 0, "subscriber_queue must be positive!"
+        self._subscriber_queue: int = subscriber_queue
+        assert slow_consumer_policy in ["drop_oldest", "latest", "disconnect"]
+        self._slow_consumer_policy: XComSlowConsumerPolicy = slow_consumer_policy
+        self._subscribers: dict[XComConnection, _XComSubscriber] = dict()
+        self._topics: dict[str, set[_XComSubscriber]] = dict()
+        self._stats = XComStats()
+
+        self._callbacks: dict[str, Callable] = dict()
+        self._policies: dict[str, XComCallbackPolicy] = dict()
+        self._caches: dict[str, _XComResponseCache] = dict()
+        self._admission_policies: dict[str, XComAdmissionPolicy] = dict()
+        self._limiters: dict[str, _XComLimiter] = dict()
+        self._limiter = _XComLimiter(max_concurrency, max_pending)
+        callback_policies = callback_policies or dict()
+        cache_policies = cache_policies or dict()
+        admission_policies = admission_policies or dict()
+        for req_type, callback in msg_callbacks.items():
+            self.register_msg_callback(
+                req_type,
+                callback,
+                callback_policies.get(req_type, "inline"),
+                cache_policies.get(req_type),
+                admission_policies.get(req_type),
+            )
+
+    def register_msg_callback(
+        self,
+        req_type: str,
+        callback: Callable,
+        policy: XComCallbackPolicy = "inline",
+        cache_policy: XComCachePolicy | None = None,
+        admission_policy: XComAdmissionPolicy | None = None,
+    ):
+        """
+        Args:
+            req_type (str): _description_
+            callback (Callable): coroutine function, or plain function taking the request data,
+                or async generator function streaming the response in chunks, see `XComTCli.stream`
+            policy (XComCallbackPolicy, optional): where a plain function runs, coroutine functions are always "inline".
+                "inline" - in the event loop
+                "thread" - in a thread pool, for functions releasing the GIL or doing blocking I/O
+                "process" - in a process pool, for CPU-bound functions; the function, request and response must be picklable
+                Defaults to "inline".
+            cache_policy (XComCachePolicy | None, optional): reuse the encoded response for requests of the same data,
+                only for callbacks whose response depends on the request data alone. Defaults to None, i.e. no cache.
+            admission_policy (XComAdmissionPolicy | None, optional): see `set_admission_policy`. Defaults to None.
+        """
+        if callback is None or not callable(callback):
+            raise TypeError(f"msg_callback for req_type={req_type} must be callable")
+        if policy not in ["inline", "thread", "process"]:
+            raise ValueError(f"Unsupported policy {policy} for req_type={req_type}")
+        if (inspect.iscoroutinefunction(callback) or inspect.isasyncgenfunction(callback)) and policy != "inline":
+            raise TypeError(f"msg_callback for req_type={req_type} must be a plain function to run in {policy}")
+        if inspect.isasyncgenfunction(callback) and cache_policy is not None:
+            raise TypeError(f"Streamed responses of req_type={req_type} cannot be cached")
+        self._callbacks[req_type] = callback
+        self._policies[req_type] = policy
+        if cache_policy is not None:
+            self._caches[req_type] = _XComResponseCache(cache_policy)
+        else:
+            self._caches.pop(req_type, None)
+        self.set_admission_policy(req_type, admission_policy)
+
+    def set_admission_policy(self, req_type: str, admission_policy: XComAdmissionPolicy | None):
+        """Limit the requests of a req_type running at the same time, also at runtime.
+
+        Requests beyond `max_concurrency` wait for a free slot if less than `max_pending` requests are waiting,
+        otherwise they are rejected right away with err_code "overloaded". The priority of the req_type orders
+        the requests waiting for the server-wide `max_concurrency`.
+
+        Args:
+            req_type (str): _description_
+            admission_policy (XComAdmissionPolicy | None): None to remove the limits.
+        """
+        if admission_policy is None:
+            self._admission_policies.pop(req_type, None)
+            self._limiters.pop(req_type, None)
+            return
+        self._admission_policies[req_type] = admission_policy
+        if req_type in self._limiters:
+            self._limiters[req_type].update(admission_policy.max_concurrency, admission_policy.max_pending)
+        else:
+            self._limiters[req_type] = _XComLimiter(admission_policy.max_concurrency, admission_policy.max_pending)
+
+    def set_max_concurrency(self, max_concurrency: int, max_pending: int):
+        """Change the server-wide limits at runtime"""
+        assert max_concurrency >= 0 and max_pending >= 0
+        self._limiter.update(max_concurrency, max_pending)
+
+    def admission(self) -> dict[str, dict[str, Any]]:
+        """Limits and occupancy, {"__all__" or req_type: {"max_concurrency", "max_pending", "running", "pending",
+        "rejected", "priority"}}, also part of `stats()`"""
+        admission = {"__all__": self._limiter.snapshot()}
+        for req_type, limiter in self._limiters.items():
+            admission[req_type] = {**limiter.snapshot(), "priority": self._admission_policies[req_type].priority}
+        return admission
+
+    async def _admitted_call(self, req_type: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """`call()` holding a slot of the req_type and of the server"""
+        admission_policy = self._admission_policies.get(req_type)
+        priority = admission_policy.priority if admission_policy is not None else 0
+        acquired: list[_XComLimiter] = []
+        try:
+            for limiter in (self._limiters.get(req_type), self._limiter):
+                if limiter is None:
+                    continue
+                if not await limiter.acquire(priority):
+                    raise _XComRejected(f"Server is overloaded for req_type={req_type}.", "overloaded")
+                acquired.append(limiter)
+            return await call()
+        finally:
+            for limiter in acquired:
+                limiter.release()
+
+    def _executor(self, policy: XComCallbackPolicy) -> concurrent.futures.Executor:
+        """Created on first use, i.e. after forking workers"""
+        if policy not in self._executors:
+            if policy == "thread":
+                self._executors[policy] = concurrent.futures.ThreadPoolExecutor(
+                    self._executor_workers.get(policy), thread_name_prefix=self._identifier
+                )
+            else:
+                self._executors[policy] = concurrent.futures.ProcessPoolExecutor(self._executor_workers.get(policy))
+        return self._executors[policy]
+
+    def _shutdown_executors(self):
+        executors, self._executors = self._executors, dict()
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _cached_call(self, req_type: str, data: Any) -> Any:
+        """`_call` through the response cache of the req_type, if any"""
+        cache = self._caches.get(req_type)
+        key = cache.key(data) if cache is not None else None
+        if key is None:
+            return await self._call(req_type, data)
+        return await cache.get_or_call(key, lambda: self._call(req_type, data))  # type: ignore[union-attr]
+
+    async def _call(self, req_type: str, data: Any) -> Any:
+        callback, policy = self._callbacks[req_type], self._policies[req_type]
+        if inspect.iscoroutinefunction(callback):
+            return await callback(data)
+        elif policy == "inline":
+            return callback(data)
+
+        queue_limit = self._executor_queue_limits.get(policy, 0)
+        if queue_limit > 0 and self._executor_queued[policy] >= queue_limit:
+            raise _XComRejected(f"Executor of policy={policy} is full.", "overloaded")
+        loop = asyncio.get_running_loop()
+        fut = self._executor(policy).submit(callback, data)
+        self._executor_queued[policy] += 1
+        # the slot is freed once the job leaves the pool, not when its request is cancelled
+        fut.add_done_callback(lambda _: self._release_executor_slot(loop, policy))
+        return await asyncio.wrap_future(fut)
+
+    def _release_executor_slot(self, loop: asyncio.AbstractEventLoop, policy: XComCallbackPolicy):
+        """Called from the pool when a job is done or cancelled"""
+
+        def release():
+            self._executor_queued[policy] -= 1
+
+        with contextlib.suppress(RuntimeError):
+            # the loop is closed already
+            loop.call_soon_threadsafe(release)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Latency percentiles in microseconds and counters by req_type of this process, also served as req_type
+        `__stats__`. Stages: "decode", "callback", "encode" and "send" (batches are counted as req_type `__batch__`).
+
+        Returns:
+            dict[str, dict[str, Any]]: {req_type: {stage: {"count", "mean", "max", "p50", "p90", "p99", "p999"}, "errors": int}}
+                plus "cache_hits", "cache_misses", "coalesced" and "cache_entries" of cached req_types,
+                and "admission" of req_types with admission control, see `admission`
+        """
+        summary = self._stats.summary()
+        for req_type, admission in self.admission().items():
+            summary.setdefault(req_type, {})["admission"] = admission
+        for req_type, cache in self._caches.items():
+            summary.setdefault(req_type, {}).update(
+                cache_hits=cache.hits, cache_misses=cache.misses, coalesced=cache.coalesced, cache_entries=len(cache)
+            )
+        return summary
+
+    def _stats_key(self, raw_req_d: dict[str, Any]) -> str:
+        """Bound the number of histograms, whatever req_types clients send"""
+        if "batch" in raw_req_d:
+            return "__batch__"
+        req_type = raw_req_d.get("req_type")
+        return req_type if req_type in self._callbacks or req_type in _XCOM_RESERVED else "__unknown__"
+
+    def publish(self, topic: str, data: Any, key: Any = None) -> int:
+        """Push a message to every connection subscribed to `topic` without waiting for any of them.
+
+        The message is encoded once per codec in use and queued for each subscriber, a dedicated task per subscriber
+        writes its queue to the connection. A subscriber falling behind by `subscriber_queue` messages is handled by
+        `slow_consumer_policy`: "drop_oldest" drops its oldest message, "latest" keeps only the latest message per
+        (topic, `key`), "disconnect" closes its connection.
+
+        Must be called from the event loop serving the connections, i.e. not with `workers > 1`.
+
+        Args:
+            topic (str): _description_
+            data (Any): message data
+            key (Any, optional): conflation key for the "latest" policy. Defaults to None, i.e. one per topic.
+
+        Returns:
+            int: number of subscribers the message is queued for
+        """
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return 0
+        raw_msg_d = {
+            "ts": int(time.time() * 1000000),
+            "topic": topic,
+            "data": data,
+        }
+        frames: dict[XComCodec, bytes] = dict()
+        for subscriber in subscribers:
+            if subscriber.codec not in frames:
+                frames[subscriber.codec] = subscriber.codec.encode(raw_msg_d)
+            subscriber.put((topic, key), frames[subscriber.codec])
+        return len(subscribers)
+
+    def _on_topic_req(self, raw_req_d: dict[str, Any], ws: XComConnection | None, rsp_codec: XComCodec) -> Any:
+        if ws is None or not self._keep_alive:
+            raise _XComRejected("Subscription requires a keep-alive connection.")
+        topic = raw_req_d["data"].get("topic") if isinstance(raw_req_d["data"], dict) else None
+        if not isinstance(topic, str):
+            raise _XComRejected('Subscription requires data={"topic": str}.')
+
+        if raw_req_d["req_type"] == _XCOM_SUBSCRIBE:
+            if ws not in self._subscribers:
+                self._subscribers[ws] = _XComSubscriber(
+                    ws, rsp_codec, self._subscriber_queue, self._slow_consumer_policy
+                )
+            subscriber = self._subscribers[ws]
+            subscriber.topics.add(topic)
+            self._topics.setdefault(topic, set()).add(subscriber)
+        else:
+            subscriber = self._subscribers.get(ws)  # type: ignore[assignment]
+            if subscriber is not None and topic in subscriber.topics:
+                subscriber.topics.discard(topic)
+                self._topics[topic].discard(subscriber)
+                if not self._topics[topic]:
+                    del self._topics[topic]
+        return {"topic": topic, "subscribed": raw_req_d["req_type"] == _XCOM_SUBSCRIBE}
+
+    def _drop_subscriber(self, ws: XComConnection):
+        subscriber = self._subscribers.pop(ws, None)
+        if subscriber is None:
+            return
+        subscriber.close()
+        for topic in subscriber.topics:
+            self._topics[topic].discard(subscriber)
+            if not self._topics[topic]:
+                del self._topics[topic]
+
+    async def _dispatch(
+        self,
+        raw_req_d: dict[str, Any],
+        ws: XComConnection | None = None,
+        rsp_codec: XComCodec = JSON_CODEC,
+        slots: asyncio.Semaphore | None = None,
+    ) -> dict[str, Any]:
+        """Process a request envelope, or every envelope of a batch envelope into a batch response
+
+        Args:
+            slots (asyncio.Semaphore | None, optional): pipeline slots of the connection, of which the envelope
+                holds one. Defaults to None, i.e. a batch has `pipeline` slots of its own.
+        """
+        if "batch" not in raw_req_d:
+            return await self._process(raw_req_d, ws, rsp_codec)
+        elif self._pipeline > 0:
+            raw_rsp_ds = await self._process_batch(raw_req_d["batch"], ws, rsp_codec, slots)
+        else:
+            raw_rsp_ds = [await self._process(d, ws, rsp_codec) for d in raw_req_d["batch"]]
+        return _batch_envelope(raw_rsp_ds)
+
+    async def _process_batch(
+        self,
+        raw_req_ds: list[dict[str, Any]],
+        ws: XComConnection | None,
+        rsp_codec: XComCodec,
+        slots: asyncio.Semaphore | None,
+    ) -> list[dict[str, Any]]:
+        """Run the envelopes of a batch concurrently on the slot of the batch plus the slots free when it starts, so
+        that every envelope counts against `pipeline`"""
+        if slots is None:
+            slots = asyncio.Semaphore(self._pipeline - 1)
+        raw_rsp_ds: list[dict[str, Any]] = [dict()] * len(raw_req_ds)
+        pending = iter(enumerate(raw_req_ds))
+
+        async def worker():
+            for i, raw_req_d in pending:
+                raw_rsp_ds[i] = await self._process(raw_req_d, ws, rsp_codec)
+
+        async def extra_worker():
+            try:
+                await worker()
+            finally:
+                slots.release()
+
+        n_extra = 0
+        while n_extra < len(raw_req_ds) - 1 and not slots.locked():
+            # free right away, the loop does not yield
+            await slots.acquire()
+            n_extra += 1
+        await asyncio.gather(worker(), *[extra_worker() for _ in range(n_extra)])
+        return raw_rsp_ds
+
+    async def _process(
+        self, raw_req_d: dict[str, Any], ws: XComConnection | None = None, rsp_codec: XComCodec = JSON_CODEC
+    ) -> dict[str, Any]:
+        """Run the callback for one request envelope and build the response envelope"""
+        if raw_req_d["req_type"] not in self._callbacks and raw_req_d["req_type"] not in _XCOM_RESERVED:
+            self._stats.incr("__unknown__", "errors")
+            raw_rsp_d = {
+                "ts": int(time.time() * 1000000),
+                "err_msg": "Callback for req_type={} not found.".format(raw_req_d["req_type"]),
+            }
+        else:
+            start = monotonic_us()
+            try:
+                rsp_d = await self._call_until_deadline(raw_req_d, ws, rsp_codec)
+            except _XComRejected as e:
+                self._stats.incr(raw_req_d["req_type"], e.err_code)
+                raw_rsp_d = {
+                    "ts": int(time.time() * 1000000),
+                    "err_msg": str(e),
+                    "err_code": e.err_code,
+                }
+            except Exception as e:
+                self._stats.incr(raw_req_d["req_type"], "errors")
+                raw_rsp_d = {
+                    "ts": int(time.time() * 1000000),
+                    "err_msg": "Callback failed with exception={}. reason={}. raw_req={}.".format(
+                        e.__class__.__name__,
+                        str(e),
+                        str(raw_req_d),
+                    ),
+                }
+            else:
+                raw_rsp_d = {
+                    "ts": int(time.time() * 1000000),
+                    "data": rsp_d,
+                }
+                if rsp_d is _XCOM_EOS:
+                    raw_rsp_d["data"] = None
+                    raw_rsp_d["eos"] = True
+            self._stats.record(raw_req_d["req_type"], "callback", monotonic_us() - start)
+
+        if "req_id" in raw_req_d:
+            raw_rsp_d["req_id"] = raw_req_d["req_id"]
+        return raw_rsp_d
+
+    async def _call_until_deadline(
+        self, raw_req_d: dict[str, Any], ws: XComConnection | None, rsp_codec: XComCodec
+    ) -> Any:
+        """Run the request unless its `deadline` (epoch in microseconds of the server, set from `timeout_us` on
+        receipt) has passed, and cancel it at the deadline"""
+        deadline = raw_req_d.get("deadline")
+        if deadline is None:
+            return await self._run_req(raw_req_d, ws, rsp_codec)
+        remaining = deadline / 1000000 - time.time()
+        if remaining <= 0:
+            raise _XComRejected("Deadline exceeded.", "deadline_exceeded")
+        deadline_cm = asyncio.timeout(remaining)
+        try:
+            async with deadline_cm:
+                return await self._run_req(raw_req_d, ws, rsp_codec)
+        except TimeoutError:
+            if deadline_cm.expired():
+                raise _XComRejected("Deadline exceeded.", "deadline_exceeded")
+            raise
+
+    async def _run_req(self, raw_req_d: dict[str, Any], ws: XComConnection | None, rsp_codec: XComCodec) -> Any:
+        if raw_req_d["req_type"] == _XCOM_PING:
+            return {}
+        elif raw_req_d["req_type"] == _XCOM_STATS:
+            return self.stats()
+        elif raw_req_d["req_type"] in (_XCOM_SUBSCRIBE, _XCOM_UNSUBSCRIBE):
+            return self._on_topic_req(raw_req_d, ws, rsp_codec)
+        elif inspect.isasyncgenfunction(self._callbacks[raw_req_d["req_type"]]):
+            return await self._admitted_call(
+                raw_req_d["req_type"], lambda: self._stream_chunks(raw_req_d, ws, rsp_codec)
+            )
+        else:
+            return await self._admitted_call(
+                raw_req_d["req_type"], lambda: self._cached_call(raw_req_d["req_type"], raw_req_d["data"])
+            )
+
+    async def _stream_chunks(self, raw_req_d: dict[str, Any], ws: XComConnection | None, rsp_codec: XComCodec) -> Any:
+        """Send every chunk yielded by a streaming callback as its own frame, before the final response"""
+        if ws is None:
+            raise _XComRejected("Streaming requires a connection.")
+        async for chunk in self._callbacks[raw_req_d["req_type"]](raw_req_d["data"]):
+            chunk_d = {
+                "ts": int(time.time() * 1000000),
+                "chunk": chunk,
+            }
+            if "req_id" in raw_req_d:
+                chunk_d["req_id"] = raw_req_d["req_id"]
+            await ws.send(rsp_codec.encode(chunk_d))
+        return _XCOM_EOS
+
+    def _rsp_codec(self, raw_req_d: dict[str, Any], req_codec: XComCodec) -> XComCodec:
+        if self._codecs and "req_type" in raw_req_d and raw_req_d["req_type"] in self._codecs:
+            return self._codecs[raw_req_d["req_type"]]
+        return self._codec or req_codec
+
+    def _decode_req(self, raw_req_b: bytes) -> Tuple[dict[str, Any], XComCodec]:
+        received_us = int(time.time() * 1000000)
+        start = monotonic_us()
+        req_codec = codec_of_frame(raw_req_b)
+        raw_req_d = req_codec.decode(raw_req_b)
+        for env in _iter_envelopes(raw_req_d):
+            if "timeout_us" in env:
+                # relative to the clock of the server, whatever the clock of the client
+                env["deadline"] = received_us + env["timeout_us"]
+        self._stats.record(self._stats_key(raw_req_d), "decode", monotonic_us() - start)
+        if self._debug:
+            logger.debug("Receive raw request {}".format(raw_req_d))
+        return raw_req_d, req_codec
+
+    async def _send_rsp(
+        self, ws: XComConnection, raw_req_d: dict[str, Any], raw_rsp_d: dict[str, Any], rsp_codec: XComCodec
+    ):
+        if self._debug:
+            logger.debug("Send raw rsponse {}".format(raw_rsp_d))
+        start = monotonic_us()
+        raw_rsp_b = rsp_codec.encode(raw_rsp_d)
+        encoded = monotonic_us()
+        await ws.send(raw_rsp_b)
+        stats_key = self._stats_key(raw_req_d)
+        self._stats.record(stats_key, "encode", encoded - start)
+        self._stats.record(stats_key, "send", monotonic_us() - encoded)
+
+    async def _req_handler(self, ws: XComConnection):
+        if self._recorder is not None:
+            ws = _XComRecordingConnection(ws, self._recorder)  # type: ignore[assignment]
+        if self._pipeline > 0 and self._keep_alive:
+            await self._pipelined_req_handler(ws)
+            return
+
+        try:
+            while True:
+                try:
+                    raw_req_b = await ws.recv(decode=False)
+                except websockets.exceptions.ConnectionClosedError as e:
+                    logger.debug("Connection closed with code {} and reason {}".format(e.code, e.reason))
+                    break
+                except (websockets.exceptions.ConnectionClosedOK, XComConnectionClosed):
+                    break
+
+                raw_req_d, req_codec = self._decode_req(raw_req_b)
+                rsp_codec = self._rsp_codec(raw_req_d, req_codec)
+                raw_rsp_d = await self._dispatch(raw_req_d, ws, rsp_codec)
+                await self._send_rsp(ws, raw_req_d, raw_rsp_d, rsp_codec)
+
+                if not self._keep_alive:
+                    break
+        finally:
+            self._drop_subscriber(ws)
+
+    async def _pipelined_req_handler(self, ws: XComConnection):
+        """Run up to `pipeline` requests of one connection concurrently and send each response as soon as it is ready.
+
+        Requests flagged `ordered` get their responses sent in the order they were received.
+        """
+        slots = asyncio.Semaphore(self._pipeline)
+        tasks: set[asyncio.Task] = set()
+        last_ordered_sent: asyncio.Future | None = None
+        try:
+            while True:
+                try:
+                    raw_req_b = await ws.recv(decode=False)
+                except websockets.exceptions.ConnectionClosedError as e:
+                    logger.debug("Connection closed with code {} and reason {}".format(e.code, e.reason))
+                    break
+                except (websockets.exceptions.ConnectionClosedOK, XComConnectionClosed):
+                    break
+
+                # stop reading from the connection until a slot is free
+                await slots.acquire()
+                raw_req_d, req_codec = self._decode_req(raw_req_b)
+
+                prev_ordered_sent, ordered_sent = None, None
+                if raw_req_d.get("ordered"):
+                    prev_ordered_sent = last_ordered_sent
+                    ordered_sent = last_ordered_sent = asyncio.get_running_loop().create_future()
+                task = asyncio.create_task(
+                    self._pipelined_process(
+                        ws, raw_req_d, self._rsp_codec(raw_req_d, req_codec), slots, prev_ordered_sent, ordered_sent
+                    )
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self._drop_subscriber(ws)
+            for task in tasks:
+                task.cancel()
+
+    async def _pipelined_process(
+        self,
+        ws: XComConnection,
+        raw_req_d: dict[str, Any],
+        rsp_codec: XComCodec,
+        slots: asyncio.Semaphore,
+        prev_ordered_sent: asyncio.Future | None,
+        ordered_sent: asyncio.Future | None,
+    ):
+        try:
+            raw_rsp_d = await self._dispatch(raw_req_d, ws, rsp_codec, slots)
+            if prev_ordered_sent is not None:
+                await prev_ordered_sent
+            await self._send_rsp(ws, raw_req_d, raw_rsp_d, rsp_codec)
+        except (websockets.exceptions.ConnectionClosed, XComConnectionClosed):
+            pass
+        finally:
+            if ordered_sent is not None and not ordered_sent.done():
+                ordered_sent.set_result(None)
+            slots.release()
+
+    async def run(self):
+        if self._workers > 1:
+            await self._supervise_workers()
+        else:
+            try:
+                await self._serve()
+            finally:
+                self._shutdown_executors()
+                if self._recorder is not None:
+                    self._recorder.close()
+
+    async def _serve(self, sock: socket.socket | None = None):
+        while True:
+            try:
+                if self._use_unix_sock:
+                    logger.debug("Listen to {}".format(self._unix_sock))
+                else:
+                    logger.debug("Listen to {}:{}".format(self._host, self._port))
+                server = await start_server(
+                    self._transport,
+                    self._req_handler,
+                    self._unix_sock,
+                    self._host,
+                    self._port,
+                    sock=sock,
+                    reuse_port=self._workers > 1,
+                    options=self._transport_options,
+                )
+                async with server:
+                    await asyncio.Future()
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                logger.info("Stop gracefully.")
+                break
+            except Exception as e:
+                logger.error("Failed with {}. error={}".format(e.__class__.__name__, str(e)))
+                logger.debug(traceback.format_exc())
+                if self._restart_policy == "always":
+                    logger.info(f"Restart server.")
+                    await asyncio.sleep(0.5)
+                else:
+                    break
+
+    def serve_forever(self):
+        """Run the server in a new event loop until interrupted, on uvloop if so chosen by `transport_options`"""
+        try:
+            run_event_loop(self.run(), self._transport_options.event_loop)
+        except KeyboardInterrupt:
+            pass
+
+    def _worker_main(self, sock: socket.socket | None):
+        if self._recorder is not None:
+            self._recorder = self._recorder.for_worker()
+        try:
+            run_event_loop(self._serve(sock), self._transport_options.event_loop)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._shutdown_executors()
+            if self._recorder is not None:
+                self._recorder.close()
+
+    def _spawn_worker(self, sock: socket.socket | None) -> multiprocessing.process.BaseProcess:
+        proc = multiprocessing.get_context("fork").Process(target=self._worker_main, args=(sock,), daemon=True)
+        proc.start()
+        logger.info("Worker {} started.".format(proc.pid))
+        return proc
+
+    async def _supervise_workers(self):
+        """Fork `workers` processes serving the same endpoint and restart them by `restart_policy`
+
+        TCP: every worker listens to the same port with SO_REUSEPORT and the kernel balances connections.
+        Unix socket: the supervisor listens once and all workers accept connections from the shared socket.
+        """
+        sock = bind_unix_socket(self._unix_sock) if self._use_unix_sock else None  # type: ignore[arg-type]
+        try:
+            self._worker_procs = [self._spawn_worker(sock) for _ in range(self._workers)]
+            while True:
+                await asyncio.sleep(0.5)
+                for i, proc in enumerate(self._worker_procs):
+                    if proc.is_alive() or proc.exitcode is None:
+                        continue
+                    logger.error("Worker {} exited with code {}.".format(proc.pid, proc.exitcode))
+                    if self._restart_policy == "always":
+                        logger.info(f"Restart worker.")
+                        self._worker_procs[i] = self._spawn_worker(sock)
+                if not any(proc.is_alive() for proc in self._worker_procs):
+                    break
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            logger.info("Stop gracefully.")
+        finally:
+            for proc in self._worker_procs:
+                proc.terminate()
+            for proc in self._worker_procs:
+                proc.join(timeout=1)
+            if sock is not None:
+                sock.close()
+
+
+class XComTCli(XComBase):
+    """Interprocess Communication by Websocket - Tansient Client
+
+    Mode: one request, one response, e.g., REQ->RSP->REQ->RSP
+
+    With `pool_size > 0`, requests are multiplexed over up to `pool_size` persistent connections
+    instead of opening a new connection per request (server must be `keep_alive=True`).
+    """
+
+    def __init__(
+        self,
+        unix_sock: str | None = None,
+        host: str | None = None,
+        port: int | None = None,
+        req_type: str | None = None,
+        pool_size: int = 0,
+        batch_size: int = 0,
+        batch_window: float = 0.001,
+        codec: XComCodec = JSON_CODEC,
+        codecs: dict[str, XComCodec] | None = None,
+        transport: XComTransport = "ws",
+        transport_options: XComTransportOptions | None = None,
+        recorder: XComRecorder | None = None,
+        tag: str = "",
+        verbose: bool = True,
+        debug: bool = False,
+    ) -> None:
+        """_summary_
+
+        Args:
+            unix_sock (str | None, optional): _description_. Defaults to None.
+            host (str | None, optional): _description_. Defaults to None.
+            port (int | None, optional): _description_. Defaults to None.
+            req_type (str | None, optional): default req_type. Defaults to None.
+            pool_size (int, optional): number of persistent connections, 0 for one connection per request. Defaults to 0.
+            batch_size (int, optional): send up to `batch_size` requests of a pooled connection in one batch envelope, 0 to disable. Defaults to 0.
+            batch_window (float, optional): max seconds a request waits for its batch to fill up. Defaults to 0.001.
+            codec (XComCodec, optional): codec of requests. Defaults to JSON codec.
+            codecs (dict[str, XComCodec] | None, optional): {req_type: codec of requests}, overrides `codec` except for batches. Defaults to None.
+            transport (XComTransport, optional): must match the transport of the server. Defaults to "ws".
+            transport_options (XComTransportOptions | None, optional): socket, framing and event loop settings. Defaults to None, i.e. `XComTransportOptions()`.
+            recorder (XComRecorder | None, optional): capture every frame sent and received, see `XComRecorder`. Defaults to None.
+            debug (bool, optional): _description_. Defaults to False.
+        """
+        super().__init__(tag, verbose, debug)
+        self._use_unix_sock: bool
+        self._unix_sock: str | None
+        self._host: str | None
+        self._port: int | None
+
+        # sanity check
+        assert (unix_sock is not None) ^ ((host is not None) & (port is not None))
+        if unix_sock:
+            self._use_unix_sock = True
+            self._unix_sock = unix_sock
+            self._host = None
+            self._port = None
+        else:
+            self._use_unix_sock = False
+            self._unix_sock = None
+            self._host = host
+            self._port = port
+        self._req_type: str | None = req_type
+        assert pool_size >= 0, "pool_size must not be negative!"
+        self._pool_size: int = pool_size
+        self._pool: list[_XComMuxConn] = []
+        self._pool_lock = asyncio.Lock()
+        assert batch_size == 0 or pool_size > 0, "batching requires pool_size > 0!"
+        self._batch_size: int = batch_size
+        self._batch_window: float = batch_window
+        self._codec: XComCodec = codec
+        self._codecs: dict[str, XComCodec] = codecs or dict()
+        assert transport in XCOM_TRANSPORTS
+        self._transport: XComTransport = transport
+        self._transport_options: XComTransportOptions = transport_options or XComTransportOptions()
+        if transport == "local" and not self._transport_options.serialize:
+            # envelopes are passed as objects, the server replies the same way unless it has a codec of its own
+            self._codec = OBJECT_CODEC
+            self._codecs = dict()
+        self._recorder: XComRecorder | None = recorder
+        self._stats = XComStats()
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Round-trip latency percentiles ("rtt") in microseconds and error counters by req_type, see `XComSvr.stats`"""
+        return self._stats.summary()
+
+    async def _acquire_conn(self) -> _XComMuxConn:
+        """Pick the pooled connection with the fewest in-flight requests, opening a new one while the pool is not full
+        and every open connection is busy."""
+        self._pool = [conn for conn in self._pool if not conn.closed]
+        best = min(self._pool, key=lambda conn: conn.n_pending, default=None)
+        if best is not None and (
+            best.n_pending == 0 or len(self._pool) >= self._pool_size or self._pool_lock.locked()
+        ):
+            return best
+        async with self._pool_lock:
+            self._pool = [conn for conn in self._pool if not conn.closed]
+            if len(self._pool) < self._pool_size:
+                conn = _XComMuxConn(await self._connect(), self._codec, self._batch_size, self._batch_window)
+                self._pool.append(conn)
+                return conn
+            return min(self._pool, key=lambda conn: conn.n_pending)
+
+    async def warm_up(self):
+        """Open all pooled connections in advance"""
+        async with self._pool_lock:
+            self._pool = [conn for conn in self._pool if not conn.closed]
+            while len(self._pool) < self._pool_size:
+                self._pool.append(
+                    _XComMuxConn(await self._connect(), self._codec, self._batch_size, self._batch_window)
+                )
+
+    async def close(self):
+        """Close all pooled connections"""
+        pool, self._pool = self._pool, []
+        for conn in pool:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.debug(
+                    "Meet {} during closing pooled connection. Error msg {}".format(e.__class__.__name__, str(e))
+                )
+
+    async def _pooled_req(self, raw_req_d: dict[str, Any], timeout: float) -> Tuple[dict[str, Any] | None, str | None]:
+        """
+        Returns:
+            Tuple[dict, str]:
+                if all success, return received response envelope, None
+                otherwise, return None, error reason str
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                conn = await self._acquire_conn()
+                return await conn.req(raw_req_d, self._codecs.get(raw_req_d["req_type"])), None
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            return None, f"Connection failed with {str(e)}."
+        except TimeoutError:
+            return None, f"Request timeout."
+        except Exception as e:
+            return None, "Connection error. Error type: {}. Error msg: {}..".format(e.__class__.__name__, str(e))
+
+    async def _raw_req(self, raw_req_b: bytes, timeout: float) -> Tuple[bytes | None, str | None]:
+        """
+        Args:
+            raw_req_b (bytes): _description_
+            timeout (float): in seconds
+
+        Returns:
+            Tuple[bytes, str]:
+                if all success, return received bytes, None
+                otherwise, return None, error reason str
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                async with await self._connect(transient=True) as ws:
+                    await ws.send(raw_req_b)
+                    raw_rsp_b = await ws.recv(decode=False)
+                    return raw_rsp_b, None
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            return None, f"Connection failed with {str(e)}."
+        except TimeoutError:
+            return None, f"Request timeout."
+        except Exception as e:
+            return None, "Connection error. Error type: {}. Error msg: {}..".format(e.__class__.__name__, str(e))
+
+    async def req(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        req_type: str | None = None,
+        timeout: float = 0.5,
+    ) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]:
+        """_summary_
+
+        Args:
+            req_d (dict[str, Any]): _description_
+
+        Returns:
+            Tuple[dict[str, Any] | None, str | None]: rsp_data, error message, latancy_ms
+        """
+        if req_type:
+            final_req_type = req_type
+        elif self._req_type:
+            final_req_type = self._req_type
+        else:
+            raise ValueError("Must specify req_type!")
+        ts = int(time.time() * 1000000)
+        raw_req_d = {
+            "req_type": final_req_type,
+            "ts": ts,
+            "data": req_d,
+            "timeout_us": int(timeout * 1000000),
+        }
+        start = monotonic_us()
+        if self._pool_size > 0:
+            raw_rsp_d, err_msg = await self._pooled_req(raw_req_d, timeout=timeout)
+        else:
+            codec = self._codecs.get(final_req_type, self._codec)
+            raw_rsp_b, err_msg = await self._raw_req(codec.encode(raw_req_d), timeout=timeout)
+            raw_rsp_d = None if raw_rsp_b is None else decode_frame(raw_rsp_b)
+        if raw_rsp_d is None:
+            self._stats.incr(final_req_type, "errors")
+            return None, err_msg, None
+        else:
+            self._stats.record(final_req_type, "rtt", monotonic_us() - start)
+            raw_rsp_d = _single_rsp(raw_rsp_d)
+            if "err_msg" in raw_rsp_d:
+                self._stats.incr(final_req_type, "errors")
+            return _unpack_rsp(raw_rsp_d)
+
+    async def send(
+        self, req_d: dict[str, Any] | XComRaw, req_type: str | None = None, timeout: float = 1
+    ) -> str | None:
+        """One-way request over a pooled connection, returning once it is sent; the response is discarded.
+
+        Args:
+            req_d (dict[str, Any] | XComRaw): _description_
+            req_type (str | None, optional): _description_. Defaults to None.
+            timeout (float, optional): seconds to wait for a connection and sending. Defaults to 1.
+
+        Returns:
+            str | None: error message, None if sent
+        """
+        assert self._pool_size > 0, "send requires pool_size > 0!"
+        final_req_type = req_type or self._req_type
+        if not final_req_type:
+            raise ValueError("Must specify req_type!")
+        raw_req_d = {"req_type": final_req_type, "ts": int(time.time() * 1000000), "data": req_d}
+        try:
+            async with asyncio.timeout(timeout):
+                conn = await self._acquire_conn()
+                await conn.send(raw_req_d, self._codecs.get(final_req_type))
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            err_msg = f"Connection failed with {str(e)}."
+        except TimeoutError:
+            err_msg = f"Send timeout."
+        except Exception as e:
+            err_msg = "Connection error. Error type: {}. Error msg: {}..".format(e.__class__.__name__, str(e))
+        else:
+            return None
+        self._stats.incr(final_req_type, "errors")
+        return err_msg
+
+    async def stream(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        req_type: str | None = None,
+        timeout: float = 5,
+        max_chunks: int = 64,
+    ) -> AsyncIterator[Any]:
+        """Send a request to a streaming callback and iterate over the chunks of its response as they arrive.
+
+        Args:
+            req_d (dict[str, Any] | XComRaw): _description_
+            req_type (str | None, optional): _description_. Defaults to None.
+            timeout (float, optional): seconds until the end of stream. Defaults to 5.
+            max_chunks (int, optional): chunks buffered for a pooled connection before its reading waits for the
+                iteration, which delays the other responses of that connection. Defaults to 64.
+
+        Raises:
+            XComStreamError: if the stream fails, with the error message
+
+        Returns:
+            AsyncIterator[Any]: chunks
+        """
+        final_req_type = req_type or self._req_type
+        if not final_req_type:
+            raise ValueError("Must specify req_type!")
+        ts = int(time.time() * 1000000)
+        raw_req_d = {
+            "req_type": final_req_type,
+            "ts": ts,
+            "data": req_d,
+            "timeout_us": int(timeout * 1000000),
+        }
+        deadline = asyncio.get_running_loop().time() + timeout
+        codec = self._codecs.get(final_req_type, self._codec)
+        if self._pool_size > 0:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    conn = await self._acquire_conn()
+            except TimeoutError:
+                raise XComStreamError("Request timeout.")
+            except Exception as e:
+                raise XComStreamError("Connection failed with {}.".format(str(e)))
+            async for chunk in conn.stream(raw_req_d, deadline, max_chunks, codec):
+                yield chunk
+            return
+
+        # a connection of its own, read as fast as the chunks are consumed
+        try:
+            async with asyncio.timeout_at(deadline):
+                ws = await self._connect(transient=True)
+        except TimeoutError:
+            raise XComStreamError("Request timeout.")
+        except Exception as e:
+            raise XComStreamError("Connection failed with {}.".format(str(e)))
+        async with ws:
+            await ws.send(codec.encode(raw_req_d))
+            while True:
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        raw_rsp_d = decode_frame(await ws.recv(decode=False))
+                except TimeoutError:
+                    raise XComStreamError("Request timeout.")
+                except Exception as e:
+                    raise XComStreamError("Connection lost. Error type: {}.".format(e.__class__.__name__))
+                if "chunk" in raw_rsp_d:
+                    yield raw_rsp_d["chunk"]
+                elif "err_msg" in raw_rsp_d:
+                    raise XComStreamError(raw_rsp_d["err_msg"], raw_rsp_d.get("err_code"))
+                else:
+                    return
+
+
+class XComKACli(XComBase):
+    """保持连接的ws client, 发请求和收回复是异步的。
+    主要用在请求后需要NO BLOCK等待回复或者不需要等待回复的场景。
+    """
+
+    def __init__(
+        self,
+        req_type: str,
+        unix_sock: str | None = None,
+        host: str | None = None,
+        port: int | None = None,
+        reconnect_wait: float = 0.5,
+        reconnect_initial_wait: float = 0.01,
+        replay_buffer: int = 0,
+        ordered: bool = False,
+        batch_size: int = 0,
+        batch_window: float = 0.001,
+        codec: XComCodec = JSON_CODEC,
+        transport: XComTransport = "ws",
+        transport_options: XComTransportOptions | None = None,
+        recorder: XComRecorder | None = None,
+        send_queue: int = 0,
+        overflow: XComOverflowPolicy = "block",
+        tag: str = "",
+        verbose: bool = True,
+        debug: bool = False,
+    ):
+        """_summary_
+
+        Args:
+            uri (str): _description_
+            req_type (str): request type str
+            reconnect_wait (float, optional): max seconds between reconnect attempts: the wait doubles from `reconnect_initial_wait` up to `reconnect_wait`, with jitter, and starts over once a connection stayed up for `reconnect_wait`. Defaults to 0.5.
+            reconnect_initial_wait (float, optional): wait before the first reconnect attempt, at most `reconnect_wait`. Defaults to 0.01.
+            replay_buffer (int, optional): keep up to `replay_buffer` one-way requests sent while disconnected, dropping the oldest, and send them once reconnected; 0 to fail them. Defaults to 0.
+            ordered (bool, optional): ask a pipelined server to send responses in request order. Defaults to False.
+            batch_size (int, optional): send up to `batch_size` requests in one batch envelope, 0 to disable. Defaults to 0.
+            batch_window (float, optional): max seconds a request waits for its batch to fill up. Defaults to 0.001.
+            codec (XComCodec, optional): codec of requests. Defaults to JSON codec.
+            transport (XComTransport, optional): must match the transport of the server. Defaults to "ws".
+            transport_options (XComTransportOptions | None, optional): socket, framing and event loop settings. Defaults to None, i.e. `XComTransportOptions()`.
+            recorder (XComRecorder | None, optional): capture every frame sent and received, see `XComRecorder`. Defaults to None.
+            send_queue (int, optional): queue up to `send_queue` requests and send them by one writer task, also while reconnecting; 0 to send directly. Defaults to 0.
+            overflow (XComOverflowPolicy, optional): what `send()` does when the send queue is full: "block", "drop_newest", "drop_oldest" or "conflate" by key. Defaults to "block".
+            debug (bool, optional): _description_. Defaults to False.
+        """
+        super().__init__(tag, verbose, debug)
+        self._use_unix_sock: bool
+        self._unix_sock: str | None
+        self._host: str | None
+        self._port: int | None
+
+        # sanity check
+        assert (unix_sock is not None) ^ ((host is not None) & (port is not None))
+        if unix_sock:
+            self._use_unix_sock = True
+            self._unix_sock = unix_sock
+            self._host = None
+            self._port = None
+        else:
+            self._use_unix_sock = False
+            self._unix_sock = None
+            self._host = host
+            self._port = port
+        assert req_type, "req_type must not be none!"
+        self._req_type: str = req_type
+        assert reconnect_wait >= 0, "reconnect_wait must not be negative!"
+        assert reconnect_initial_wait >= 0, "reconnect_initial_wait must not be negative!"
+        self._reconnect_wait: float = reconnect_wait
+        # 0 for reconnect_wait=0, i.e. reconnect without waiting
+        self._reconnect_initial_wait: float = min(reconnect_initial_wait, reconnect_wait)
+        assert replay_buffer >= 0, "replay_buffer must not be negative!"
+        self._replay_buffer: int = replay_buffer
+        self._replay: collections.deque[dict[str, Any]] = collections.deque()
+        self._ordered: bool = ordered
+        self._codec: XComCodec = codec
+        assert transport in XCOM_TRANSPORTS
+        self._transport: XComTransport = transport
+        self._transport_options: XComTransportOptions = transport_options or XComTransportOptions()
+        if transport == "local" and not self._transport_options.serialize:
+            # envelopes are passed as objects, the server replies the same way unless it has a codec of its own
+            self._codec = OBJECT_CODEC
+        self._recorder: XComRecorder | None = recorder
+        self._debug: bool = debug
+        self._ws: XComConnection | None = None
+        self._msg_callback: Callable | None = None
+        self._tag: str = tag
+        self._closing_flag: bool = False
+        self._pending = _XComPending()
+        self._batch_size: int = batch_size
+        self._send_queue = _XComSendQueue(send_queue, overflow) if send_queue > 0 else None
+        # with a send queue, the writer task batches whatever is queued instead
+        self._batcher = (
+            _XComBatcher(self._send_batch, batch_size, batch_window)
+            if batch_size > 0 and self._send_queue is None
+            else None
+        )
+        self._topics: dict[str, Callable | None] = dict()
+        self._resubscribing: asyncio.Task | None = None
+        self._stats = XComStats()
+
+    def register_msg_callback(self, msg_callback: Callable):
+        if inspect.iscoroutinefunction(msg_callback):
+            self._msg_callback = msg_callback
+        else:
+            raise TypeError("msg_callback must be a coroutine function")
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Round-trip latency percentiles ("rtt") of correlated requests in microseconds and error counters by req_type,
+        see `XComSvr.stats`, and the connection metrics under "__connection__": "downtime" percentiles in microseconds
+        and the counters "reconnects", "replayed" and "replay_dropped"."""
+        return self._stats.summary()
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    @property
+    def replay_depth(self) -> int:
+        """Number of one-way requests waiting in the replay buffer for the connection"""
+        return len(self._replay)
+
+    @property
+    def send_queue_depth(self) -> int:
+        """Number of requests waiting in the send queue"""
+        return len(self._send_queue) if self._send_queue is not None else 0
+
+    @property
+    def send_dropped(self) -> int:
+        """Number of requests dropped or conflated by the overflow policy of the send queue"""
+        return self._send_queue.dropped if self._send_queue is not None else 0
+
+    async def send(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        timeout: int = 1,
+        key: Any = None,
+    ) -> str | None:
+        """_summary_
+
+        Args:
+            req_d (dict[str, Any] | XComRaw): request data, or already serialized request data
+            timeout (int, optional): seconds to wait for sending, or for a free slot of the send queue. Defaults to 1.
+            key (Any, optional): conflation key of the "conflate" overflow policy. Defaults to None.
+
+        Returns:
+            str | None: if error, return err msg, else return None.
+                In batching or send queue mode the request is only queued and send errors are logged.
+        """
+        return await self._send_raw_req(self._new_raw_req(req_d), timeout, key)
+
+    async def send_req(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        timeout: float = 1,
+    ) -> asyncio.Future:
+        """Send a request and return a future of its own response, instead of passing the response to the msg callback.
+
+        Args:
+            req_d (dict[str, Any]): _description_
+            timeout (float, optional): seconds to wait for sending and the response. Defaults to 1.
+
+        Returns:
+            asyncio.Future: resolves to (rsp_data, error message, server ts), the same as `XComTCli.req`
+        """
+        return await self._send_req(self._new_raw_req(req_d), timeout)
+
+    async def _send_req(self, raw_req_d: dict[str, Any], timeout: float) -> asyncio.Future:
+        req_id, fut = self._pending.create()
+        raw_req_d["req_id"] = req_id
+        raw_req_d["timeout_us"] = int(timeout * 1000000)
+        deadline = asyncio.get_running_loop().time() + timeout
+        start = monotonic_us()
+        err_msg = await self._send_raw_req(raw_req_d, timeout)
+        if err_msg is not None:
+            self._stats.incr(raw_req_d["req_type"], "errors")
+            self._pending.discard(req_id)
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_result((None, err_msg, None))
+            return fut
+        return asyncio.ensure_future(self._wait_rsp(req_id, fut, deadline, raw_req_d["req_type"], start))
+
+    async def req(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        timeout: float = 1,
+    ) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]:
+        """Send a request and wait for its response. Returns (rsp_data, error message, server ts)"""
+        return await (await self.send_req(req_d, timeout))
+
+    async def stream(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        timeout: float = 5,
+        max_chunks: int = 64,
+    ) -> AsyncIterator[Any]:
+        """Send a request to a streaming callback and iterate over the chunks of its response, see `XComTCli.stream`.
+
+        Raises:
+            XComStreamError: if the stream fails, with the error message
+        """
+        req_id, queue = self._pending.create_stream(max_chunks)
+        raw_req_d = self._new_raw_req(req_d)
+        raw_req_d["req_id"] = req_id
+        raw_req_d["timeout_us"] = int(timeout * 1000000)
+        deadline = asyncio.get_running_loop().time() + timeout
+        try:
+            err_msg = await self._send_raw_req(raw_req_d, timeout)
+            if err_msg is not None:
+                raise XComStreamError(err_msg)
+            async for chunk in _iter_stream(queue, deadline):
+                yield chunk
+        finally:
+            self._pending.discard(req_id)
+
+    async def subscribe(self, topic: str, callback: Callable | None = None, timeout: float = 1) -> str | None:
+        """Receive the messages published by the server to `topic`, see `XComSvr.publish`.
+
+        The subscription is kept by the client and sent again on every (re)connect.
+
+        Args:
+            topic (str): _description_
+            callback (Callable | None, optional): coroutine function taking the message data. Defaults to None, i.e. the msg callback.
+            timeout (float, optional): _description_. Defaults to 1.
+
+        Returns:
+            str | None: if error, return err msg, else return None. Not connected yet is not an error.
+        """
+        if callback is not None and not inspect.iscoroutinefunction(callback):
+            raise TypeError("callback must be a coroutine function")
+        self._topics[topic] = callback
+        if self._ws is None:
+            return None
+        return (await self._topic_req(_XCOM_SUBSCRIBE, topic, timeout))[1]
+
+    async def unsubscribe(self, topic: str, timeout: float = 1) -> str | None:
+        if self._topics.pop(topic, False) is False or self._ws is None:
+            return None
+        return (await self._topic_req(_XCOM_UNSUBSCRIBE, topic, timeout))[1]
+
+    async def _topic_req(
+        self, req_type: str, topic: str, timeout: float
+    ) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]:
+        return await (await self._send_req(self._new_raw_req({"topic": topic}, req_type), timeout))
+
+    async def _resubscribe(self):
+        for topic in list(self._topics):
+            _, err_msg, _ = await self._topic_req(_XCOM_SUBSCRIBE, topic, timeout=1)
+            if err_msg is not None:
+                logger.error("Failed to subscribe topic {}. {}".format(topic, err_msg))
+
+    async def _wait_rsp(
+        self,
+        req_id: int,
+        fut: asyncio.Future,
+        deadline: float,
+        req_type: str,
+        start: int,
+    ) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]:
+        try:
+            async with asyncio.timeout_at(deadline):
+                raw_rsp_d = await fut
+        except TimeoutError:
+            self._stats.incr(req_type, "errors")
+            return None, f"Request timeout.", None
+        except ConnectionError as e:
+            self._stats.incr(req_type, "errors")
+            return None, str(e), None
+        finally:
+            self._pending.discard(req_id)
+        self._stats.record(req_type, "rtt", monotonic_us() - start)
+        raw_rsp_d = _single_rsp(raw_rsp_d)
+        if "err_msg" in raw_rsp_d:
+            self._stats.incr(req_type, "errors")
+        return _unpack_rsp(raw_rsp_d)
+
+    def _new_raw_req(self, req_d: dict[str, Any] | XComRaw, req_type: str | None = None) -> dict[str, Any]:
+        raw_req_d = {
+            "req_type": req_type or self._req_type,
+            "ts": int(time.time() * 1000000),
+            "data": req_d,
+        }
+        if self._ordered:
+            raw_req_d["ordered"] = True
+        return raw_req_d
+
+    async def _send_raw_req(self, raw_req_d: dict[str, Any], timeout: float, key: Any = None) -> str | None:
+        if self._send_queue is not None:
+            return await self._send_queue.put(raw_req_d, key, timeout)
+        if self._batcher is not None and self._ws is not None:
+            self._batcher.add(raw_req_d)
+            return None
+        return await self._send_raw(raw_req_d, timeout)
+
+    async def _send_batch(self, items: list[dict[str, Any]]):
+        # batches are flushed in the background, give them the default timeout of `send()`
+        err_msg = await self._send_raw(_batch_envelope(items), timeout=1)
+        if err_msg is not None:
+            logger.error("Failed to send batch of {} request(s). {}".format(len(items), err_msg))
+            for raw_req_d in items:
+                if "req_id" in raw_req_d:
+                    self._pending.fail(raw_req_d["req_id"], err_msg)
+
+    async def _send_raw(self, raw_req_d: dict[str, Any], timeout: float) -> str | None:
+        # keep the order of the requests waiting for replay
+        if self._replay and self._buffer_replay(raw_req_d):
+            return None
+        if self._ws is not None:
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._ws.send(self._codec.encode(raw_req_d))
+                return None
+            except TimeoutError:
+                return f"Send timeout."
+            except (websockets.exceptions.ConnectionClosed, XComConnectionClosed) as e:
+                if self._buffer_replay(raw_req_d):
+                    return None
+                return "Send failed. Error type {}. Error msg {}.".format(e.__class__.__name__, str(e))
+            except Exception as e:
+                return "Send failed. Error type {}. Error msg {}.".format(e.__class__.__name__, str(e))
+        elif self._buffer_replay(raw_req_d):
+            return None
+        else:
+            return f"Connection is not ready for sending."
+
+    def _buffer_replay(self, raw_req_d: dict[str, Any]) -> bool:
+        """Keep a one-way request (or batch of them) for `_replay_loop`. Returns False if it cannot be kept."""
+        if self._replay_buffer == 0 or any("req_id" in item for item in _iter_envelopes(raw_req_d)):
+            return False
+        if len(self._replay) >= self._replay_buffer:
+            self._replay.popleft()
+            self._stats.incr(_XCOM_CONNECTION, "replay_dropped")
+        self._replay.append(raw_req_d)
+        return True
+
+    async def _replay_loop(self):
+        """Send the requests buffered while disconnected, before any newer one-way request"""
+        while self._replay and self._ws is not None:
+            raw_req_d = self._replay[0]
+            try:
+                raw_req_b = self._codec.encode(raw_req_d)
+            except Exception as e:
+                logger.error("Drop unencodable request. Error msg {}.".format(str(e)))
+                self._replay.popleft()
+                self._stats.incr(_XCOM_CONNECTION, "replay_dropped")
+                continue
+            try:
+                await self._ws.send(raw_req_b)
+            except Exception as e:
+                logger.error("Replay stopped. Error type {}. Error msg {}.".format(e.__class__.__name__, str(e)))
+                break
+            if self._replay and self._replay[0] is raw_req_d:
+                self._replay.popleft()
+            self._stats.incr(_XCOM_CONNECTION, "replayed", len(raw_req_d.get("batch", (raw_req_d,))))
+
+    def _reconnect_delay(self, attempt: int) -> float:
+        """Seconds to wait before reconnect attempt `attempt` (0-based): `reconnect_initial_wait` doubling up to
+        `reconnect_wait`, of which a random half, so that clients of a restarted server do not reconnect at once"""
+        wait = min(self._reconnect_wait, self._reconnect_initial_wait * 2**attempt)
+        return wait / 2 + random.uniform(0, wait / 2)
+
+    async def _write_loop(self):
+        """Drain the send queue into the connection, queued requests are kept if sending fails"""
+        while self._ws is not None:
+            entries = await self._send_queue.peek(max(self._batch_size, 1))  # type: ignore[union-attr]
+            try:
+                if len(entries) == 1:
+                    raw_req_b = self._codec.encode(entries[0][1])
+                else:
+                    raw_req_b = self._codec.encode(_batch_envelope([raw_req_d for _, raw_req_d in entries]))
+            except Exception as e:
+                logger.error("Drop {} unencodable request(s). Error msg {}.".format(len(entries), str(e)))
+                self._send_queue.ack(entries)  # type: ignore[union-attr]
+                continue
+            try:
+                await self._ws.send(raw_req_b)
+            except Exception as e:
+                logger.error("Writer stopped. Error type {}. Error msg {}.".format(e.__class__.__name__, str(e)))
+                break
+            self._send_queue.ack(entries)  # type: ignore[union-attr]
+
+    async def _listen(self):
+        if self._ws is None:
+            return
+        while True:
+            try:
+                raw_rsp_b = await self._ws.recv(decode=False)
+            except Exception as e:
+                logger.error(
+                    "recv() error. Error type {}. Error msg {}.".format(
+                        e.__class__.__name__,
+                        str(e),
+                    )
+                )
+                self._pending.fail_all("Connection lost before response.")
+                break
+            else:
+                for raw_rsp_d in _iter_envelopes(decode_frame(raw_rsp_b)):
+                    await self._on_raw_rsp(raw_rsp_d)
+
+    async def _on_raw_rsp(self, raw_rsp_d: dict[str, Any]):
+        if "req_id" in raw_rsp_d and (
+            await self._pending.resolve_stream(raw_rsp_d) or self._pending.resolve(raw_rsp_d)
+        ):
+            return
+        if raw_rsp_d.get("eos"):
+            return
+        if "chunk" in raw_rsp_d:
+            # chunks of a streamed response nobody iterates over
+            raw_rsp_d = {"ts": raw_rsp_d["ts"], "data": raw_rsp_d["chunk"]}
+        msg_callback = self._msg_callback
+        if "topic" in raw_rsp_d:
+            msg_callback = self._topics.get(raw_rsp_d["topic"]) or msg_callback
+        if "err_msg" in raw_rsp_d:
+            logger.error("Recv error msg {}".format(raw_rsp_d["err_msg"]))
+        elif msg_callback is not None:
+            try:
+                await msg_callback(raw_rsp_d["data"])
+            except Exception as e:
+                logger.error(
+                    "Error during msg callback. Error type {}. Error msg {}.".format(
+                        e.__class__.__name__,
+                        str(e),
+                    )
+                )
+                logger.debug(traceback.format_exc())
+        else:
+            logger.warning(f"Discard response {raw_rsp_d} as no callback registered!")
+
+    async def run(self) -> None:
+        attempt = 0
+        connected_at: int = 0
+        disconnected_at: int | None = None
+        while True:
+            if self._ws is not None:
+                try:
+                    await self._ws.close()
+                except Exception as e:
+                    logger.error(
+                        "Meet {} during closing ws client. Force clearing previous connection now. Error msg {}".format(
+                            e.__class__.__name__,
+                            str(e),
+                        )
+                    )
+                    self._ws = None
+                else:
+                    self._ws = None
+            try:
+                async with await self._connect() as self._ws:
+                    connected_at = monotonic_us()
+                    if disconnected_at is not None:
+                        self._stats.record(_XCOM_CONNECTION, "downtime", monotonic_us() - disconnected_at)
+                        self._stats.incr(_XCOM_CONNECTION, "reconnects")
+                        disconnected_at = None
+                    if self._debug:
+                        if self._use_unix_sock:
+                            logger.info(f"Connected to {self._unix_sock}")
+                        else:
+                            logger.info(f"Connected to {self._host}:{self._port}")
+                    if self._topics:
+                        # acknowledgements are received by `_listen`
+                        self._resubscribing = asyncio.create_task(self._resubscribe())
+                    writer = asyncio.create_task(self._write_loop()) if self._send_queue is not None else None
+                    replayer = asyncio.create_task(self._replay_loop()) if self._replay else None
+                    try:
+                        await self._listen()
+                    finally:
+                        # sends fail or go to the replay buffer from now on, the connection is closed on exit
+                        self._ws = None
+                        disconnected_at = monotonic_us()
+                        # a peer closing right after accepting must not reset the backoff
+                        if disconnected_at - connected_at >= self._reconnect_wait * 1000000:
+                            attempt = 0
+                        for task in (writer, replayer):
+                            if task is not None:
+                                task.cancel()
+            except (ConnectionRefusedError, FileNotFoundError) as e:
+                logger.error(f"Connection failed with {str(e)}.")
+            except (asyncio.CancelledError, KeyboardInterrupt) as e:
+                logger.info(f"Close gracefully.")
+                self._closing_flag = True
+                if self._ws is not None:
+                    await self._ws.close()
+                break
+            except Exception as e:
+                logger.error(
+                    "Connection failed. Error type {}. Error msg {}".format(
+                        e.__class__.__name__,
+                        str(e),
+                    )
+                )
+                if self._debug:
+                    logger.debug(traceback.format_exc())
+            finally:
+                if not self._closing_flag:
+                    wait = self._reconnect_delay(attempt)
+                    attempt += 1
+                    logger.info("Reconnect after {:.3f} second(s)".format(wait))
+                    await asyncio.sleep(wait)
@@ -0,0 +1,249 @@
+import asyncio
+import random
+import time
+from typing import Any, Iterable, Literal, Tuple
+
+from loguru import logger
+
+from .capture import XComRecorder
+from .codec import JSON_CODEC, XComCodec, XComRaw
+from .core import _XCOM_PING, XComBase, XComTCli
+from .stats import monotonic_us
+from .transport import XComTransport, XComTransportOptions
+
+XComRouting = Literal["least_outstanding", "ewma"]
+XComEndpoint = str | Tuple[str, int]
+
+
+class _XComReplica:
+    """One endpoint of `XComMultiCli` with its routing and health state"""
+
+    def __init__(self, endpoint: XComEndpoint, cli: XComTCli):
+        self.endpoint = endpoint
+        self.cli = cli
+        self.outstanding: int = 0
+        self.ewma_us: float = 0
+        self.failures: int = 0
+        self.ejected_until: float = 0
+
+    @property
+    def name(self) -> str:
+        return self.endpoint if isinstance(self.endpoint, str) else "{}:{}".format(*self.endpoint)
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class XComMultiCli(XComBase):
+    """Interprocess Communication by Websocket - Client of several replicas of the same server
+
+    Every request goes to one replica picked by `routing`, over a pool of persistent connections per replica
+    (servers must be `keep_alive=True`). Replicas are health-checked in the background with the reserved req_type
+    `__ping__`; a replica failing `eject_after` times in a row (health checks or requests) is ejected for
+    `eject_time` seconds. Idempotent requests failing on the client side, i.e. connection errors and timeouts,
+    are retried on other replicas within the same timeout.
+    """
+
+    def __init__(
+        self,
+        endpoints: Iterable[XComEndpoint],
+        req_type: str | None = None,
+        routing: XComRouting = "least_outstanding",
+        pool_size: int = 1,
+        retries: int = 1,
+        idempotent_req_types: Iterable[str] | None = None,
+        health_interval: float = 1,
+        eject_after: int = 3,
+        eject_time: float = 5,
+        ewma_alpha: float = 0.3,
+        codec: XComCodec = JSON_CODEC,
+        transport: XComTransport = "ws",
+        transport_options: XComTransportOptions | None = None,
+        recorder: XComRecorder | None = None,
+        tag: str = "",
+        verbose: bool = True,
+        debug: bool = False,
+    ) -> None:
+        """_summary_
+
+        Args:
+            endpoints (Iterable[XComEndpoint]): unix socket paths or (host, port)
+            req_type (str | None, optional): default req_type. Defaults to None.
+            routing (XComRouting, optional): "least_outstanding" picks the replica with the fewest requests in flight,
+                "ewma" the lowest moving average of latency weighted by requests in flight. Defaults to "least_outstanding".
+            pool_size (int, optional): persistent connections per replica. Defaults to 1.
+            retries (int, optional): max retries of an idempotent request on other replicas. Defaults to 1.
+            idempotent_req_types (Iterable[str] | None, optional): req_types safe to retry, see `req`. Defaults to None.
+            health_interval (float, optional): seconds between health checks, 0 to disable. Defaults to 1.
+            eject_after (int, optional): consecutive failures ejecting a replica. Defaults to 3.
+            eject_time (float, optional): seconds an ejected replica receives no requests. Defaults to 5.
+            ewma_alpha (float, optional): weight of the latest latency in the moving average. Defaults to 0.3.
+            codec (XComCodec, optional): codec of requests. Defaults to JSON codec.
+            transport (XComTransport, optional): must match the transport of the servers. Defaults to "ws".
+            transport_options (XComTransportOptions | None, optional): socket and framing settings. Defaults to None.
+            recorder (XComRecorder | None, optional): capture the frames of every replica. Defaults to None.
+            debug (bool, optional): _description_. Defaults to False.
+        """
+        super().__init__(tag, verbose, debug)
+        self._replicas: list[_XComReplica] = []
+        for endpoint in endpoints:
+            unix_sock, host, port = (endpoint, None, None) if isinstance(endpoint, str) else (None, *endpoint)
+            cli = XComTCli(
+                unix_sock=unix_sock,
+                host=host,
+                port=port,
+                pool_size=pool_size,
+                codec=codec,
+                transport=transport,
+                transport_options=transport_options,
+                recorder=recorder,
+                tag=tag,
+            )
+            self._replicas.append(_XComReplica(endpoint, cli))
+        assert self._replicas, "endpoints must not be empty!"
+        assert routing in ["least_outstanding", "ewma"]
+        self._routing: XComRouting = routing
+        assert pool_size > 0, "pool_size must be positive!"
+        assert retries >= 0, "retries must not be negative!"
+        self._retries: int = retries
+        self._idempotent_req_types: set[str] = set(idempotent_req_types or ())
+        self._health_interval: float = health_interval
+        assert eject_after > 0, "eject_after must be positive!"
+        self._eject_after: int = eject_after
+        self._eject_time: float = eject_time
+        assert 0 < ewma_alpha <= 1, "ewma_alpha must be in (0, 1]!"
+        self._ewma_alpha: float = ewma_alpha
+        self._req_type: str | None = req_type
+        self._health_task: asyncio.Task | None = None
+
+    @property
+    def replicas(self) -> list[dict[str, Any]]:
+        """Routing and health state of every replica"""
+        now = time.monotonic()
+        return [
+            {
+                "endpoint": replica.name,
+                "healthy": replica.healthy(now),
+                "outstanding": replica.outstanding,
+                "ewma_us": round(replica.ewma_us, 1),
+                "failures": replica.failures,
+            }
+            for replica in self._replicas
+        ]
+
+    def _pick(self, tried: list[_XComReplica]) -> _XComReplica | None:
+        now = time.monotonic()
+        candidates = [replica for replica in self._replicas if replica not in tried]
+        # fail open if every replica left is ejected
+        candidates = [replica for replica in candidates if replica.healthy(now)] or candidates
+        if not candidates:
+            return None
+        best = min(self._weight(replica) for replica in candidates)
+        return random.choice([replica for replica in candidates if self._weight(replica) == best])
+
+    def _weight(self, replica: _XComReplica) -> float:
+        if self._routing == "ewma":
+            return replica.ewma_us * (replica.outstanding + 1)
+        return replica.outstanding
+
+    def _on_success(self, replica: _XComReplica, latency_us: int):
+        replica.failures = 0
+        replica.ejected_until = 0
+        if replica.ewma_us == 0:
+            replica.ewma_us = latency_us
+        else:
+            replica.ewma_us += self._ewma_alpha * (latency_us - replica.ewma_us)
+
+    def _on_failure(self, replica: _XComReplica, err_msg: str | None):
+        replica.failures += 1
+        if replica.failures >= self._eject_after and replica.healthy(time.monotonic()):
+            logger.warning("Eject replica {} after {} failure(s). {}".format(replica.name, replica.failures, err_msg))
+            replica.ejected_until = time.monotonic() + self._eject_time
+
+    def _ensure_health_checks(self):
+        if self._health_interval > 0 and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.gather(*[self._health_check(replica) for replica in self._replicas])
+            await asyncio.sleep(self._health_interval)
+
+    async def _health_check(self, replica: _XComReplica):
+        _, err_msg, ts = await replica.cli.req({}, req_type=_XCOM_PING, timeout=self._health_interval)
+        if err_msg is None:
+            if not replica.healthy(time.monotonic()):
+                logger.info("Replica {} is healthy again.".format(replica.name))
+            replica.failures = 0
+            replica.ejected_until = 0
+        elif ts is None:
+            self._on_failure(replica, err_msg)
+
+    async def warm_up(self):
+        """Open the connections to every replica and start the health checks"""
+        self._ensure_health_checks()
+        await asyncio.gather(*[replica.cli.warm_up() for replica in self._replicas], return_exceptions=True)
+
+    async def close(self):
+        """Stop the health checks and close all connections"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for replica in self._replicas:
+            await replica.cli.close()
+
+    async def req(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        req_type: str | None = None,
+        timeout: float = 0.5,
+        idempotent: bool | None = None,
+    ) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]:
+        """The same as `XComTCli.req`, routed to one of the replicas
+
+        Args:
+            req_d (dict[str, Any] | XComRaw): _description_
+            req_type (str | None, optional): _description_. Defaults to None.
+            timeout (float, optional): in seconds, shared by the retries: each attempt gets an even share of the
+                time left. Defaults to 0.5.
+            idempotent (bool | None, optional): retry on another replica if the request fails on the client side.
+                Defaults to None, i.e. whether req_type is in `idempotent_req_types`.
+
+        Returns:
+            Tuple[dict[str, Any] | None, str | None]: rsp_data, error message, server ts
+        """
+        final_req_type = req_type or self._req_type
+        if not final_req_type:
+            raise ValueError("Must specify req_type!")
+        if idempotent is None:
+            idempotent = final_req_type in self._idempotent_req_types
+        self._ensure_health_checks()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        tried: list[_XComReplica] = []
+        result: Tuple[Any, Any, Any] = (None, "No replica available.", None)
+        attempts = 1 + (self._retries if idempotent else 0)
+        for attempt in range(attempts):
+            remaining = deadline - loop.time()
+            replica = self._pick(tried)
+            if replica is None or remaining <= 0:
+                break
+            tried.append(replica)
+            replica.outstanding += 1
+            start = monotonic_us()
+            try:
+                # an even share of what is left, so that a timed-out attempt leaves time to retry
+                result = await replica.cli.req(
+                    req_d, req_type=final_req_type, timeout=remaining / (attempts - attempt)
+                )
+            finally:
+                replica.outstanding -= 1
+            if result[2] is not None:
+                # the replica responded, even with an error message
+                self._on_success(replica, monotonic_us() - start)
+                return result
+            self._on_failure(replica, result[1])
+            if self._debug:
+                logger.debug("Request to replica {} failed. {}".format(replica.name, result[1]))
+        return result
@@ -0,0 +1,175 @@
+"""Replay of captured xcom traffic against a server
+
+Reads the requests of capture files written by `XComRecorder` (of servers or clients) and sends them to a running
+`XComSvr` over a pooled `XComTCli`, keeping their original spacing at `--speed` times real time, or as fast as
+`--concurrency` request loops go with `--speed 0`. Prints throughput and latency as JSON.
+
+Usage:
+    python -m xutility.xcom.replay capture.xcap --unix-sock /tmp/xcom.sock --speed 10
+    python -m xutility.xcom.replay capture.xcap.* --host 127.0.0.1 --port 9898 --speed 0 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import sys
+from typing import Any, Iterable, Tuple
+
+import orjson
+
+from ..logger import setup_logger
+from .capture import read_capture
+from .codec import XComCodec, codec_of_frame
+from .core import _XCOM_RESERVED, XComTCli, _iter_envelopes
+from .stats import XComHistogram, monotonic_us
+from .transport import XComEventLoop, XComTransport, XComTransportOptions, run_event_loop
+
+# (arrival ts in epoch microseconds, req_type, data, codec of the frame)
+XComCapturedReq = Tuple[int, str, Any, XComCodec]
+
+
+def load_requests(paths: Iterable[str], req_types: Iterable[str] | None = None) -> list[XComCapturedReq]:
+    """Captured requests of every file in arrival order, with batches unpacked. Responses, frames that cannot be
+    decoded and reserved req_types such as `__ping__` are skipped."""
+    req_types = set(req_types or ())
+    requests: list[XComCapturedReq] = []
+    for path in paths:
+        for ts, _, raw_b in read_capture(path):
+            codec = codec_of_frame(raw_b)
+            try:
+                raw_d = codec.decode(raw_b)
+            except Exception:
+                continue
+            if not isinstance(raw_d, dict):
+                continue
+            for raw_req_d in _iter_envelopes(raw_d):
+                req_type = raw_req_d.get("req_type")
+                if not req_type or req_type in _XCOM_RESERVED or (req_types and req_type not in req_types):
+                    continue
+                requests.append((ts, req_type, raw_req_d.get("data"), codec))
+    requests.sort(key=lambda req: req[0])
+    return requests
+
+
+async def replay(
+    requests: list[XComCapturedReq],
+    endpoint: dict[str, Any],
+    speed: float = 1,
+    concurrency: int = 32,
+    pool_size: int = 4,
+    timeout: float = 5,
+    transport: XComTransport = "ws",
+    transport_options: XComTransportOptions | None = None,
+) -> dict[str, Any]:
+    """Send `requests` to the server at `endpoint` ({"unix_sock"} or {"host", "port"})
+
+    Args:
+        speed (float, optional): send each request at its original offset divided by `speed`, without waiting for
+            earlier responses; 0 to send as fast as `concurrency` request loops go. Defaults to 1.
+
+    Returns:
+        dict[str, Any]: throughput, latency percentiles in microseconds, max lag behind the schedule, and the
+            latency and errors by req_type
+    """
+    assert speed >= 0, "speed must not be negative!"
+    assert concurrency > 0, "concurrency must be positive!"
+    hist = XComHistogram()
+    errors = 0
+    max_lag_us = 0
+    cli = XComTCli(
+        pool_size=pool_size,
+        codecs={req_type: codec for _, req_type, _, codec in requests},
+        transport=transport,
+        transport_options=transport_options,
+        **endpoint,
+    )
+    await cli.warm_up()
+
+    async def send(req_type: str, data: Any):
+        nonlocal errors
+        start = monotonic_us()
+        _, err_msg, _ = await cli.req(data, req_type=req_type, timeout=timeout)
+        if err_msg is None:
+            hist.record(monotonic_us() - start)
+        else:
+            errors += 1
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        if speed > 0 and requests:
+            first_ts = requests[0][0]
+            tasks = []
+            for ts, req_type, data, _ in requests:
+                delay = started + (ts - first_ts) / 1000000 / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    max_lag_us = max(max_lag_us, int(-delay * 1000000))
+                tasks.append(asyncio.create_task(send(req_type, data)))
+            await asyncio.gather(*tasks)
+        else:
+            pending = iter(requests)
+
+            async def worker():
+                for _, req_type, data, _ in pending:
+                    await send(req_type, data)
+
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+    finally:
+        await cli.close()
+    duration = loop.time() - started
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "speed": speed,
+        "duration": round(duration, 3),
+        "msgs_per_sec": round(len(requests) / duration, 1) if duration else 0,
+        "mean_us": round(hist.total / hist.count, 1) if hist.count else 0,
+        **{f"{name}_us": value for name, value in hist.percentiles((50, 99, 99.9)).items()},
+        "max_us": hist.max,
+        "max_lag_us": max_lag_us,
+        "req_types": cli.stats(),
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m xutility.xcom.replay", description=__doc__.splitlines()[0])
+    parser.add_argument("captures", nargs="+", help="capture files, merged by arrival time")
+    parser.add_argument("--unix-sock", type=str, default=None)
+    parser.add_argument("--host", type=str, default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--transport", choices=["ws", "stream", "shm"], default="ws")
+    parser.add_argument("--speed", type=float, default=1, help="times real time, 0 for max speed")
+    parser.add_argument("--concurrency", type=int, default=32, help="request loops of max speed")
+    parser.add_argument("--pool-size", type=int, default=4, help="connections to the server")
+    parser.add_argument("--timeout", type=float, default=5, help="seconds per request")
+    parser.add_argument("--req-types", type=str, default="", help="only replay these req_types, comma separated")
+    parser.add_argument("--event-loop", choices=["auto", "asyncio", "uvloop"], default="auto")
+    parser.add_argument("--output", type=str, default="", help="write the JSON report to this file, default stdout")
+    args = parser.parse_args(argv)
+    if (args.unix_sock is None) == (args.host is None or args.port is None):
+        parser.error("Specify either --unix-sock or --host and --port")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    setup_logger(echo_level="ERROR")
+    requests = load_requests(args.captures, [x for x in args.req_types.split(",") if x])
+    endpoint = {"unix_sock": args.unix_sock} if args.unix_sock else {"host": args.host, "port": args.port}
+    event_loop: XComEventLoop = args.event_loop
+    report = run_event_loop(
+        replay(requests, endpoint, args.speed, args.concurrency, args.pool_size, args.timeout, args.transport),
+        event_loop,
+    )
+    report_b = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(report_b)
+    else:
+        print(report_b.decode())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import time
+from typing import Any, Iterable
+
+
+def monotonic_us() -> int:
+    return time.perf_counter_ns() // 1000
+
+
+class XComHistogram:
+    """Latency histogram of fixed size, in microseconds
+
+    HDR-style log-linear buckets: values below 128 are exact, larger values fall into 64 buckets per power of two,
+    i.e. a relative error below 1.6%. Values up to 2**40 us (~12 days) are tracked, larger ones are clamped.
+    """
+
+    _SUB_BITS = 7
+    _SUB_COUNT = 1 << _SUB_BITS
+    _HALF_COUNT = _SUB_COUNT >> 1
+    _MAX_SHIFT = 34
+    _N_BUCKETS = _SUB_COUNT + _MAX_SHIFT * _HALF_COUNT
+
+    def __init__(self) -> None:
+        self._counts: list[int] = [0] * self._N_BUCKETS
+        self.count: int = 0
+        self.total: int = 0
+        self.max: int = 0
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        if value < cls._SUB_COUNT:
+            return value if value > 0 else 0
+        shift = min(value.bit_length() - cls._SUB_BITS, cls._MAX_SHIFT)
+        top = min(value >> shift, cls._SUB_COUNT - 1)
+        return cls._SUB_COUNT + (shift - 1) * cls._HALF_COUNT + top - cls._HALF_COUNT
+
+    @classmethod
+    def _value(cls, index: int) -> int:
+        """Highest value falling into the bucket"""
+        if index < cls._SUB_COUNT:
+            return index
+        shift, top = divmod(index - cls._SUB_COUNT, cls._HALF_COUNT)
+        return ((top + cls._HALF_COUNT + 1) << (shift + 1)) - 1
+
+    def record(self, value: int):
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "XComHistogram"):
+        for i, n in enumerate(other._counts):
+            if n:
+                self._counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self._counts = [0] * self._N_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def percentile(self, q: float) -> int:
+        """Value at the q-th percentile (0 to 100), 0 if empty"""
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for i, n in enumerate(self._counts):
+            seen += n
+            if seen >= rank:
+                return min(self._value(i), self.max)
+        return self.max
+
+    def percentiles(self, qs: Iterable[float] = (50, 90, 99, 99.9)) -> dict[str, int]:
+        """{"p50": value, "p999": value, ...} in one pass"""
+        qs = sorted(qs)
+        result: dict[str, int] = {}
+        if not qs:
+            return result
+        ranks = [max(1, -(-self.count * q // 100)) for q in qs]
+        seen, j = 0, 0
+        for i, n in enumerate(self._counts):
+            if not n:
+                continue
+            seen += n
+            while j < len(qs) and seen >= ranks[j]:
+                result[self._name(qs[j])] = min(self._value(i), self.max)
+                j += 1
+            if j == len(qs):
+                break
+        for q in qs[j:]:
+            result[self._name(q)] = 0
+        return result
+
+    @staticmethod
+    def _name(q: float) -> str:
+        return "p" + f"{q:g}".replace(".", "")
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "max": self.max,
+            **self.percentiles(),
+        }
+
+
+class XComStats:
+    """Latency histograms and counters by (req_type, name), cheap enough to be always on"""
+
+    def __init__(self) -> None:
+        self._histograms: dict[str, dict[str, XComHistogram]] = {}
+        self._counters: dict[str, dict[str, int]] = {}
+
+    def record(self, req_type: str, stage: str, value: int):
+        """Record a latency in microseconds"""
+        stages = self._histograms.get(req_type)
+        if stages is None:
+            stages = self._histograms[req_type] = {}
+        histogram = stages.get(stage)
+        if histogram is None:
+            histogram = stages[stage] = XComHistogram()
+        histogram.record(value)
+
+    def incr(self, req_type: str, counter: str, n: int = 1):
+        counters = self._counters.setdefault(req_type, {})
+        counters[counter] = counters.get(counter, 0) + n
+
+    def histogram(self, req_type: str, stage: str) -> XComHistogram | None:
+        return self._histograms.get(req_type, {}).get(stage)
+
+    def reset(self):
+        self._histograms = {}
+        self._counters = {}
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        """{req_type: {stage: {"count", "mean", "max", "p50", "p90", "p99", "p999"}, counter: int}}, in microseconds"""
+        summary: dict[str, dict[str, Any]] = {}
+        for req_type, stages in self._histograms.items():
+            summary[req_type] = {stage: histogram.summary() for stage, histogram in stages.items()}
+        for req_type, counters in self._counters.items():
+            summary.setdefault(req_type, {}).update(counters)
+        return summary
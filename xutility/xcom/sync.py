@@ -0,0 +1,169 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Tuple, TypeVar
+
+from loguru import logger
+
+from .capture import XComRecorder
+from .codec import JSON_CODEC, XComCodec, XComRaw
+from .core import XComBase, XComTCli
+from .transport import XComTransport, XComTransportOptions, new_event_loop
+
+_T = TypeVar("_T")
+
+
+class XComSyncCli(XComBase):
+    """Interprocess Communication by Websocket - Synchronous Client
+
+    Blocking facade of a pooled `XComTCli` running in an event loop of its own, on a background thread, for
+    synchronous code such as worker threads of a data pipeline. Every method is safe to call from many threads at
+    once; requests of all threads share the `pool_size` persistent connections (server must be `keep_alive=True`).
+    Must not be called from the thread of its own loop, e.g. from a callback scheduled on it.
+    """
+
+    def __init__(
+        self,
+        unix_sock: str | None = None,
+        host: str | None = None,
+        port: int | None = None,
+        req_type: str | None = None,
+        pool_size: int = 4,
+        batch_size: int = 0,
+        batch_window: float = 0.001,
+        codec: XComCodec = JSON_CODEC,
+        codecs: dict[str, XComCodec] | None = None,
+        transport: XComTransport = "ws",
+        transport_options: XComTransportOptions | None = None,
+        recorder: XComRecorder | None = None,
+        tag: str = "",
+        verbose: bool = True,
+        debug: bool = False,
+    ) -> None:
+        """_summary_
+
+        Args:
+            req_type (str | None, optional): default req_type. Defaults to None.
+            pool_size (int, optional): number of persistent connections. Defaults to 4.
+            transport_options (XComTransportOptions | None, optional): also picks the loop of the background thread,
+                see `XComTransportOptions.event_loop`. Defaults to None.
+
+            The other arguments are the same as of `XComTCli`.
+        """
+        super().__init__(tag, verbose, debug)
+        assert pool_size > 0, "pool_size must be positive!"
+        self._cli = XComTCli(
+            unix_sock=unix_sock,
+            host=host,
+            port=port,
+            req_type=req_type,
+            pool_size=pool_size,
+            batch_size=batch_size,
+            batch_window=batch_window,
+            codec=codec,
+            codecs=codecs,
+            transport=transport,
+            transport_options=transport_options,
+            recorder=recorder,
+            tag=tag,
+            verbose=verbose,
+            debug=debug,
+        )
+        self._loop = new_event_loop((transport_options or XComTransportOptions()).event_loop)
+        self._thread = threading.Thread(target=self._run_loop, name=self._identifier, daemon=True)
+        self._thread.start()
+        self._closed: bool = False
+        self._close_lock = threading.Lock()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _submit(self, coro: Coroutine[Any, Any, _T]) -> concurrent.futures.Future[_T]:
+        if self._closed:
+            coro.close()
+            raise RuntimeError(f"{self._identifier} is closed")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _wait(self, fut: concurrent.futures.Future[_T]) -> _T:
+        if threading.current_thread() is self._thread:
+            fut.cancel()
+            raise RuntimeError("Blocking call from the event loop of the client would dead-lock")
+        return fut.result()
+
+    def req_future(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        req_type: str | None = None,
+        timeout: float = 0.5,
+    ) -> concurrent.futures.Future[
+        Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]
+    ]:
+        """Future of the result of `req`, without blocking the calling thread"""
+        return self._submit(self._cli.req(req_d, req_type=req_type, timeout=timeout))
+
+    def req(
+        self,
+        req_d: dict[str, Any] | XComRaw,
+        req_type: str | None = None,
+        timeout: float = 0.5,
+    ) -> Tuple[dict[str, Any], None, float] | Tuple[None, str, float] | Tuple[None, str | None, None]:
+        """The same as `XComTCli.req`, blocking the calling thread
+
+        Returns:
+            Tuple[dict[str, Any] | None, str | None]: rsp_data, error message, server ts
+        """
+        return self._wait(self.req_future(req_d, req_type=req_type, timeout=timeout))
+
+    def send_future(
+        self, req_d: dict[str, Any] | XComRaw, req_type: str | None = None, timeout: float = 1
+    ) -> concurrent.futures.Future[str | None]:
+        """Future of the result of `send`, without blocking the calling thread"""
+        return self._submit(self._cli.send(req_d, req_type=req_type, timeout=timeout))
+
+    def send(self, req_d: dict[str, Any] | XComRaw, req_type: str | None = None, timeout: float = 1) -> str | None:
+        """The same as `XComTCli.send`, blocking the calling thread until the request is sent
+
+        Returns:
+            str | None: error message, None if sent
+        """
+        return self._wait(self.send_future(req_d, req_type=req_type, timeout=timeout))
+
+    def warm_up(self):
+        """Open all pooled connections in advance"""
+        self._wait(self._submit(self._cli.warm_up()))
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """See `XComTCli.stats`"""
+
+        async def stats() -> dict[str, dict[str, Any]]:
+            return self._cli.stats()
+
+        return self._wait(self._submit(stats()))
+
+    def close(self):
+        """Close the connections and stop the background thread, requests in flight are cancelled"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        except Exception as e:
+            logger.debug("Meet {} during closing. Error msg {}".format(e.__class__.__name__, str(e)))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _shutdown(self):
+        await self._cli.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __enter__(self) -> "XComSyncCli":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
@@ -0,0 +1,677 @@
+import asyncio
+import collections
+import errno
+import ipaddress
+import os
+import re
+import secrets
+import socket
+import stat
+import struct
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Coroutine, Literal, Tuple, TypeVar
+
+import orjson
+import websockets
+from loguru import logger
+
+XComTransport = Literal["ws", "stream", "shm", "local"]
+XCOM_TRANSPORTS = ("ws", "stream", "shm", "local")
+XComEventLoop = Literal["auto", "asyncio", "uvloop"]
+SHM_RING_SIZE = 4 * 1024 * 1024
+
+_T = TypeVar("_T")
+
+
+class XComTransportOptions:
+    """Socket, framing and event loop settings of the connections of a server or client
+
+    Args:
+        tcp_nodelay (bool, optional): disable Nagle's algorithm on TCP connections, so that small frames are sent
+            right away. Defaults to True.
+        send_buffer (int, optional): kernel send buffer size (SO_SNDBUF) in bytes, 0 for the system default.
+            Defaults to 0.
+        recv_buffer (int, optional): kernel receive buffer size (SO_RCVBUF) in bytes, 0 for the system default.
+            Defaults to 0.
+        max_size (int | None, optional): max size of a received frame in bytes, beyond which the connection is
+            closed, None for unlimited. Defaults to 2**24.
+        write_limit (int, optional): bytes buffered for writing before a send waits for the socket to drain.
+            Defaults to 2**15.
+        compression (str | None, optional): "deflate" for per-message compression of websockets, None to disable,
+            which saves CPU and latency on local links. Defaults to None.
+        ping_interval (float | None, optional): seconds between keepalive pings of websockets, None to disable.
+            Defaults to 20.
+        ping_timeout (float | None, optional): seconds to wait for a pong before closing the connection, None to
+            disable. Defaults to 20.
+        shm_ring_size (int, optional): bytes of each shared-memory ring of the "shm" transport, set by the client.
+            Defaults to 4 MiB.
+        serialize (bool, optional): encode the envelopes of the "local" transport with the codecs like the other
+            transports; False passes the envelope objects as they are, sharing the request and response data between
+            server and client instead of copying it. Defaults to True.
+        local_queue (int, optional): max frames queued per direction of a "local" connection. Defaults to 1024.
+        event_loop (XComEventLoop, optional): event loop of `XComSvr.serve_forever` and of forked workers: "uvloop"
+            if installed for "auto", else asyncio. Defaults to "auto".
+    """
+
+    def __init__(
+        self,
+        tcp_nodelay: bool = True,
+        send_buffer: int = 0,
+        recv_buffer: int = 0,
+        max_size: int | None = 2**24,
+        write_limit: int = 2**15,
+        compression: str | None = None,
+        ping_interval: float | None = 20,
+        ping_timeout: float | None = 20,
+        shm_ring_size: int = SHM_RING_SIZE,
+        serialize: bool = True,
+        local_queue: int = 1024,
+        event_loop: XComEventLoop = "auto",
+    ):
+        assert send_buffer >= 0, "send_buffer must not be negative!"
+        assert recv_buffer >= 0, "recv_buffer must not be negative!"
+        assert max_size is None or max_size > 0, "max_size must be positive!"
+        assert write_limit > 0, "write_limit must be positive!"
+        assert compression in [None, "deflate"]
+        assert shm_ring_size > 0, "shm_ring_size must be positive!"
+        assert local_queue > 0, "local_queue must be positive!"
+        assert event_loop in ["auto", "asyncio", "uvloop"]
+        self.tcp_nodelay = tcp_nodelay
+        self.send_buffer = send_buffer
+        self.recv_buffer = recv_buffer
+        self.max_size = max_size
+        self.write_limit = write_limit
+        self.compression = compression
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.shm_ring_size = shm_ring_size
+        self.serialize = serialize
+        self.local_queue = local_queue
+        self.event_loop = event_loop
+
+    def ws_kwargs(self) -> dict[str, Any]:
+        """Keyword arguments of `websockets.serve` / `websockets.connect`"""
+        return {
+            "max_size": self.max_size,
+            "write_limit": self.write_limit,
+            "compression": self.compression,
+            "ping_interval": self.ping_interval,
+            "ping_timeout": self.ping_timeout,
+        }
+
+    def apply(self, transport: asyncio.BaseTransport):
+        """Set the socket options of a connection and the write buffer limit of its transport"""
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            if sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+            if self.send_buffer:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+            if self.recv_buffer:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+        if isinstance(transport, asyncio.WriteTransport):
+            transport.set_write_buffer_limits(high=self.write_limit)
+
+
+DEFAULT_TRANSPORT_OPTIONS = XComTransportOptions()
+
+
+def new_event_loop(event_loop: XComEventLoop = "auto") -> asyncio.AbstractEventLoop:
+    """A new uvloop loop if it is installed ("auto") or required ("uvloop"), otherwise of asyncio"""
+    if event_loop != "asyncio":
+        try:
+            import uvloop  # type: ignore[import-not-found]
+        except ImportError:
+            if event_loop == "uvloop":
+                raise
+        else:
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run_event_loop(main: Coroutine[Any, Any, _T], event_loop: XComEventLoop = "auto") -> _T:
+    """`asyncio.run` on the loop of `new_event_loop`"""
+    with asyncio.Runner(loop_factory=lambda: new_event_loop(event_loop)) as runner:
+        return runner.run(main)
+
+
+class XComConnectionClosed(ConnectionError):
+    """Raised by `recv()`/`send()` of a non-websocket connection once it is closed"""
+
+
+class XComStreamConnection:
+    """Length-prefixed frames over an asyncio stream, with the subset of the websockets connection API used by xcom
+
+    Frame layout: payload length (uint32, big endian) | payload
+    """
+
+    _HEADER = struct.Struct("!I")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_size: int | None = 2**24):
+        self._reader = reader
+        self._writer = writer
+        self._max_size = max_size
+        self._unread: bytes | None = None
+
+    @property
+    def transport(self) -> asyncio.BaseTransport:
+        return self._writer.transport
+
+    def unread(self, raw_b: bytes):
+        """Push back one frame to be returned by the next `recv()`"""
+        self._unread = raw_b
+
+    async def send(self, raw_b: bytes | str):
+        if isinstance(raw_b, str):
+            raw_b = raw_b.encode()
+        if self._writer.is_closing():
+            raise XComConnectionClosed("Connection is closed.")
+        self._writer.writelines((self._HEADER.pack(len(raw_b)), raw_b))
+        try:
+            await self._writer.drain()
+        except ConnectionError as e:
+            raise XComConnectionClosed(str(e)) from e
+
+    async def recv(self, decode: bool | None = None) -> bytes:
+        """`decode` is accepted for compatibility with websockets, frames are always returned as bytes"""
+        if self._unread is not None:
+            raw_b, self._unread = self._unread, None
+            return raw_b
+        try:
+            (size,) = self._HEADER.unpack(await self._reader.readexactly(self._HEADER.size))
+            if self._max_size is not None and size > self._max_size:
+                self._writer.close()
+                raise XComConnectionClosed(f"Frame of {size} bytes exceeds max_size={self._max_size}.")
+            return await self._reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise XComConnectionClosed("Connection closed by peer.") from e
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def __aenter__(self) -> "XComStreamConnection":
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        await self.close()
+
+
+class _ShmRing:
+    """Single-producer single-consumer ring buffer of length-prefixed frames in shared memory
+
+    Layout: head (uint64, total bytes written) | tail (uint64, total bytes read) | padding | data
+    """
+
+    _COUNTER = struct.Struct("<Q")
+    _LENGTH = struct.Struct("<I")
+    _DATA_OFFSET = 64
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self._shm = shm
+        if shm.buf is None:
+            raise XComConnectionClosed(f"Shared memory {shm.name} is closed.")
+        self._buf: memoryview = shm.buf
+        self._capacity: int = len(shm.buf) - self._DATA_OFFSET
+        self._closed: bool = False
+
+    # segments created by this process, which the resource tracker of this process is responsible for
+    _created: set[str] = set()
+
+    @classmethod
+    def create(cls, size: int) -> "_ShmRing":
+        shm = shared_memory.SharedMemory(
+            name=f"xcom_{secrets.token_hex(8)}", create=True, size=size + cls._DATA_OFFSET
+        )
+        cls._created.add(shm.name)
+        ring = cls(shm)
+        ring._buf[: cls._DATA_OFFSET] = bytes(cls._DATA_OFFSET)
+        return ring
+
+    @classmethod
+    def attach(cls, name: str) -> "_ShmRing":
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            if name not in cls._created:
+                # the creator owns the segment, do not let the resource tracker of this process unlink it
+                resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+        return cls(shm)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def fits(self, size: int) -> bool:
+        return self._LENGTH.size + size <= self._capacity
+
+    def _copy_in(self, pos: int, raw_b: bytes | memoryview):
+        start = pos % self._capacity
+        first = min(len(raw_b), self._capacity - start)
+        self._buf[self._DATA_OFFSET + start : self._DATA_OFFSET + start + first] = raw_b[:first]
+        if first < len(raw_b):
+            self._buf[self._DATA_OFFSET : self._DATA_OFFSET + len(raw_b) - first] = raw_b[first:]
+
+    def _copy_out(self, pos: int, size: int) -> bytes:
+        start = pos % self._capacity
+        first = min(size, self._capacity - start)
+        raw_b = bytes(self._buf[self._DATA_OFFSET + start : self._DATA_OFFSET + start + first])
+        if first < size:
+            raw_b += bytes(self._buf[self._DATA_OFFSET : self._DATA_OFFSET + size - first])
+        return raw_b
+
+    def write(self, raw_b: bytes) -> bool:
+        """Returns False if there is not enough free space"""
+        (head,) = self._COUNTER.unpack_from(self._buf, 0)
+        (tail,) = self._COUNTER.unpack_from(self._buf, 8)
+        if self._capacity - (head - tail) < self._LENGTH.size + len(raw_b):
+            return False
+        self._copy_in(head, self._LENGTH.pack(len(raw_b)))
+        self._copy_in(head + self._LENGTH.size, raw_b)
+        # publish the frame only after it is completely written
+        self._COUNTER.pack_into(self._buf, 0, head + self._LENGTH.size + len(raw_b))
+        return True
+
+    def read(self) -> bytes | None:
+        (head,) = self._COUNTER.unpack_from(self._buf, 0)
+        (tail,) = self._COUNTER.unpack_from(self._buf, 8)
+        if head == tail:
+            return None
+        (size,) = self._LENGTH.unpack(self._copy_out(tail, self._LENGTH.size))
+        raw_b = self._copy_out(tail + self._LENGTH.size, size)
+        self._COUNTER.pack_into(self._buf, 8, tail + self._LENGTH.size + size)
+        return raw_b
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self, unlink: bool = False):
+        if self._closed:
+            return
+        self._closed = True
+        self._buf.release()
+        self._shm.close()
+        if unlink:
+            self._created.discard(self._shm.name)
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class XComShmConnection(XComStreamConnection):
+    """Frames through a pair of shared-memory ring buffers, the socket only carries a doorbell per frame
+
+    A frame that is larger than the ring, or does not fit while the peer lags behind, is sent inline through the
+    socket instead. Frames keep their order either way.
+    """
+
+    _DOORBELL = 0xFFFFFFFF
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        send_ring: _ShmRing,
+        recv_ring: _ShmRing,
+        owner: bool,
+        max_size: int | None = 2**24,
+    ):
+        super().__init__(reader, writer, max_size)
+        self._send_ring = send_ring
+        self._recv_ring = recv_ring
+        self._owner = owner
+
+    async def send(self, raw_b: bytes | str):
+        if isinstance(raw_b, str):
+            raw_b = raw_b.encode()
+        if self._writer.is_closing() or self._send_ring.closed:
+            raise XComConnectionClosed("Connection is closed.")
+        if self._send_ring.fits(len(raw_b)) and self._send_ring.write(raw_b):
+            self._writer.write(self._HEADER.pack(self._DOORBELL))
+        else:
+            self._writer.writelines((self._HEADER.pack(len(raw_b)), raw_b))
+        try:
+            await self._writer.drain()
+        except ConnectionError as e:
+            raise XComConnectionClosed(str(e)) from e
+
+    async def recv(self, decode: bool | None = None) -> bytes:
+        try:
+            (size,) = self._HEADER.unpack(await self._reader.readexactly(self._HEADER.size))
+            raw_b = None
+            if size == self._DOORBELL:
+                if self._recv_ring.closed:
+                    raise XComConnectionClosed("Connection is closed.")
+                raw_b = self._recv_ring.read()
+                if raw_b is None:
+                    raise XComConnectionClosed("Doorbell rang on an empty ring.")
+                size = len(raw_b)
+            # ring frames count against the limit as well
+            if self._max_size is not None and size > self._max_size:
+                self._writer.close()
+                raise XComConnectionClosed(f"Frame of {size} bytes exceeds max_size={self._max_size}.")
+            if raw_b is not None:
+                return raw_b
+            return await self._reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise XComConnectionClosed("Connection closed by peer.") from e
+
+    async def close(self):
+        self._writer.close()
+        # release the rings first, closing the socket below may be cancelled
+        for ring in (self._send_ring, self._recv_ring):
+            ring.close(unlink=self._owner)
+        await super().close()
+
+
+_SHM_HELLO = "__xcom_shm__"
+# names of the segments created by `_ShmRing.create`
+_SHM_NAME = re.compile(r"^xcom_[0-9a-f]{16}$")
+
+
+def _is_loopback_peer(writer: asyncio.StreamWriter) -> bool:
+    """Whether a TCP connection goes to a loopback address, by the resolved address of the peer"""
+    peername = writer.get_extra_info("peername")
+    try:
+        return ipaddress.ip_address(peername[0]).is_loopback
+    except (TypeError, IndexError, ValueError):
+        return False
+
+
+async def _shm_client_handshake(conn: XComStreamConnection, ring_size: int) -> XComStreamConnection:
+    """Offer a pair of rings to the server, keep the plain stream connection if it is declined"""
+    c2s, s2c = _ShmRing.create(ring_size), _ShmRing.create(ring_size)
+    try:
+        await conn.send(orjson.dumps({_SHM_HELLO: [c2s.name, s2c.name]}))
+        accepted = orjson.loads(await conn.recv()).get(_SHM_HELLO, False)
+    except BaseException:
+        c2s.close(unlink=True)
+        s2c.close(unlink=True)
+        raise
+    if not accepted:
+        logger.warning("Shared memory declined by server, fall back to stream transport.")
+        c2s.close(unlink=True)
+        s2c.close(unlink=True)
+        return conn
+    return XComShmConnection(
+        conn._reader, conn._writer, send_ring=c2s, recv_ring=s2c, owner=True, max_size=conn._max_size
+    )
+
+
+async def _shm_server_handshake(conn: XComStreamConnection, local: bool) -> XComStreamConnection:
+    """Accept a pair of rings offered by the client in its first frame, or serve it as plain stream
+
+    Args:
+        local (bool): the client is on a Unix socket or a loopback address, rings offered by any other client are
+            declined
+    """
+    try:
+        raw_b = await conn.recv()
+    except XComConnectionClosed:
+        return conn
+    if not raw_b.startswith(b'{"' + _SHM_HELLO.encode()):
+        conn.unread(raw_b)
+        return conn
+    names = orjson.loads(raw_b)[_SHM_HELLO]
+    # only attach rings as created by `_ShmRing.create`, never an arbitrary segment of this user
+    if not local or not (
+        isinstance(names, list) and len(names) == 2 and all(isinstance(n, str) and _SHM_NAME.match(n) for n in names)
+    ):
+        logger.warning(
+            "Decline shared memory {} offered by {}.".format(names, conn._writer.get_extra_info("peername"))
+        )
+        await conn.send(orjson.dumps({_SHM_HELLO: False}))
+        return conn
+    c2s_name, s2c_name = names
+    try:
+        c2s = _ShmRing.attach(c2s_name)
+        s2c = _ShmRing.attach(s2c_name)
+    except Exception as e:
+        logger.warning("Failed to attach shared memory. Error type {}. Error msg {}".format(e.__class__.__name__, e))
+        await conn.send(orjson.dumps({_SHM_HELLO: False}))
+        return conn
+    await conn.send(orjson.dumps({_SHM_HELLO: True}))
+    return XComShmConnection(
+        conn._reader, conn._writer, send_ring=s2c, recv_ring=c2s, owner=False, max_size=conn._max_size
+    )
+
+
+class _XComLocalChannel:
+    """Bounded FIFO of frames from one end of a local connection to the other, with a single reader"""
+
+    def __init__(self, max_size: int):
+        self._frames: collections.deque[Any] = collections.deque()
+        self._max_size = max_size
+        self._getter: asyncio.Future | None = None
+        self._putters: collections.deque[asyncio.Future] = collections.deque()
+        self.closed: bool = False
+
+    async def put(self, frame: Any):
+        while len(self._frames) >= self._max_size and not self.closed:
+            fut = asyncio.get_running_loop().create_future()
+            self._putters.append(fut)
+            await fut
+        if self.closed:
+            raise XComConnectionClosed("Connection is closed.")
+        self._frames.append(frame)
+        if self._getter is not None and not self._getter.done():
+            self._getter.set_result(None)
+
+    async def get(self) -> Any:
+        while not self._frames:
+            if self.closed:
+                raise XComConnectionClosed("Connection closed by peer.")
+            self._getter = asyncio.get_running_loop().create_future()
+            try:
+                await self._getter
+            finally:
+                self._getter = None
+        frame = self._frames.popleft()
+        while self._putters:
+            fut = self._putters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                break
+        return frame
+
+    def close(self):
+        """Frames already queued are still delivered to the reader"""
+        self.closed = True
+        for fut in (self._getter, *self._putters):
+            if fut is not None and not fut.done():
+                fut.set_result(None)
+        self._putters.clear()
+
+
+class XComLocalConnection:
+    """One end of an in-process connection, frames are passed through a pair of queues without any socket"""
+
+    def __init__(self, recv_channel: _XComLocalChannel, send_channel: _XComLocalChannel):
+        self._recv_channel = recv_channel
+        self._send_channel = send_channel
+
+    @classmethod
+    def pair(cls, max_size: int) -> "Tuple[XComLocalConnection, XComLocalConnection]":
+        c2s, s2c = _XComLocalChannel(max_size), _XComLocalChannel(max_size)
+        return cls(s2c, c2s), cls(c2s, s2c)
+
+    async def send(self, raw_b: Any):
+        if self._recv_channel.closed:
+            raise XComConnectionClosed("Connection is closed.")
+        await self._send_channel.put(raw_b)
+
+    async def recv(self, decode: bool | None = None) -> Any:
+        """`decode` is accepted for compatibility with websockets, frames are returned as sent"""
+        return await self._recv_channel.get()
+
+    async def close(self):
+        self._send_channel.close()
+        self._recv_channel.close()
+
+    async def __aenter__(self) -> "XComLocalConnection":
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        await self.close()
+
+
+# in-process servers of the "local" transport by name
+_LOCAL_SERVERS: dict[str, "_XComLocalServer"] = dict()
+
+
+class _XComLocalServer:
+    """In-process endpoint of the "local" transport, registered by name while open"""
+
+    def __init__(
+        self, name: str, handler: Callable[[Any], Coroutine[Any, Any, None]], options: "XComTransportOptions"
+    ):
+        if name in _LOCAL_SERVERS:
+            raise OSError(errno.EADDRINUSE, f"Local server {name} already exists")
+        self._name = name
+        self._handler = handler
+        self._options = options
+        self._loop = asyncio.get_running_loop()
+        self._conns: set[XComLocalConnection] = set()
+        self._tasks: set[asyncio.Task] = set()
+        _LOCAL_SERVERS[name] = self
+
+    def connect(self) -> XComLocalConnection:
+        if asyncio.get_running_loop() is not self._loop:
+            raise ConnectionRefusedError(f"Local server {self._name} runs in another event loop")
+        client_conn, server_conn = XComLocalConnection.pair(self._options.local_queue)
+        self._conns.add(server_conn)
+        task = asyncio.create_task(self._handle(server_conn))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return client_conn
+
+    async def _handle(self, conn: XComLocalConnection):
+        try:
+            await self._handler(conn)
+        finally:
+            self._conns.discard(conn)
+            await conn.close()
+
+    async def close(self):
+        if _LOCAL_SERVERS.get(self._name) is self:
+            del _LOCAL_SERVERS[self._name]
+        for conn in list(self._conns):
+            await conn.close()
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def __aenter__(self) -> "_XComLocalServer":
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        await self.close()
+
+
+XComConnection = websockets.ClientConnection | websockets.ServerConnection | XComStreamConnection | XComLocalConnection
+
+
+async def open_connection(
+    transport: XComTransport,
+    unix_sock: str | None,
+    host: str | None,
+    port: int | None,
+    options: XComTransportOptions = DEFAULT_TRANSPORT_OPTIONS,
+) -> XComConnection:
+    if transport == "ws":
+        if unix_sock is not None:
+            ws = await websockets.unix_connect(unix_sock, **options.ws_kwargs())
+        else:
+            ws = await websockets.connect("ws://{}:{}".format(host, port), **options.ws_kwargs())
+        options.apply(ws.transport)
+        return ws
+    elif transport in ["stream", "shm"]:
+        if unix_sock is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_sock)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        options.apply(writer.transport)
+        conn = XComStreamConnection(reader, writer, options.max_size)
+        if transport == "shm" and (unix_sock is not None or _is_loopback_peer(writer)):
+            return await _shm_client_handshake(conn, options.shm_ring_size)
+        return conn
+    elif transport == "local":
+        server = _LOCAL_SERVERS.get(unix_sock)  # type: ignore[arg-type]
+        if server is None:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, f"No local server {unix_sock}")
+        return server.connect()
+    else:
+        raise ValueError(f"Unsupported transport {transport}")
+
+
+def bind_unix_socket(unix_sock: str) -> socket.socket:
+    """A listening Unix socket to be shared by forked worker processes"""
+    if os.path.exists(unix_sock) and stat.S_ISSOCK(os.stat(unix_sock).st_mode):
+        os.remove(unix_sock)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(unix_sock)
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    return sock
+
+
+async def start_server(
+    transport: XComTransport,
+    handler: Callable[[Any], Coroutine[Any, Any, None]],
+    unix_sock: str | None,
+    host: str | None,
+    port: int | None,
+    sock: socket.socket | None = None,
+    reuse_port: bool = False,
+    options: XComTransportOptions = DEFAULT_TRANSPORT_OPTIONS,
+) -> Any:
+    """Returns a started server, to be used as an async context manager
+
+    Args:
+        sock (socket.socket | None, optional): an already listening Unix socket, instead of `unix_sock`. Defaults to None.
+        reuse_port (bool, optional): let several processes listen to the same TCP port. Defaults to False.
+        options (XComTransportOptions, optional): settings of the accepted connections. Defaults to the defaults.
+    """
+    if transport == "ws":
+
+        async def ws_handler(ws: websockets.ServerConnection):
+            options.apply(ws.transport)
+            await handler(ws)
+
+        if sock is not None:
+            return await websockets.unix_serve(ws_handler, sock=sock, **options.ws_kwargs())
+        elif unix_sock is not None:
+            return await websockets.unix_serve(ws_handler, unix_sock, **options.ws_kwargs())
+        else:
+            return await websockets.serve(ws_handler, host, port, reuse_port=reuse_port, **options.ws_kwargs())
+    elif transport in ["stream", "shm"]:
+
+        async def stream_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            options.apply(writer.transport)
+            conn = XComStreamConnection(reader, writer, options.max_size)
+            try:
+                if transport == "shm":
+                    peer_sock = writer.get_extra_info("socket")
+                    local = (peer_sock is not None and peer_sock.family == socket.AF_UNIX) or _is_loopback_peer(writer)
+                    conn = await _shm_server_handshake(conn, local)
+                await handler(conn)
+            finally:
+                await conn.close()
+
+        if sock is not None:
+            return await asyncio.start_unix_server(stream_handler, sock=sock)
+        elif unix_sock is not None:
+            return await asyncio.start_unix_server(stream_handler, unix_sock)
+        else:
+            return await asyncio.start_server(stream_handler, host, port, reuse_port=reuse_port)
+    elif transport == "local":
+        assert unix_sock is not None, "local transport requires a name as unix_sock!"
+        return _XComLocalServer(unix_sock, handler, options)
+    else:
+        raise ValueError(f"Unsupported transport {transport}")